@@ -628,7 +628,7 @@ process MergeSampleCallsVCFs {
 
     script:
     """
-    python3 $workflow.projectDir/scripts/Nk_mergeVCF.py ${workflow.manifest.version} ${params.path_gatk} ${params.path_vt} ${params.path_vcfvalidator} ${pathVCFraw} ${pathFasta} ${params.min_cov} ${sample} ${vcf}
+    python3 $workflow.projectDir/scripts/Nk_mergeVCF.py ${workflow.manifest.version} ${params.path_gatk} ${params.path_vt} ${params.path_vcfvalidator} ${pathVCFraw} ${pathFasta} ${params.min_cov} ${sample} --cpus=${task.cpus} ${vcf}
     """
 }
 
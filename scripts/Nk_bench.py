@@ -0,0 +1,287 @@
+#=====================================================
+# -*- coding: utf-8 -*-                              |
+# title           : Nk_bench.py                      |
+# description     : NiourK-db ingest & query bench   |
+# author          : dooguypapua                      |
+# copyright       : CHU Angers                       |
+# date            : 20201026                         |
+# version         : 0.1                              |
+# python_version  : 3.8.2                            |
+#==================================================================
+# USAGE: Nk_bench.py [key=value] ... [key=value]
+#   runs=2          Number of synthetic sequencing runs
+#   samples=4       Number of samples per run
+#   regions=500     Number of target regions (depth BED size)
+#   variants=1000   Number of VCF variants per sample
+#   nkvariants=100  Number of Nk_sample (chrM) variants per sample
+#   queries=20      Number of single get-variant queries
+#   chunk=25000     Nk_db bulk batch size
+#   mongod=mongod   mongod binary (a throwaway instance is started)
+#   port=27119      Throwaway mongod port
+#   seed=1          Random seed
+#   keep=0          Keep synthetic files & database (1)
+#   out=            Output JSON file (default: stdout)
+# OUT  : Errors or JSON metrics
+#==================================================================
+import sys
+import os
+import json
+import time
+import random
+import shutil
+import socket
+import tempfile
+import subprocess
+import pymongo
+from Nk_mongo import dicoChrSize
+
+
+dicoBench = { "runs":2, "samples":4, "regions":500, "variants":1000, "nkvariants":100, "queries":20, "chunk":25000, \
+              "mongod":"mongod", "port":27119, "seed":1, "keep":0, "out":"" }
+lstChrom = ["chr"+str(i) for i in range(1,23)]
+lstCaller = ["gatkHC","tvc"]
+lstNkCaller = ["GATKu","LoFreq","platypus","SNVer","TSVC","VarScan"]
+pathNkDb = os.path.join(os.path.dirname(os.path.abspath(__file__)),"Nk_db.py")
+
+
+
+#***** ARGUMENTS *****#
+lstErrors = []
+for i in range(1,len(sys.argv),1):
+    if not "=" in sys.argv[i]: lstErrors.append("Invalid input argument `"+sys.argv[i]+"`")
+    else:
+        key,value = sys.argv[i].split("=",1)
+        if not key in dicoBench: lstErrors.append("Unknown argument `"+key+"`")
+        elif type(dicoBench[key])==int:
+            try: dicoBench[key] = int(value)
+            except: lstErrors.append("Bad integer value for `"+key+"`")
+        else: dicoBench[key] = value
+if shutil.which(dicoBench["mongod"])==None: lstErrors.append("mongod binary not found `"+dicoBench["mongod"]+"`")
+if len(lstErrors)>0: exit("USAGE : python Nk_bench.py [key=value] ... [key=value]\n"+"\n".join(lstErrors))
+random.seed(dicoBench["seed"])
+
+
+
+#---------------------------------------------------------------#
+#---------------------------------------------------------------#
+#                        SYNTHETIC DATA                         #
+#---------------------------------------------------------------#
+#---------------------------------------------------------------#
+
+#***** Target regions *****#
+# Sorted [(chrom,start,end)] (0-based, half-open)
+def makeRegions(nbRegion):
+    lstRegion = []
+    for i in range(nbRegion):
+        chrom = random.choice(lstChrom)
+        start = random.randint(1000000,40000000)
+        lstRegion.append((chrom,start,start+random.randint(150,1500)))
+    lstRegion.sort(key=lambda region: (lstChrom.index(region[0]),region[1]))
+    # Remove overlaps
+    lstMerged = []
+    for region in lstRegion:
+        if lstMerged and lstMerged[-1][0]==region[0] and region[1]<=lstMerged[-1][2]: continue
+        lstMerged.append(region)
+    return lstMerged
+
+#***** Run parameter file (IonTorrent format, see loadTorrentJson) *****#
+def writeRunJson(pathJson,runId,lstSample):
+    dicoBarcode = {}
+    for i in range(len(lstSample)): dicoBarcode[lstSample[i]] = {"barcodes":["IonXpress_"+str(i+1).zfill(3)]}
+    dicoRun = { "runid":runId, "expName":"bench_"+runId, "chiptype":"540", "project":"BENCH", "resultsName":"Auto_bench_"+runId, \
+                "exp_json":{ "date":"2020-10-26T00:00", "pgmName":"S5", "sequencekitname":"bench", "repResult":1 }, \
+                "experimentAnalysisSettings":{ "experiment":runId, "status":"run", "libraryKitName":"bench", "date":"2020-10-26T00:00", \
+                                               "reference":"hg38", "targetRegionBedFile":"/bench/targets.bed", "barcodedSamples":dicoBarcode } }
+    JSON = open(pathJson,'w')
+    json.dump(dicoRun,JSON)
+    JSON.close()
+
+#***** Depth BED (mosdepth per-base format) *****#
+# Return (number of lines, { (chrom,pos): depth }) with 1-based positions
+def writeDepthBed(pathBed,lstRegion):
+    dicoDepth = {}
+    nbLine = 0
+    BED = open(pathBed,'w')
+    for chrom,start,end in lstRegion:
+        pos = start
+        while pos<end:
+            runEnd = min(end,pos+random.randint(1,40))
+            depth = random.randint(0,400)
+            BED.write(chrom+"\t"+str(pos)+"\t"+str(runEnd)+"\t"+str(depth)+"\n")
+            for pos0 in range(pos,runEnd): dicoDepth[(chrom,pos0+1)] = depth
+            nbLine+=1
+            pos = runEnd
+    BED.close()
+    return nbLine,dicoDepth
+
+#***** Variant pool *****#
+# Shared sites so that samples carry common variants
+def makeVariantPool(lstRegion,nbVariant):
+    setVar = set()
+    while len(setVar)<nbVariant:
+        chrom,start,end = random.choice(lstRegion)
+        ref = random.choice("ACGT")
+        setVar.add((chrom,random.randint(start+1,end),ref,random.choice([base for base in "ACGT" if base!=ref])))
+    return sorted(setVar,key=lambda var: (lstChrom.index(var[0]),var[1]))
+
+#***** Merged Nk VCF *****#
+def writeNkVcf(pathVcf,sample,lstVar,dicoDepth):
+    VCF = open(pathVcf,'w')
+    VCF.write("##fileformat=VCFv4.2\n##Nk_version=1.0\n##Nk_calls="+"|".join(lstCaller)+"\n##reference=/bench/GRCh38.fasta\n")
+    for infoID in ["CALLAF","CALLFILTER","CALLQUAL"]: VCF.write("##INFO=<ID="+infoID+",Number=A,Type=String,Description=\""+infoID+"\">\n")
+    VCF.write("##INFO=<ID=CALLNB,Number=A,Type=Integer,Description=\"CALLNB\">\n")
+    VCF.write("##FORMAT=<ID=GT,Number=1,Type=String,Description=\"GT\">\n##FORMAT=<ID=DP,Number=1,Type=Integer,Description=\"DP\">\n##FORMAT=<ID=AF,Number=A,Type=Float,Description=\"AF\">\n")
+    for chrom in lstChrom: VCF.write("##contig=<ID="+chrom+",length="+str(dicoChrSize[chrom])+">\n")
+    VCF.write("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t"+sample+"\n")
+    for chrom,pos,ref,alt in lstVar:
+        lstFilter = [random.choice([".",".",".","DepthofQuality"]) for caller in lstCaller]
+        lstQual = ["." if callFilter!="." else str(random.randint(20,99)) for callFilter in lstFilter]
+        lstAF = [str(round(random.random(),2)) for caller in lstCaller]
+        info = "CALLNB="+str(lstFilter.count("."))+";CALLAF="+"|".join(lstAF)+";CALLFILTER="+"|".join(lstFilter)+";CALLQUAL="+"|".join(lstQual)
+        VCF.write(chrom+"\t"+str(pos)+"\t.\t"+ref+"\t"+alt+"\t50\tPASS\t"+info+"\tGT:DP:AF\t0/1:"+str(max(1,dicoDepth.get((chrom,pos),1)))+":"+lstAF[0]+"\n")
+    VCF.close()
+
+#***** Nk_sample JSON (GRCh37 chrM variants) *****#
+def writeNkSample(pathJson,nbVariant):
+    dicoSample = { "haplo":"H1b2 ("+str(round(random.random(),2))+")" }
+    while len(dicoSample)<nbVariant+1:
+        ref = random.choice("ACGT")
+        varId = "chrM_"+str(random.randint(1,16500))+"_"+ref+"_"+random.choice([base for base in "ACGT" if base!=ref])
+        dicoSample[varId] = { "allele_freq":round(random.random(),2), "strand_bias":round(random.random(),2), "dico_cov":{"reads_all":random.randint(10,5000)} }
+        for caller in random.sample(lstNkCaller,3): dicoSample[varId][caller] = random.randint(20,99)
+    JSON = open(pathJson,'w')
+    json.dump(dicoSample,JSON)
+    JSON.close()
+
+
+
+#---------------------------------------------------------------#
+#---------------------------------------------------------------#
+#                            MEASURES                           #
+#---------------------------------------------------------------#
+#---------------------------------------------------------------#
+
+#***** Start throwaway mongod *****#
+def startMongod(pathDbDir,port):
+    process = subprocess.Popen([dicoBench["mongod"],"--port",str(port),"--dbpath",pathDbDir,"--bind_ip","127.0.0.1","--logpath",os.path.join(pathDbDir,"mongod.log")],stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL)
+    for i in range(300):
+        try:
+            socket.create_connection(("127.0.0.1",port),timeout=0.1).close()
+            return process
+        except OSError:
+            if process.poll()!=None: break
+            time.sleep(0.1)
+    process.kill()
+    exit("Unable to start mongod (see `"+os.path.join(pathDbDir,"mongod.log")+"`)")
+
+#***** Run a Nk_db sub-command *****#
+# Return elapsed seconds
+def runNkDb(lstArg):
+    dicoEnv = dict(os.environ)
+    dicoEnv["NK_MONGO_HOST"] = "127.0.0.1"
+    dicoEnv["NK_MONGO_PORT"] = str(dicoBench["port"])
+    startTime = time.time()
+    process = subprocess.Popen([sys.executable,pathNkDb]+lstArg+["-q"],stdout=subprocess.PIPE,stderr=subprocess.PIPE,env=dicoEnv)
+    out,err = process.communicate()
+    elapsed = time.time()-startTime
+    if process.returncode!=0 or "Traceback" in err.decode('utf-8'): exit("Nk_db.py "+" ".join(lstArg)+" failed\n"+out.decode('utf-8')+err.decode('utf-8'))
+    return elapsed
+
+#***** Percentile (nearest rank) *****#
+def percentile(lstValue,percent):
+    lstSorted = sorted(lstValue)
+    return lstSorted[max(0,min(len(lstSorted)-1,int(round(percent/100*len(lstSorted)+0.5))-1))]
+
+#***** Sub-command summary *****#
+# lstMeasure = [(elapsed,nbDoc)]
+def summary(lstMeasure):
+    lstElapsed = [elapsed for elapsed,nbDoc in lstMeasure]
+    nbDoc = sum([nbDoc for elapsed,nbDoc in lstMeasure])
+    dicoSummary = { "calls":len(lstMeasure), "docs":nbDoc, "total_s":round(sum(lstElapsed),3), \
+                    "p50_s":round(percentile(lstElapsed,50),3), "p90_s":round(percentile(lstElapsed,90),3), "p99_s":round(percentile(lstElapsed,99),3), "max_s":round(max(lstElapsed),3) }
+    if nbDoc>0: dicoSummary["docs_per_s"] = round(nbDoc/max(sum(lstElapsed),0.001),1)
+    return dicoSummary
+
+#***** Collections & indexes sizes *****#
+def collectionSizes(port):
+    client = pymongo.MongoClient("mongodb://127.0.0.1:"+str(port)+"/")
+    db = client.NiourK_db
+    dicoSize = {}
+    for collection in sorted(db.list_collection_names()):
+        stats = db.command("collstats",collection)
+        dicoSize[collection] = { "count":stats["count"], "size":stats["size"], "storageSize":stats["storageSize"], "totalIndexSize":stats["totalIndexSize"], "indexSizes":stats["indexSizes"] }
+    client.close()
+    return dicoSize
+
+
+
+#---------------------------------------------------------------#
+#---------------------------------------------------------------#
+#                              MAIN                             #
+#---------------------------------------------------------------#
+#---------------------------------------------------------------#
+pathDirTmp = tempfile.mkdtemp(prefix="Nk_bench_")
+pathDbDir = os.path.join(pathDirTmp,"db")
+pathDataDir = os.path.join(pathDirTmp,"data")
+os.makedirs(pathDbDir)
+os.makedirs(pathDataDir)
+dicoResult = { "module":sys.argv[0], "date":time.strftime("%c %Z", time.localtime()), "parameters":dict(dicoBench), "subcommands":{} }
+
+#***** Generate synthetic files *****#
+startTime = time.time()
+lstRegion = makeRegions(dicoBench["regions"])
+lstPool = makeVariantPool(lstRegion,dicoBench["variants"]*2)
+lstJob = [] # (runId,sample,pathBed,nbLine,pathVcf,pathNkSample)
+lstRunJson = [] # (pathJson,nbSample)
+for r in range(dicoBench["runs"]):
+    runId = "BENCH"+str(r+1)
+    lstSample = ["S"+str(s+1) for s in range(dicoBench["samples"])]
+    pathJson = os.path.join(pathDataDir,runId+".json")
+    writeRunJson(pathJson,runId,lstSample)
+    lstRunJson.append((pathJson,len(lstSample)))
+    for sample in lstSample:
+        pathBed = os.path.join(pathDataDir,runId+"_"+sample+".per-base.bed")
+        nbLine,dicoDepth = writeDepthBed(pathBed,lstRegion)
+        pathVcf = os.path.join(pathDataDir,runId+"_"+sample+".vcf")
+        writeNkVcf(pathVcf,sample,sorted(random.sample(lstPool,dicoBench["variants"]),key=lambda var: (lstChrom.index(var[0]),var[1])),dicoDepth)
+        pathNkSample = os.path.join(pathDataDir,runId+"_"+sample+".json")
+        writeNkSample(pathNkSample,dicoBench["nkvariants"])
+        lstJob.append((runId,sample,pathBed,nbLine,pathVcf,pathNkSample))
+dicoResult["generate_s"] = round(time.time()-startTime,3)
+
+#***** Benchmark sub-commands *****#
+process = startMongod(pathDbDir,dicoBench["port"])
+try:
+    chunk = str(dicoBench["chunk"])
+    dicoMeasure = { "add-run":[], "add-depth":[], "add-vcf":[], "add-nksample":[], "get-variant":[], "get-variant-batch":[], "list-sample":[] }
+    for pathJson,nbSample in lstRunJson: dicoMeasure["add-run"].append((runNkDb(["add-run","-i",pathJson]),nbSample))
+    for runId,sample,pathBed,nbLine,pathVcf,pathNkSample in lstJob:
+        dicoMeasure["add-depth"].append((runNkDb(["add-depth","-i",pathBed,"-r",runId,"-s",sample,"-c",chunk]),nbLine))
+    for runId,sample,pathBed,nbLine,pathVcf,pathNkSample in lstJob:
+        dicoMeasure["add-vcf"].append((runNkDb(["add-vcf","-i",pathVcf,"-r",runId,"-s",sample,"-c",chunk]),dicoBench["variants"]))
+    for runId,sample,pathBed,nbLine,pathVcf,pathNkSample in lstJob:
+        dicoMeasure["add-nksample"].append((runNkDb(["add-nksample","-i",pathNkSample,"-r",runId,"-s",sample,"-c",chunk]),dicoBench["nkvariants"]))
+    # Single variant queries (latency includes interpreter startup)
+    for chrom,pos,ref,alt in random.sample(lstPool,min(dicoBench["queries"],len(lstPool))):
+        dicoMeasure["get-variant"].append((runNkDb(["get-variant","-i",chrom+"_"+str(pos)+"_"+ref+"_"+alt]),1))
+    # Batch query of the whole pool
+    pathVarList = os.path.join(pathDataDir,"variants.txt")
+    VAR = open(pathVarList,'w')
+    for chrom,pos,ref,alt in lstPool: VAR.write(chrom+"_"+str(pos)+"_"+ref+"_"+alt+"\n")
+    VAR.close()
+    dicoMeasure["get-variant-batch"].append((runNkDb(["get-variant","-i",pathVarList,"-o",os.path.join(pathDataDir,"variants.tsv"),"-c",chunk]),len(lstPool)))
+    dicoMeasure["list-sample"].append((runNkDb(["list-sample","-o",os.path.join(pathDataDir,"samples.csv")]),dicoBench["runs"]*dicoBench["samples"]))
+    for subCmd in dicoMeasure: dicoResult["subcommands"][subCmd] = summary(dicoMeasure[subCmd])
+    dicoResult["collections"] = collectionSizes(dicoBench["port"])
+finally:
+    process.terminate()
+    process.wait()
+    if dicoBench["keep"]==1: dicoResult["path"] = pathDirTmp
+    else: shutil.rmtree(pathDirTmp)
+
+#***** Write JSON *****#
+if dicoBench["out"]=="": print(json.dumps(dicoResult,indent=4))
+else:
+    OUT = open(dicoBench["out"],'w')
+    json.dump(dicoResult,OUT,indent=4)
+    OUT.close()
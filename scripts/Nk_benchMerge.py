@@ -0,0 +1,136 @@
+#=====================================================
+# -*- coding: utf-8 -*-                              |
+# title           : Nk_benchMerge.py                 |
+# description     : Nk_mergeVCF engines bench        |
+# author          : dooguypapua                      |
+# copyright       : CHU Angers                       |
+# date            : 20201029                         |
+# version         : 0.1                              |
+# python_version  : 3.8.2                            |
+#==================================================================
+# USAGE: Nk_benchMerge.py [key=value] ... [key=value]
+#   dir=            Folder of caller VCFs (<sample>_<x>_<caller>.vcf)
+#   samples=        Comma separated samples (default: all samples in dir)
+#   fasta=          Reference FASTA
+#   gatk=gatk       GATK launcher
+#   vt=vt           vt binary
+#   validator=vcf_validator  vcf-validator binary
+#   dp=20           DP filter value
+#   cpus=1          Nk_mergeVCF --cpus
+#   repeats=3       Runs per sample and engine
+#   keep=0          Keep merge folders (1)
+#   out=            Output JSON file (default: stdout)
+# Each sample is merged with --engine=gatk & --engine=native (bgzip & tabix
+# required in PATH), merged records of both engines must be identical
+# OUT  : Errors or JSON metrics
+#==================================================================
+import sys
+import os
+import json
+import time
+import gzip
+import glob
+import shutil
+import tempfile
+import subprocess
+
+
+dicoBench = { "dir":"", "samples":"", "fasta":"", "gatk":"gatk", "vt":"vt", "validator":"vcf_validator", "dp":20, \
+              "cpus":1, "repeats":3, "keep":0, "out":"" }
+lstEngine = ["gatk","native"]
+pathMergeVCF = os.path.join(os.path.dirname(os.path.abspath(__file__)),"Nk_mergeVCF.py")
+
+
+
+#***** ARGUMENTS *****#
+lstErrors = []
+for i in range(1,len(sys.argv),1):
+    if not "=" in sys.argv[i]: lstErrors.append("Invalid input argument `"+sys.argv[i]+"`")
+    else:
+        key,value = sys.argv[i].split("=",1)
+        if not key in dicoBench: lstErrors.append("Unknown argument `"+key+"`")
+        elif type(dicoBench[key])==int:
+            try: dicoBench[key] = int(value)
+            except: lstErrors.append("Bad integer value for `"+key+"`")
+        else: dicoBench[key] = value
+if not os.path.isdir(dicoBench["dir"]): lstErrors.append("Unable to find VCF folder `"+dicoBench["dir"]+"`")
+if not os.path.isfile(dicoBench["fasta"]): lstErrors.append("Unable to find reference `"+dicoBench["fasta"]+"`")
+if dicoBench["repeats"]<1: lstErrors.append("Invalid repeats value `"+str(dicoBench["repeats"])+"`")
+for binary in ["bgzip","tabix"]:
+    if shutil.which(binary)==None: lstErrors.append(binary+" binary not found")
+if len(lstErrors)>0: exit("USAGE : python Nk_benchMerge.py [key=value] ... [key=value]\n"+"\n".join(lstErrors))
+# Samples & their caller VCFs
+dicoSampleVcf = {}
+for pathVcf in sorted(glob.glob(os.path.join(dicoBench["dir"],"*.vcf"))):
+    sample = os.path.basename(pathVcf).split("_")[0]
+    if dicoBench["samples"]=="" or sample in dicoBench["samples"].split(","):
+        if not sample in dicoSampleVcf: dicoSampleVcf[sample] = []
+        dicoSampleVcf[sample].append(pathVcf)
+if len(dicoSampleVcf)==0: exit("No caller VCF found in `"+dicoBench["dir"]+"`")
+
+
+
+#---------------------------------------------------------------#
+#---------------------------------------------------------------#
+#                            MEASURES                           #
+#---------------------------------------------------------------#
+#---------------------------------------------------------------#
+
+#***** Run Nk_mergeVCF for one sample *****#
+# Return (elapsed seconds, merged records)
+def runMerge(pathRunDir,sample,lstVcf,engine):
+    os.makedirs(pathRunDir)
+    lstLocalVcf = []
+    for pathVcf in lstVcf:
+        shutil.copy(pathVcf,pathRunDir)
+        lstLocalVcf.append(os.path.basename(pathVcf))
+    lstArg = ["bench",dicoBench["gatk"],dicoBench["vt"],dicoBench["validator"],"raw",os.path.abspath(dicoBench["fasta"]),str(dicoBench["dp"]),sample, \
+              "--cpus="+str(dicoBench["cpus"]),"--engine="+engine]
+    startTime = time.time()
+    process = subprocess.Popen([sys.executable,pathMergeVCF]+lstArg+lstLocalVcf,stdout=subprocess.PIPE,stderr=subprocess.PIPE,cwd=pathRunDir)
+    out,err = process.communicate()
+    elapsed = time.time()-startTime
+    if process.returncode!=0 or "Traceback" in err.decode('utf-8'): exit("Nk_mergeVCF.py --engine="+engine+" `"+sample+"` failed\n"+out.decode('utf-8')+err.decode('utf-8'))
+    VCF = gzip.open(os.path.join(pathRunDir,sample+"_Nk.vcf.gz"),'rt')
+    lstRecord = [line for line in VCF if not line.startswith("#")]
+    VCF.close()
+    return elapsed,lstRecord
+
+#***** Engine summary *****#
+def summary(lstElapsed):
+    return { "runs":len(lstElapsed), "mean_s":round(sum(lstElapsed)/len(lstElapsed),3), "min_s":round(min(lstElapsed),3), "max_s":round(max(lstElapsed),3) }
+
+
+
+#---------------------------------------------------------------#
+#---------------------------------------------------------------#
+#                              MAIN                             #
+#---------------------------------------------------------------#
+#---------------------------------------------------------------#
+pathDirTmp = tempfile.mkdtemp(prefix="Nk_benchMerge_")
+dicoResult = { "module":sys.argv[0], "date":time.strftime("%c %Z", time.localtime()), "parameters":dict(dicoBench), "samples":{} }
+try:
+    for sample in dicoSampleVcf:
+        dicoMeasure = {}
+        dicoRecord = {}
+        # Engines alternated to spread caching effects
+        for r in range(dicoBench["repeats"]):
+            for engine in lstEngine:
+                elapsed,lstRecord = runMerge(os.path.join(pathDirTmp,sample,engine+"_"+str(r+1)),sample,dicoSampleVcf[sample],engine)
+                if not engine in dicoMeasure: dicoMeasure[engine] = []
+                dicoMeasure[engine].append(elapsed)
+                dicoRecord[engine] = lstRecord
+        dicoResult["samples"][sample] = { "callers":len(dicoSampleVcf[sample]), "records":len(dicoRecord["native"]), "identical":dicoRecord["gatk"]==dicoRecord["native"] }
+        for engine in lstEngine: dicoResult["samples"][sample][engine] = summary(dicoMeasure[engine])
+        dicoResult["samples"][sample]["saved_s"] = round(dicoResult["samples"][sample]["gatk"]["mean_s"]-dicoResult["samples"][sample]["native"]["mean_s"],3)
+    dicoResult["saved_s_per_sample"] = round(sum([dicoResult["samples"][sample]["saved_s"] for sample in dicoResult["samples"]])/len(dicoResult["samples"]),3)
+finally:
+    if dicoBench["keep"]==1: dicoResult["path"] = pathDirTmp
+    else: shutil.rmtree(pathDirTmp)
+
+#***** Write JSON *****#
+if dicoBench["out"]=="": print(json.dumps(dicoResult,indent=4))
+else:
+    OUT = open(dicoBench["out"],'w')
+    json.dump(dicoResult,OUT,indent=4)
+    OUT.close()
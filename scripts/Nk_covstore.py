@@ -0,0 +1,208 @@
+#=====================================================
+# -*- coding: utf-8 -*-                              |
+# title           : Nk_covstore.py                   |
+# description     : Memory-mapped depth store        |
+# author          : dooguypapua                      |
+# copyright       : CHU Angers                       |
+# date            : 20201022                         |
+# version         : 0.1                              |
+# python_version  : 3.8.2                            |
+#=====================================================
+# Store layout (one folder):
+#   covstore.json       target regions & ordered sample list
+#   <chrom>.depth.npy   uint16 matrix [sample row, target position]
+#   covstore.lock       exclusive lock of the writers (add & remove a sample)
+# Target positions of a chromosome are concatenated: column of a
+# position = offset of its region + (pos0 - region start)
+#=====================================================
+import os
+import json
+import bisect
+import fcntl
+import numpy
+from numpy.lib.format import open_memmap
+
+
+# Initial number of sample rows (doubled when full)
+initCapacity = 16
+# uint16 depth saturation
+maxDepth = 65535
+
+
+
+#***** INIT store from a target BED *****#
+# Overlapping or adjacent regions are merged
+def initCovStore(pathStore,pathTargetBed):
+    dicoRegion = {}
+    BED = open(pathTargetBed,'r')
+    for line in BED:
+        if line.strip()=="" or line.startswith("#") or line.startswith("track") or line.startswith("browser"): continue
+        splitLine = line.rstrip("\n").split("\t")
+        if not splitLine[0] in dicoRegion: dicoRegion[splitLine[0]] = []
+        dicoRegion[splitLine[0]].append((int(splitLine[1]),int(splitLine[2])))
+    BED.close()
+    dicoMeta = { "capacity":initCapacity, "samples":[], "chroms":{} }
+    for chrom in dicoRegion:
+        lstStart = []
+        lstEnd = []
+        for start,end in sorted(dicoRegion[chrom]):
+            if len(lstEnd)>0 and start<=lstEnd[-1]: lstEnd[-1] = max(lstEnd[-1],end)
+            else:
+                lstStart.append(start)
+                lstEnd.append(end)
+        lstOffset = [0]
+        for i in range(len(lstStart)): lstOffset.append(lstOffset[-1]+lstEnd[i]-lstStart[i])
+        dicoMeta["chroms"][chrom] = { "starts":lstStart, "ends":lstEnd, "offsets":lstOffset }
+    os.makedirs(pathStore,exist_ok=True)
+    for chrom in dicoMeta["chroms"]:
+        matrix = open_memmap(os.path.join(pathStore,chrom+".depth.npy"),mode='w+',dtype=numpy.uint16,shape=(initCapacity,dicoMeta["chroms"][chrom]["offsets"][-1]))
+        matrix.flush()
+        del matrix
+    saveCovStoreMeta(pathStore,dicoMeta)
+    return dicoMeta
+
+#***** OPEN store *****#
+# Return store dictionnary (matrices are memory-mapped on first access)
+def openCovStore(pathStore):
+    return { "path":pathStore, "meta":readCovStoreMeta(pathStore), "matrix":{}, "lock":None }
+
+#***** READ store metadata *****#
+def readCovStoreMeta(pathStore):
+    JSON = open(os.path.join(pathStore,"covstore.json"),'r')
+    dicoMeta = json.load(JSON)
+    JSON.close()
+    return dicoMeta
+
+#***** LOCK store *****#
+# Exclusive lock held from the sample row reservation to its commit (or removal), concurrent
+# writers wait for it; metadata & matrices are reloaded under the lock (released at process exit)
+def lockCovStore(covStore):
+    if covStore["lock"]!=None: return
+    LOCK = open(os.path.join(covStore["path"],"covstore.lock"),'a')
+    fcntl.flock(LOCK,fcntl.LOCK_EX)
+    covStore["lock"] = LOCK
+    covStore["meta"] = readCovStoreMeta(covStore["path"])
+    covStore["matrix"] = {}
+
+#***** UNLOCK store *****#
+def unlockCovStore(covStore):
+    if covStore["lock"]==None: return
+    fcntl.flock(covStore["lock"],fcntl.LOCK_UN)
+    covStore["lock"].close()
+    covStore["lock"] = None
+
+#***** SAVE store metadata (atomic) *****#
+def saveCovStoreMeta(pathStore,dicoMeta):
+    pathJson = os.path.join(pathStore,"covstore.json")
+    JSON = open(pathJson+".tmp",'w')
+    json.dump(dicoMeta,JSON)
+    JSON.close()
+    os.replace(pathJson+".tmp",pathJson)
+
+#***** GET chromosome matrix *****#
+def covStoreMatrix(covStore,chrom,mode='r'):
+    if not chrom in covStore["matrix"] or (mode=='r+' and not covStore["matrix"][chrom].flags.writeable):
+        covStore["matrix"][chrom] = numpy.load(os.path.join(covStore["path"],chrom+".depth.npy"),mmap_mode=mode)
+    return covStore["matrix"][chrom]
+
+#***** GROW matrices to a new sample capacity *****#
+def growCovStore(covStore,capacity):
+    nbSample = len(covStore["meta"]["samples"])
+    for chrom in covStore["meta"]["chroms"]:
+        pathMatrix = os.path.join(covStore["path"],chrom+".depth.npy")
+        oldMatrix = numpy.load(pathMatrix,mmap_mode='r')
+        newMatrix = open_memmap(pathMatrix+".tmp",mode='w+',dtype=numpy.uint16,shape=(capacity,oldMatrix.shape[1]))
+        newMatrix[:nbSample] = oldMatrix[:nbSample]
+        newMatrix.flush()
+        del oldMatrix,newMatrix
+        os.replace(pathMatrix+".tmp",pathMatrix)
+    covStore["matrix"] = {}
+    covStore["meta"]["capacity"] = capacity
+    saveCovStoreMeta(covStore["path"],covStore["meta"])
+
+#***** COLUMN range of a 0-based interval *****#
+# Yield (colStart,colEnd) for each target region overlapping [start,end[
+def covStoreColumns(dicoChrom,start,end):
+    lstStart = dicoChrom["starts"]
+    lstEnd = dicoChrom["ends"]
+    i = max(0,bisect.bisect_right(lstStart,start)-1)
+    while i<len(lstStart) and lstStart[i]<end:
+        overlapStart = max(start,lstStart[i])
+        overlapEnd = min(end,lstEnd[i])
+        if overlapStart<overlapEnd:
+            colStart = dicoChrom["offsets"][i]+overlapStart-lstStart[i]
+            yield (colStart,colStart+overlapEnd-overlapStart)
+        i+=1
+
+#***** WRITE sample depth *****#
+# Generator passing through (chrom,start,end,depth) intervals while writing them
+# to the next free sample row, the sample is only visible after commitCovStore
+# (store locked from the first interval to commitCovStore, see lockCovStore)
+def covStoreWriter(covStore,bedReader):
+    lockCovStore(covStore)
+    row = len(covStore["meta"]["samples"])
+    if row>=covStore["meta"]["capacity"]: growCovStore(covStore,covStore["meta"]["capacity"]*2)
+    # Clear row (previous uncommitted sample)
+    for chrom in covStore["meta"]["chroms"]: covStoreMatrix(covStore,chrom,'r+')[row] = 0
+    for chrom,start,end,depth in bedReader:
+        if chrom in covStore["meta"]["chroms"]:
+            matrix = covStoreMatrix(covStore,chrom,'r+')
+            for colStart,colEnd in covStoreColumns(covStore["meta"]["chroms"][chrom],start,end):
+                matrix[row,colStart:colEnd] = min(depth,maxDepth)
+        yield (chrom,start,end,depth)
+
+#***** COMMIT written sample *****#
+# Release the store lock
+def commitCovStore(covStore,sampleID):
+    for chrom in covStore["matrix"]: covStore["matrix"][chrom].flush()
+    covStore["meta"]["samples"].append(sampleID)
+    saveCovStoreMeta(covStore["path"],covStore["meta"])
+    unlockCovStore(covStore)
+
+#***** REMOVE a sample *****#
+# Last sample row is moved to the removed row (rows are unordered)
+# Return False if the sample is absent
+def removeCovStoreSample(covStore,sampleID):
+    lockCovStore(covStore)
+    lstSample = covStore["meta"]["samples"]
+    if not sampleID in lstSample:
+        unlockCovStore(covStore)
+        return False
+    row = lstSample.index(sampleID)
+    last = len(lstSample)-1
+    for chrom in covStore["meta"]["chroms"]:
+        matrix = covStoreMatrix(covStore,chrom,'r+')
+        matrix[row] = matrix[last]
+        matrix[last] = 0
+        matrix.flush()
+    lstSample[row] = lstSample[last]
+    lstSample.pop()
+    saveCovStoreMeta(covStore["path"],covStore["meta"])
+    unlockCovStore(covStore)
+    return True
+
+#***** COUNT covering samples *****#
+# Number of samples with depth>=mindepth for each 1-based position of a chromosome
+# (-1 for positions outside target regions)
+def covStoreCounts(covStore,chrom,lstPos,mindepth):
+    arrCount = numpy.full(len(lstPos),-1,dtype=numpy.int64)
+    if not chrom in covStore["meta"]["chroms"]: return arrCount
+    dicoChrom = covStore["meta"]["chroms"][chrom]
+    arrPos0 = numpy.asarray(lstPos,dtype=numpy.int64)-1
+    arrStart = numpy.asarray(dicoChrom["starts"],dtype=numpy.int64)
+    arrEnd = numpy.asarray(dicoChrom["ends"],dtype=numpy.int64)
+    arrRegion = numpy.searchsorted(arrStart,arrPos0,side='right')-1
+    arrTarget = (arrRegion>=0) & (arrPos0<arrEnd[numpy.maximum(arrRegion,0)])
+    if not arrTarget.any(): return arrCount
+    arrCol = numpy.asarray(dicoChrom["offsets"],dtype=numpy.int64)[arrRegion[arrTarget]]+arrPos0[arrTarget]-arrStart[arrRegion[arrTarget]]
+    nbSample = len(covStore["meta"]["samples"])
+    matrix = covStoreMatrix(covStore,chrom)
+    arrCount[arrTarget] = numpy.count_nonzero(matrix[:nbSample,arrCol]>=mindepth,axis=0)
+    return arrCount
+
+#***** COUNT covering samples at one position *****#
+# Return None when position is outside target regions
+def covStoreCount(covStore,chrom,pos,mindepth):
+    count = int(covStoreCounts(covStore,chrom,[pos],mindepth)[0])
+    if count==-1: return None
+    return count
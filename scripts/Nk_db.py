@@ -16,6 +16,7 @@
 #     add-depth       Add sample depth from a BED file
 #     add-vcf         Add variants from a VCF file
 #     add-nksample    Add variants from a Nk_sample JSON file
+#     add-batch       Add a folder or a manifest of files in parallel
 #     --------------------------------------------------------
 #     del-run         Delete sequencing run
 #     del-sample      Delete sample depth and variants
@@ -24,29 +25,35 @@
 #     list-sample     List samples for a sequencing run
 #     --------------------------------------------------------
 #     get-variant     Get variant features
+#     get-sample      Get variants of a sample
+#     get-region      Get variants & coverage of regions
 #     --------------------------------------------------------
+#     migrate-depth   Convert per-base depth to depth segments
+#     migrate-varlayout  Convert variant calls layout (field/array)
+#     init-indexes    Create missing indexes and report query plans
+#     init-covstore   Create a memory-mapped depth store on target regions
+#     rebuild-aggregates  Recompute variant frequency counters
 #     stats           Print some database statistics
-#     export          Export database to a specified file
+#     export          Export variants to a cohort VCF or parquet file
+#     profile-report  Summarize query profiles (--profile)
 #     --------------------------------------------------------
 #     -h  --help      Print this help menu
 #     -v  --version   Print tool version
 #     -q  --quiet     Disable verbose output
+#         --profile   Write a JSON query profile to a file or folder
 #==================================================================
 # BATCH:
 #  ADD-RUN (nk_run & nk_sample)
-#  bash add_batch.sh run <parameters_json folder> <threads>
+#  python Nk_db.py add-batch --type run --input <parameters_json folder> --threads <threads>
 #  ADD-DEPTH
-#  bash add_batch.sh depth <GRCh38 all run BED folder> <threads>
+#  python Nk_db.py add-batch --type depth --input <GRCh38 run BED folder> --run <run> --threads <threads>
 #  ADD-NKSAMPLE
-#  bash add_batch.sh var <nksample all run folder> <threads>
+#  python Nk_db.py add-batch --type nksample --input <manifest> --threads <threads>
 #==================================================================
 
 import sys
 import os
-import shutil
-import tempfile
 from Nk_functions import *
-from Nk_mongo import *
 
 
 
@@ -55,18 +62,18 @@ from Nk_mongo import *
 dicoInit = {
             'white':"235;235;235", 'grey1':"200;200;200", 'grey2':"150;150;150",'blue1':"135;135;222",'blue2':"175;175;233", 'red':"255;85;85",'green':"113;180;120" ,\
             'colorBool':True, "quiet" : False, \
-            'pathSrc':os.path.dirname(os.path.abspath("__file__")), 'pathDirTmp':tempfile.mkdtemp(), \
-            'pathLiftover':os.path.dirname(os.path.abspath("__file__"))+"/liftOver", 'pathLiftChain':os.path.dirname(os.path.abspath("__file__"))+"/hg19ToHg38.over.chain.gz", \
-            'mongoHost':"localhost", "mongoPort":"27018", 'nbChunk':25000, 'maxSevSelDelay':10 , 'truncateWidth':(30,50) \
+            'pathSrc':os.path.dirname(os.path.abspath(__file__)), 'pathDirTmp':"", \
+            'pathLiftChain':os.path.dirname(os.path.abspath(__file__))+"/hg19ToHg38.over.chain.gz", \
+            'mongoHost':os.environ.get("NK_MONGO_HOST","localhost"), "mongoPort":os.environ.get("NK_MONGO_PORT","27018"), 'nbChunk':25000, 'nbWriter':2, 'maxSegLen':10000, 'staleDelay':600, 'pathCovStore':"", 'lstCovThreshold':[1,10,20,30,50,100], 'maxSevSelDelay':10 , 'truncateWidth':(30,50), 'nbPrettyRow':1000, \
+            'pathProfile':"", 'nbProfileRow':15 \
            }
-# MongoDB (sudo mongod --port 27018 --dbpath /media/dooguy/ultima_thule/niourkdb)
-connectMongo(dicoInit)
-
-# Arguments
+# Arguments (help, version & usage errors exit before any heavy import or connection)
 NkDBargManager(sys.argv,dicoInit)
 
-# Check NkDepth
-# if dicoInit["collect_nk_depth"].count()!=3088286401: initNkDepth(dicoInit,dicoChrSize)
+# MongoDB (sudo mongod --port 27018 --dbpath /media/dooguy/ultima_thule/niourkdb)
+# (host & port can be changed with NK_MONGO_HOST & NK_MONGO_PORT environment variables)
+from Nk_mongo import *
+if not dicoInit["subCmd"] in ["init-covstore","profile-report"]: connectMongo(dicoInit)
 
 
 
@@ -78,7 +85,13 @@ if dicoInit["subCmd"]=="list-sample": listSample(dicoInit)
 # DB Summary
 if dicoInit["subCmd"]=="stats": dbStats(dicoInit)
 # Variant Summary
-if dicoInit["subCmd"]=="get-variant": getVariant(dicoInit)
+if dicoInit["subCmd"]=="get-variant":
+    if os.path.isfile(dicoInit["varInput"]): getVariantBatch(dicoInit)
+    else: getVariant(dicoInit)
+# Sample variants
+if dicoInit["subCmd"]=="get-sample": getSample(dicoInit)
+# Region variants & coverage
+if dicoInit["subCmd"]=="get-region": getRegion(dicoInit)
 
 
 
@@ -91,11 +104,41 @@ if dicoInit["subCmd"]=="add-vcf": addVcf(dicoInit)
 if dicoInit["subCmd"]=="add-nksample": addNkSample(dicoInit)
 # Add depth
 if dicoInit["subCmd"]=="add-depth": addDepth(dicoInit)
+# Add batch of files
+if dicoInit["subCmd"]=="add-batch": addBatch(dicoInit)
+
+
+
+#***** DEL FUNCTIONS  *****#
+# Del Run
+if dicoInit["subCmd"]=="del-run": delRun(dicoInit)
+# Del Sample
+if dicoInit["subCmd"]=="del-sample": delSample(dicoInit)
+
+
+
+#***** MAINTENANCE  *****#
+# Per-base depth to depth segments
+if dicoInit["subCmd"]=="migrate-depth": migrateDepth(dicoInit)
+# Variant calls layout
+if dicoInit["subCmd"]=="migrate-varlayout": migrateVarLayout(dicoInit)
+# Indexes
+if dicoInit["subCmd"]=="init-indexes": initIndexes(dicoInit)
+# Memory-mapped depth store
+if dicoInit["subCmd"]=="init-covstore": initDepthStore(dicoInit)
+# Variant aggregates
+if dicoInit["subCmd"]=="rebuild-aggregates": rebuildAggregates(dicoInit)
+# Cohort VCF or parquet export
+if dicoInit["subCmd"]=="export": exportDb(dicoInit)
+# Query profiles summary
+if dicoInit["subCmd"]=="profile-report": profileReport(dicoInit)
 
 
 
 #***** POSTPROCESSING  *****#
+# Query profile
+if dicoInit["pathProfile"]!="" and "db" in dicoInit: writeProfile(dicoInit)
 # Clean temporary folder
-shutil.rmtree(dicoInit["pathDirTmp"])
+cleanTmpDir(dicoInit)
 # Exit
 exit("\n")
\ No newline at end of file
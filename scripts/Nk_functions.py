@@ -10,12 +10,20 @@
 #=====================================================
 import os
 import re
+import gzip
 import json
 import shutil
+import tempfile
 import math
+import time
+import importlib.util
 from io import StringIO
 
 
+# get-variant id format (chrom_pos_ref_alt)
+reVarId = re.compile("chr[123456789YXM][0-9]?_[0-9]+_[ATGC]+_[ATGC]+")
+
+
 
 
 
@@ -37,10 +45,27 @@ def display_errors(lst_error,dicoInit):
     if len(lst_error)>0:
         printcolor(" "+lst_error[0]+"\n","0",dicoInit['red'],None,dicoInit['colorBool'])
         for i in range(1,len(lst_error),1): printcolor("         "+lst_error[i]+"\n","0",dicoInit['red'],None,dicoInit['colorBool'])
-        try: shutil.rmtree(dicoInit["pathDirTmp"])
-        except: pass
+        cleanTmpDir(dicoInit)
         exit("\n")
 
+#***** TEMPORARY FOLDER *****#
+# Created on first use only
+def getTmpDir(dicoInit):
+    if dicoInit["pathDirTmp"]=="": dicoInit["pathDirTmp"] = tempfile.mkdtemp()
+    return dicoInit["pathDirTmp"]
+
+def cleanTmpDir(dicoInit):
+    if dicoInit["pathDirTmp"]!="":
+        shutil.rmtree(dicoInit["pathDirTmp"],ignore_errors=True)
+        dicoInit["pathDirTmp"] = ""
+
+#***** LAZY CONNECTION *****#
+# Nk_mongo (pymongo, tqdm) is only imported when a subcommand needs the database
+def requireMongo(dicoInit):
+    if not "db" in dicoInit:
+        from Nk_mongo import connectMongo
+        connectMongo(dicoInit)
+
 #***** CONVERT BYTE FORMAT *****#
 def convertByteSize(size_bytes):
    if size_bytes == 0:
@@ -77,6 +102,7 @@ def NkDBfooterUsage(dicoInit,error):
     printcolor("    -h  --help      Print this help menu\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
     printcolor("    -v  --version   Print tool version\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
     printcolor("    -q  --quiet     Disable verbose output\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("        --profile   Write a JSON query profile to a file or folder\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
     printcolor("\n"+error+"\n\n","0",dicoInit['red'],None,dicoInit['colorBool'])
     exit()
 
@@ -89,6 +115,7 @@ def NkDBmainUsage(dicoInit,error):
     printcolor("    add-depth       Add sample depth from a BED file\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
     printcolor("    add-vcf         Add variants from a VCF file\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
     printcolor("    add-nksample    Add variants from a Nk_sample JSON file\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("    add-batch       Add a folder or a manifest of files in parallel\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
     printcolor("    --------------------------------------------------------\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
     printcolor("    del-run         Delete sequencing run\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
     printcolor("    del-sample      Delete sample depth and variants\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
@@ -97,9 +124,17 @@ def NkDBmainUsage(dicoInit,error):
     printcolor("    list-sample     List samples for a sequencing run\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
     printcolor("    --------------------------------------------------------\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
     printcolor("    get-variant     Get variant features\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("    get-sample      Get variants of a sample\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("    get-region      Get variants & coverage of regions\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
     printcolor("    --------------------------------------------------------\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("    migrate-depth   Convert per-base depth to depth segments\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("    migrate-varlayout  Convert variant calls layout (field/array)\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("    init-indexes    Create missing indexes and report query plans\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("    init-covstore   Create a memory-mapped depth store on target regions\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("    rebuild-aggregates  Recompute variant frequency counters\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
     printcolor("    stats           Print some database statistics\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
-    printcolor("    export          Export database to a specified file\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("    export          Export variants to a cohort VCF or parquet file\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("    profile-report  Summarize query profiles (--profile)\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
     NkDBfooterUsage(dicoInit,error)
 
 #***** SUBCOMMAND USAGE *****#
@@ -118,13 +153,43 @@ def NkDBaddDepthNkSampleUsage(dicoInit,error):
     else: printcolor("    -i  --input     Input sample depth BED(.gz) file [required]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
     printcolor("    -r  --run       Sequencing name or id [required]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
     printcolor("    -s  --sample    Sample name or barcode [required]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("    -c  --chunk     Number of writes per bulk batch [optionnal] [default:"+str(dicoInit["nbChunk"])+"]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    if dicoInit["subCmd"]!="add-depth": printcolor("    -w  --writers   Number of writer threads [optionnal] [default:"+str(dicoInit["nbWriter"])+"]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    if dicoInit["subCmd"]=="add-depth": printcolor("        --covstore  Also write depth to a memory-mapped depth store folder [optionnal]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    NkDBfooterUsage(dicoInit,error)
+# Add batch usage
+def NkDBaddBatchUsage(dicoInit,error):
+    NkDBheaderUsage(dicoInit,True)
+    printcolor("python Nk_db.py add-batch --type <run|depth|vcf|nksample> --input <folder/manifest> [--run <name/id>] [--threads <int>]\n\n","0",dicoInit['blue2'],None,dicoInit['colorBool'])
+    printcolor("    -t  --type      Input files type [required]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("                    (run: IonTorrent JSON, depth: BED(.gz), vcf: Nk VCF(.gz), nksample: Nk_sample JSON)\n","3",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("    -i  --input     Input folder or manifest file [required]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("                    (manifest: one `path<TAB>run<TAB>sample` line per file, run & sample unused for `run` type)\n","3",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("    -r  --run       Sequencing name or id for all files of an input folder [optionnal]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("                    (sample name is the file name without extension)\n","3",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("    -n  --threads   Number of parallel processes [optionnal] [default:4]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("    -c  --chunk     Number of writes per bulk batch [optionnal] [default:"+str(dicoInit["nbChunk"])+"]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    NkDBfooterUsage(dicoInit,error)
+# Del Run & sample usage
+def NkDBdelRunSampleUsage(dicoInit,error):
+    NkDBheaderUsage(dicoInit,True)
+    if dicoInit["subCmd"]=="del-run": printcolor("python Nk_db.py del-run --run <name/id>\n\n","0",dicoInit['blue2'],None,dicoInit['colorBool'])
+    else: printcolor("python Nk_db.py del-sample --run <name/id> --sample <name/barcode>\n\n","0",dicoInit['blue2'],None,dicoInit['colorBool'])
+    printcolor("    -r  --run       Sequencing name or id [required]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    if dicoInit["subCmd"]=="del-sample": printcolor("    -s  --sample    Sample name or barcode [required]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("    -c  --chunk     Number of variants per bulk batch [optionnal] [default:"+str(dicoInit["nbChunk"])+"]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("        --covstore  Also remove from a memory-mapped depth store folder [optionnal]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
     NkDBfooterUsage(dicoInit,error)
 # List Run & sample usage
 def NkDBlistRunSampleUsage(dicoInit,error):
     NkDBheaderUsage(dicoInit,True)
-    printcolor("python Nk_db.py "+dicoInit["subCmd"]+" --csv <file> [--pretty]"+"\n\n","0",dicoInit['blue2'],None,dicoInit['colorBool'])
+    printcolor("python Nk_db.py "+dicoInit["subCmd"]+" --output <file> [--pretty] [--project <name>] [--instrument <name>] [--from <date>] [--to <date>]"+"\n\n","0",dicoInit['blue2'],None,dicoInit['colorBool'])
     printcolor("    -o  --output    Output CSV file [required]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
     printcolor("    -p  --pretty    Display summary [optionnal]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("        --project   Only runs of this project [optionnal]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("        --instrument  Only runs of this instrument [optionnal]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("        --from      Only runs from this date (YYYY-MM-DD) [optionnal]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("        --to        Only runs until this date (YYYY-MM-DD) [optionnal]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
     NkDBfooterUsage(dicoInit,error)
 # List Run & sample usage
 def NkDBSimpleUsage(dicoInit,error):
@@ -134,10 +199,73 @@ def NkDBSimpleUsage(dicoInit,error):
 # Get variant features
 def NkDBaddGetVarUsage(dicoInit,error):
     NkDBheaderUsage(dicoInit,True)
-    printcolor("python Nk_db.py get-variant --input <variant> [--mindepth <int>]\n\n","0",dicoInit['blue2'],None,dicoInit['colorBool'])
-    printcolor("    -i  --input     Input variant [required]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
-    printcolor("                    (must be formatted as follows: `chr5_145000789_A_G`)\n","3",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("python Nk_db.py get-variant --input <variant/file> [--output <file>] [--mindepth <int>]\n\n","0",dicoInit['blue2'],None,dicoInit['colorBool'])
+    printcolor("    -i  --input     Input variant or file [required]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("                    (variant must be formatted as follows: `chr5_145000789_A_G`)\n","3",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("                    (file: VCF(.gz) or one variant per line)\n","3",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("    -o  --output    Output TSV or JSON (.json) file for an input file [required with file]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
     printcolor("    -m  --mindepth  Min depth to consider a sample covering a position [optionnal] [default:20]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("    -c  --chunk     Number of variants per query for an input file [optionnal] [default:"+str(dicoInit["nbChunk"])+"]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("        --covstore  Count covering samples from a memory-mapped depth store folder [optionnal]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("                    (NiourK-db depth segments are used for positions outside store target regions)\n","3",dicoInit['grey1'],None,dicoInit['colorBool'])
+    NkDBfooterUsage(dicoInit,error)
+# Get region variants & coverage usage
+def NkDBgetRegionUsage(dicoInit,error):
+    NkDBheaderUsage(dicoInit,True)
+    printcolor("python Nk_db.py get-region --input <region/BED> [--output <file>] [--mindepth <int>]\n\n","0",dicoInit['blue2'],None,dicoInit['colorBool'])
+    printcolor("    -i  --input     Input region or BED(.gz) file [required]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("                    (region must be formatted as follows: `chr5:145000000-145100000`)\n","3",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("    -o  --output    Output TSV or JSON (.json) file [required with BED]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("                    (TSV: variants & `<output>.coverage.tsv` per-sample depth)\n","3",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("    -m  --mindepth  Min depth to consider a sample covering a position [optionnal] [default:20]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    NkDBfooterUsage(dicoInit,error)
+# Get sample variants usage
+def NkDBgetSampleUsage(dicoInit,error):
+    NkDBheaderUsage(dicoInit,True)
+    printcolor("python Nk_db.py get-sample --run <name/id> --sample <name/barcode> --output <file>\n\n","0",dicoInit['blue2'],None,dicoInit['colorBool'])
+    printcolor("    -r  --run       Sequencing name or id [required]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("    -s  --sample    Sample name or barcode [required]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("    -o  --output    Output TSV or JSON (.json) file [required]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    NkDBfooterUsage(dicoInit,error)
+# Migrate variant layout usage
+def NkDBmigrateVarLayoutUsage(dicoInit,error):
+    NkDBheaderUsage(dicoInit,True)
+    printcolor("python Nk_db.py migrate-varlayout --layout <field|array>\n\n","0",dicoInit['blue2'],None,dicoInit['colorBool'])
+    printcolor("    -l  --layout    Sample calls layout of `nk_var` documents [required]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("                    (field: one `runId_sample` field per call, array: indexed `calls` array)\n","3",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("                    (current layout: only add missing chrom/pos fields of older variants)\n","3",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("    -c  --chunk     Number of writes per bulk batch [optionnal] [default:"+str(dicoInit["nbChunk"])+"]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    NkDBfooterUsage(dicoInit,error)
+# Export usage
+def NkDBexportUsage(dicoInit,error):
+    NkDBheaderUsage(dicoInit,True)
+    printcolor("python Nk_db.py export --output <file> [--depth]\n\n","0",dicoInit['blue2'],None,dicoInit['colorBool'])
+    printcolor("    -o  --output    Output cohort VCF (.vcf.gz) or variant calls parquet (.parquet) file [required]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("                    (VCF is bgzipped & tabix indexed, parquet requires pyarrow)\n","3",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("    -d  --depth     Add sample depth from NiourK-db depth segments [optionnal]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("    -c  --chunk     Number of variants per query [optionnal] [default:"+str(dicoInit["nbChunk"])+"]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    NkDBfooterUsage(dicoInit,error)
+# Migrate depth usage
+def NkDBmigrateDepthUsage(dicoInit,error):
+    NkDBheaderUsage(dicoInit,True)
+    printcolor("python Nk_db.py migrate-depth [--drop]\n\n","0",dicoInit['blue2'],None,dicoInit['colorBool'])
+    printcolor("    -d  --drop      Drop per-base `nk_depth` collection after migration [optionnal]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    NkDBfooterUsage(dicoInit,error)
+# Profile report usage
+def NkDBprofileReportUsage(dicoInit,error):
+    NkDBheaderUsage(dicoInit,True)
+    printcolor("python Nk_db.py profile-report --input <profile/folder> [--output <file>]\n\n","0",dicoInit['blue2'],None,dicoInit['colorBool'])
+    printcolor("    -i  --input     Input JSON profile or folder of profiles [required]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("                    (written by `--profile` with any subcommand)\n","3",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("    -o  --output    Output JSON summary file [optionnal]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    NkDBfooterUsage(dicoInit,error)
+# Init depth store usage
+def NkDBinitCovStoreUsage(dicoInit,error):
+    NkDBheaderUsage(dicoInit,True)
+    printcolor("python Nk_db.py init-covstore --input <target BED> --covstore <folder>\n\n","0",dicoInit['blue2'],None,dicoInit['colorBool'])
+    printcolor("    -i  --input     Input target regions BED file [required]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("        --covstore  Output depth store folder [required]\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    printcolor("                    (one uint16 depth matrix per chromosome, samples x target positions)\n","3",dicoInit['grey1'],None,dicoInit['colorBool'])
     NkDBfooterUsage(dicoInit,error)
 
 
@@ -149,6 +277,53 @@ def NkDBaddGetVarUsage(dicoInit,error):
 #                  NIOURK-DB ARGUMENT MANAGER                   #
 #---------------------------------------------------------------#
 #---------------------------------------------------------------#
+
+#***** SEARCH run entry *****#
+# Set runId & runName from a run name/id
+def searchRun(dicoInit,run):
+    requireMongo(dicoInit)
+    dicoInit["runId"] = ""
+    dicoInit["runName"] = ""
+    # Search run entry
+    findRun = dicoInit["collect_nk_run"].find_one({"_id": run})
+    if findRun:
+        dicoInit["runId"] = run
+        dicoInit["runName"] = findRun["name"]
+    else:
+        findRun = dicoInit["collect_nk_run"].find_one({"name": run})
+        if findRun:
+            dicoInit["runName"] = run
+            dicoInit["runId"] = findRun["_id"]
+    try:
+        findRun = dicoInit["collect_nk_run"].find_one({"name": "_".join(run.split("_")[:-1]), "num":int(run.split("_")[-1]) })
+        if findRun:
+            dicoInit["runName"] = "_".join(run.split("_")[:-1])
+            dicoInit["runId"] = findRun["_id"]
+    except: pass
+    if dicoInit["runId"]==dicoInit["runName"]=="": return "Sequencing name or id not found in database"
+    return ""
+
+#***** SEARCH run & sample entries *****#
+# Set runId, runName, sampleBc & sampleName from a run name/id and a sample name/barcode
+def searchRunSample(dicoInit,run,sample):
+    dicoInit["sampleBc"] = ""
+    dicoInit["sampleName"] = ""
+    error = searchRun(dicoInit,run)
+    if error!="": return error
+    # Search sample entry
+    findSample = dicoInit["collect_nk_sample"].find_one({"runid":dicoInit["runId"], "bc": sample})
+    if findSample:
+        dicoInit["sampleBc"] = sample
+        dicoInit["sampleName"] = findSample["name"]
+    else:
+        findSample = dicoInit["collect_nk_sample"].find_one({"runid":dicoInit["runId"],"name": sample})
+        if findSample:
+            dicoInit["sampleName"] = sample
+            dicoInit["sampleBc"] = findSample["bc"]
+    if dicoInit["sampleBc"]==dicoInit["sampleName"]=="": return "Sample name or barcode not found in database"
+    return ""
+
+#***** ARGUMENTS *****#
 def NkDBargManager(lstArgv,dicoInit):
 
     #***** Help or no arguments => Main usage *****#
@@ -158,6 +333,15 @@ def NkDBargManager(lstArgv,dicoInit):
     #***** Subcommand *****#
     else:
         dicoInit["subCmd"] = lstArgv[1]
+        # Query profile (removed from arguments, written at the end of the subcommand)
+        if "--profile" in lstArgv[2:]:
+            i = lstArgv.index("--profile",2)
+            if len(lstArgv)<=i+1: NkDBmainUsage(dicoInit,"Missing value for `--profile`")
+            if not os.path.isdir(lstArgv[i+1]) and not check_file_writable(lstArgv[i+1]): NkDBmainUsage(dicoInit,"Profile file not writable `"+lstArgv[i+1]+"`")
+            dicoInit["pathProfile"] = lstArgv[i+1]
+            dicoInit["profileArgv"] = lstArgv[1:i]+lstArgv[i+2:]
+            dicoInit["profileStart"] = time.time()
+            lstArgv = lstArgv[:i]+lstArgv[i+2:]
         
         #***** ADD run *****#
         if dicoInit["subCmd"]=="add-run":
@@ -174,52 +358,100 @@ def NkDBargManager(lstArgv,dicoInit):
             if len(set(["--run","-r"]) & set(lstArgv))==0: NkDBlistRunSampleUsage(dicoInit,"Missing argument `--run -r`")
             if len(set(["--sample","-s"]) & set(lstArgv))==0: NkDBlistRunSampleUsage(dicoInit,"Missing argument `--sample -s`")
             dicoInit["pathInput"] = ""
-            dicoInit["runId"] = ""
-            dicoInit["runName"] = ""
-            dicoInit["sampleBc"] = ""
-            dicoInit["sampleName"] = ""
-            for i in range(2,len(lstArgv),2):
+            run = ""
+            sample = ""
+            i = 2
+            while i < len(lstArgv):
+                if lstArgv[i] in ["--quiet","-q"]: i+=1 ; continue
                 if len(lstArgv)<=i+1: NkDBaddDepthNkSampleUsage(dicoInit,"Missing value for `"+lstArgv[i]+"`")
                 if lstArgv[i] in ["--input","-i"]:
                     if not os.path.isfile(lstArgv[i+1]): NkDBaddDepthNkSampleUsage(dicoInit,"Input file not found `"+lstArgv[i+1]+"`")
                     else: dicoInit["pathInput"] = lstArgv[i+1]
                 elif lstArgv[i] in ["--run","-r"]:
-                    # Search run entry
-                    findRun = dicoInit["collect_nk_run"].find_one({"_id": lstArgv[i+1]})
-                    if findRun:
-                        dicoInit["runId"] = lstArgv[i+1]
-                        dicoInit["runName"] = findRun["name"]
-                    else:
-                        findRun = dicoInit["collect_nk_run"].find_one({"name": lstArgv[i+1]})
-                        if findRun:
-                            dicoInit["runName"] = lstArgv[i+1]
-                            dicoInit["runId"] = findRun["_id"]
-                    try:
-                        findRun = dicoInit["collect_nk_run"].find_one({"name": "_".join(lstArgv[i+1].split("_")[:-1]), "num":int(lstArgv[i+1].split("_")[-1]) })
-                        if findRun:
-                            dicoInit["runName"] = "_".join(lstArgv[i+1].split("_")[:-1])
-                            dicoInit["runId"] = findRun["_id"]
-                    except: pass
+                    run = lstArgv[i+1]
                 elif lstArgv[i] in ["--sample","-s"]:
                     sample = lstArgv[i+1]
+                elif lstArgv[i] in ["--chunk","-c"]:
+                    try: dicoInit["nbChunk"] = int(lstArgv[i+1])
+                    except: NkDBaddDepthNkSampleUsage(dicoInit,"Bad integer value for `"+lstArgv[i]+"`")
+                    if dicoInit["nbChunk"]<1: NkDBaddDepthNkSampleUsage(dicoInit,"Bad integer value for `"+lstArgv[i]+"`")
+                elif lstArgv[i] in ["--writers","-w"] and dicoInit["subCmd"]!="add-depth":
+                    try: dicoInit["nbWriter"] = int(lstArgv[i+1])
+                    except: NkDBaddDepthNkSampleUsage(dicoInit,"Bad integer value for `"+lstArgv[i]+"`")
+                    if dicoInit["nbWriter"]<1: NkDBaddDepthNkSampleUsage(dicoInit,"Bad integer value for `"+lstArgv[i]+"`")
+                elif lstArgv[i]=="--covstore" and dicoInit["subCmd"]=="add-depth":
+                    if not os.path.isfile(os.path.join(lstArgv[i+1],"covstore.json")): NkDBaddDepthNkSampleUsage(dicoInit,"Depth store not found `"+lstArgv[i+1]+"` (see `init-covstore`)")
+                    dicoInit["pathCovStore"] = lstArgv[i+1]
+                i+=2
             # Check
             if dicoInit["pathInput"]=="": NkDBaddDepthNkSampleUsage(dicoInit,"Missing value for `--input -i`")
-            if dicoInit["runId"]==dicoInit["runName"]=="": NkDBaddDepthNkSampleUsage(dicoInit,"Sequencing name or id not found in database")
-            # Search sample entry
-            findSample = dicoInit["collect_nk_sample"].find_one({"runid":dicoInit["runId"], "bc": lstArgv[i+1]})
-            if findSample:
-                dicoInit["sampleBc"] = lstArgv[i+1]
-                dicoInit["sampleName"] = findSample["name"]
-            else:
-                findSample = dicoInit["collect_nk_sample"].find_one({"runid":dicoInit["runId"],"name": lstArgv[i+1]})
-                if findSample:
-                    dicoInit["sampleName"] = lstArgv[i+1]
-                    dicoInit["sampleBc"] = findSample["bc"]
-            if dicoInit["sampleBc"]==dicoInit["sampleName"]=="": NkDBaddDepthNkSampleUsage(dicoInit,"Sample name or barcode not found in database")
+            # Search run & sample entries
+            error = searchRunSample(dicoInit,run,sample)
+            if error!="": NkDBaddDepthNkSampleUsage(dicoInit,error)
         
+        #***** ADD batch *****#
+        elif dicoInit["subCmd"]=="add-batch":
+            if len(lstArgv)<3 or lstArgv[2] in ["--help","-h"]: NkDBaddBatchUsage(dicoInit,"")
+            if len(set(["--type","-t"]) & set(lstArgv))==0: NkDBaddBatchUsage(dicoInit,"Missing argument `--type -t`")
+            if len(set(["--input","-i"]) & set(lstArgv))==0: NkDBaddBatchUsage(dicoInit,"Missing argument `--input -i`")
+            dicoInit["batchType"] = ""
+            dicoInit["pathInput"] = ""
+            dicoInit["batchRun"] = ""
+            dicoInit["nbThread"] = 4
+            i = 2
+            while i < len(lstArgv):
+                if lstArgv[i] in ["--quiet","-q"]: i+=1 ; continue
+                if len(lstArgv)<=i+1: NkDBaddBatchUsage(dicoInit,"Missing value for `"+lstArgv[i]+"`")
+                if lstArgv[i] in ["--type","-t"]:
+                    if not lstArgv[i+1] in ["run","depth","vcf","nksample"]: NkDBaddBatchUsage(dicoInit,"Invalid type `"+lstArgv[i+1]+"`")
+                    dicoInit["batchType"] = lstArgv[i+1]
+                elif lstArgv[i] in ["--input","-i"]:
+                    if not os.path.exists(lstArgv[i+1]): NkDBaddBatchUsage(dicoInit,"Input folder or manifest not found `"+lstArgv[i+1]+"`")
+                    dicoInit["pathInput"] = lstArgv[i+1]
+                elif lstArgv[i] in ["--run","-r"]: dicoInit["batchRun"] = lstArgv[i+1]
+                elif lstArgv[i] in ["--threads","-n"]:
+                    try: dicoInit["nbThread"] = int(lstArgv[i+1])
+                    except: NkDBaddBatchUsage(dicoInit,"Bad integer value for `"+lstArgv[i]+"`")
+                    if dicoInit["nbThread"]<1: NkDBaddBatchUsage(dicoInit,"Bad integer value for `"+lstArgv[i]+"`")
+                elif lstArgv[i] in ["--chunk","-c"]:
+                    try: dicoInit["nbChunk"] = int(lstArgv[i+1])
+                    except: NkDBaddBatchUsage(dicoInit,"Bad integer value for `"+lstArgv[i]+"`")
+                    if dicoInit["nbChunk"]<1: NkDBaddBatchUsage(dicoInit,"Bad integer value for `"+lstArgv[i]+"`")
+                else: NkDBaddBatchUsage(dicoInit,"Unknwon optionnal argument `"+lstArgv[i]+"`")
+                i+=2
+            # Check
+            if dicoInit["batchType"]=="": NkDBaddBatchUsage(dicoInit,"Missing value for `--type -t`")
+            if os.path.isdir(dicoInit["pathInput"]) and dicoInit["batchType"]!="run" and dicoInit["batchRun"]=="": NkDBaddBatchUsage(dicoInit,"Missing argument `--run -r` for an input folder")
+            dicoInit["lstBatchJob"],error = listBatchFiles(dicoInit)
+            if error!="": NkDBaddBatchUsage(dicoInit,error)
+            if len(dicoInit["lstBatchJob"])==0: NkDBaddBatchUsage(dicoInit,"Any `"+dicoInit["batchType"]+"` file found in `"+dicoInit["pathInput"]+"`")
+
         #***** DEL run or sample *****#
-        elif dicoInit["subCmd"]=="del-run": exit("\nDEL RUN\n\n")
-        elif dicoInit["subCmd"]=="del-sample": exit("\nDEL SAMPLE\n\n")
+        elif dicoInit["subCmd"] in ["del-run","del-sample"]:
+            if len(lstArgv)<3 or lstArgv[2] in ["--help","-h"]: NkDBdelRunSampleUsage(dicoInit,"")
+            if len(set(["--run","-r"]) & set(lstArgv))==0: NkDBdelRunSampleUsage(dicoInit,"Missing argument `--run -r`")
+            if dicoInit["subCmd"]=="del-sample" and len(set(["--sample","-s"]) & set(lstArgv))==0: NkDBdelRunSampleUsage(dicoInit,"Missing argument `--sample -s`")
+            run = ""
+            sample = ""
+            i = 2
+            while i < len(lstArgv):
+                if lstArgv[i] in ["--quiet","-q"]: i+=1 ; continue
+                if len(lstArgv)<=i+1: NkDBdelRunSampleUsage(dicoInit,"Missing value for `"+lstArgv[i]+"`")
+                if lstArgv[i] in ["--run","-r"]: run = lstArgv[i+1]
+                elif lstArgv[i] in ["--sample","-s"] and dicoInit["subCmd"]=="del-sample": sample = lstArgv[i+1]
+                elif lstArgv[i] in ["--chunk","-c"]:
+                    try: dicoInit["nbChunk"] = int(lstArgv[i+1])
+                    except: NkDBdelRunSampleUsage(dicoInit,"Bad integer value for `"+lstArgv[i]+"`")
+                    if dicoInit["nbChunk"]<1: NkDBdelRunSampleUsage(dicoInit,"Bad integer value for `"+lstArgv[i]+"`")
+                elif lstArgv[i]=="--covstore":
+                    if not os.path.isfile(os.path.join(lstArgv[i+1],"covstore.json")): NkDBdelRunSampleUsage(dicoInit,"Depth store not found `"+lstArgv[i+1]+"` (see `init-covstore`)")
+                    dicoInit["pathCovStore"] = lstArgv[i+1]
+                else: NkDBdelRunSampleUsage(dicoInit,"Unknwon optionnal argument `"+lstArgv[i]+"`")
+                i+=2
+            # Search run & sample entries
+            if dicoInit["subCmd"]=="del-run": error = searchRun(dicoInit,run)
+            else: error = searchRunSample(dicoInit,run,sample)
+            if error!="": NkDBdelRunSampleUsage(dicoInit,error)
 
         #***** LIST runs or samples *****#
         elif dicoInit["subCmd"] in ["list-run","list-sample"]:
@@ -228,12 +460,21 @@ def NkDBargManager(lstArgv,dicoInit):
             if len(set(["--pretty","-p"]) & set(lstArgv))==1: dicoInit["listPretty"] = True
             else: dicoInit["listPretty"] = False
             dicoInit["pathOutput"] = ""
+            dicoInit["listProject"] = ""
+            dicoInit["listInstrument"] = ""
+            dicoInit["listFrom"] = ""
+            dicoInit["listTo"] = ""
             i = 2
             while i < len(lstArgv):
-                if len(lstArgv)<=i+1 and not lstArgv[i] in ["-p","--pretty"]: NkDBlistRunSampleUsage(dicoInit,"Missing value for `"+lstArgv[i]+"`")
+                if len(lstArgv)<=i+1 and not lstArgv[i] in ["-p","--pretty","-q","--quiet"]: NkDBlistRunSampleUsage(dicoInit,"Missing value for `"+lstArgv[i]+"`")
                 if lstArgv[i] in ["--output","-o"]: dicoInit["pathOutput"] = lstArgv[i+1] ; i+=2
-                elif lstArgv[i] in ["-p","--pretty"]: i+=1
-                else: NkDBlistRunSampleUsage(dicoInit,"Unknwon optionnal argument for `list-sample`")
+                elif lstArgv[i] in ["-p","--pretty","-q","--quiet"]: i+=1
+                elif lstArgv[i]=="--project": dicoInit["listProject"] = lstArgv[i+1] ; i+=2
+                elif lstArgv[i]=="--instrument": dicoInit["listInstrument"] = lstArgv[i+1] ; i+=2
+                elif lstArgv[i] in ["--from","--to"]:
+                    if not re.match("^[0-9]{4}-[0-9]{2}-[0-9]{2}$",lstArgv[i+1]): NkDBlistRunSampleUsage(dicoInit,"Bad date value for `"+lstArgv[i]+"` (YYYY-MM-DD)")
+                    dicoInit["list"+lstArgv[i][2:].capitalize()] = lstArgv[i+1] ; i+=2
+                else: NkDBlistRunSampleUsage(dicoInit,"Unknwon optionnal argument for `"+dicoInit["subCmd"]+"`")
             # Check
             if dicoInit["pathOutput"] in ["","-p","--pretty"]: NkDBlistRunSampleUsage(dicoInit,"Missing value for `--output -o`")
 
@@ -242,20 +483,191 @@ def NkDBargManager(lstArgv,dicoInit):
             if len(lstArgv)<4 or lstArgv[2] in ["--help","-h"]: NkDBaddGetVarUsage(dicoInit,"")
             if len(set(["--input","-i"]) & set(lstArgv))==0: NkDBaddGetVarUsage(dicoInit,"Missing argument `--input -i`")
             dicoInit["varInput"] = ""
+            dicoInit["pathOutput"] = ""
             dicoInit["mindepth"] = 20
-            for i in range(2,len(lstArgv),2):
+            i = 2
+            while i < len(lstArgv):
+                if lstArgv[i] in ["--quiet","-q"]: i+=1 ; continue
                 if len(lstArgv)<=i+1: NkDBaddGetVarUsage(dicoInit,"Missing value for `"+lstArgv[i]+"`")
                 if lstArgv[i] in ["--input","-i"]: dicoInit["varInput"] = lstArgv[i+1]
+                elif lstArgv[i] in ["--output","-o"]:
+                    if not check_file_writable(lstArgv[i+1]): NkDBaddGetVarUsage(dicoInit,"Output file not writable `"+lstArgv[i+1]+"`")
+                    dicoInit["pathOutput"] = lstArgv[i+1]
                 elif lstArgv[i] in ["--mindepth","-m"]:
                     try: dicoInit["mindepth"] = int(lstArgv[i+1])
                     except: NkDBaddGetVarUsage(dicoInit,"Bad integer value for `"+lstArgv[i]+"`")
-            if dicoInit["varInput"]=="": addGetVarUsage(dicoInit,"Missing value for `--input -i`")
-            elif not re.search("chr[123456789YXM][0-9]?_[0-9]+_[ATGC]+_[ATGC]+",lstArgv[3]): NkDBaddGetVarUsage(dicoInit,"Invalid variant format `"+lstArgv[3]+"`")
+                elif lstArgv[i] in ["--chunk","-c"]:
+                    try: dicoInit["nbChunk"] = int(lstArgv[i+1])
+                    except: NkDBaddGetVarUsage(dicoInit,"Bad integer value for `"+lstArgv[i]+"`")
+                    if dicoInit["nbChunk"]<1: NkDBaddGetVarUsage(dicoInit,"Bad integer value for `"+lstArgv[i]+"`")
+                elif lstArgv[i]=="--covstore":
+                    if not os.path.isfile(os.path.join(lstArgv[i+1],"covstore.json")): NkDBaddGetVarUsage(dicoInit,"Depth store not found `"+lstArgv[i+1]+"` (see `init-covstore`)")
+                    dicoInit["pathCovStore"] = lstArgv[i+1]
+                else: NkDBaddGetVarUsage(dicoInit,"Unknwon optionnal argument `"+lstArgv[i]+"`")
+                i+=2
+            if dicoInit["varInput"]=="": NkDBaddGetVarUsage(dicoInit,"Missing value for `--input -i`")
+            # Batch mode
+            elif os.path.isfile(dicoInit["varInput"]):
+                if dicoInit["pathOutput"]=="": NkDBaddGetVarUsage(dicoInit,"Missing argument `--output -o` for an input file")
+            elif not reVarId.fullmatch(dicoInit["varInput"]): NkDBaddGetVarUsage(dicoInit,"Invalid variant format `"+dicoInit["varInput"]+"`")
+
+        #***** GET REGION VARIANTS & COVERAGE *****#
+        elif dicoInit["subCmd"]=="get-region":
+            if len(lstArgv)<4 or lstArgv[2] in ["--help","-h"]: NkDBgetRegionUsage(dicoInit,"")
+            if len(set(["--input","-i"]) & set(lstArgv))==0: NkDBgetRegionUsage(dicoInit,"Missing argument `--input -i`")
+            dicoInit["regionInput"] = ""
+            dicoInit["pathOutput"] = ""
+            dicoInit["mindepth"] = 20
+            i = 2
+            while i < len(lstArgv):
+                if lstArgv[i] in ["--quiet","-q"]: i+=1 ; continue
+                if len(lstArgv)<=i+1: NkDBgetRegionUsage(dicoInit,"Missing value for `"+lstArgv[i]+"`")
+                if lstArgv[i] in ["--input","-i"]: dicoInit["regionInput"] = lstArgv[i+1]
+                elif lstArgv[i] in ["--output","-o"]:
+                    if not check_file_writable(lstArgv[i+1]): NkDBgetRegionUsage(dicoInit,"Output file not writable `"+lstArgv[i+1]+"`")
+                    dicoInit["pathOutput"] = lstArgv[i+1]
+                elif lstArgv[i] in ["--mindepth","-m"]:
+                    try: dicoInit["mindepth"] = int(lstArgv[i+1])
+                    except: NkDBgetRegionUsage(dicoInit,"Bad integer value for `"+lstArgv[i]+"`")
+                else: NkDBgetRegionUsage(dicoInit,"Unknwon optionnal argument `"+lstArgv[i]+"`")
+                i+=2
+            if dicoInit["regionInput"]=="": NkDBgetRegionUsage(dicoInit,"Missing value for `--input -i`")
+            # BED mode
+            elif os.path.isfile(dicoInit["regionInput"]):
+                if dicoInit["pathOutput"]=="": NkDBgetRegionUsage(dicoInit,"Missing argument `--output -o` for an input file")
+                dicoInit["regionStat"] = { "lines":0, "malformed":0, "lstMalformed":[] }
+                dicoInit["lstRegion"] = list(readRegions(dicoInit["regionInput"],dicoInit["regionStat"]))
+                if len(dicoInit["lstRegion"])==0: NkDBgetRegionUsage(dicoInit,"No region in `"+dicoInit["regionInput"]+"`")
+            else:
+                searchRegion = re.search("^(chr[0-9XYM]+):([0-9,]+)-([0-9,]+)$",dicoInit["regionInput"])
+                if not searchRegion: NkDBgetRegionUsage(dicoInit,"Invalid region format `"+dicoInit["regionInput"]+"`")
+                start = int(searchRegion.group(2).replace(",",""))
+                end = int(searchRegion.group(3).replace(",",""))
+                if start<1 or end<start: NkDBgetRegionUsage(dicoInit,"Invalid region coordinates `"+dicoInit["regionInput"]+"`")
+                dicoInit["lstRegion"] = [(searchRegion.group(1),start,end,"")]
+                dicoInit["regionStat"] = { "lines":1, "malformed":0, "lstMalformed":[] }
+
+        #***** EXPORT *****#
+        elif dicoInit["subCmd"]=="export":
+            if len(lstArgv)<3 or lstArgv[2] in ["--help","-h"]: NkDBexportUsage(dicoInit,"")
+            if len(set(["--output","-o"]) & set(lstArgv))==0: NkDBexportUsage(dicoInit,"Missing argument `--output -o`")
+            dicoInit["pathOutput"] = ""
+            dicoInit["exportDepth"] = False
+            i = 2
+            while i < len(lstArgv):
+                if lstArgv[i] in ["--quiet","-q"]: i+=1 ; continue
+                if lstArgv[i] in ["--depth","-d"]: dicoInit["exportDepth"] = True ; i+=1 ; continue
+                if len(lstArgv)<=i+1: NkDBexportUsage(dicoInit,"Missing value for `"+lstArgv[i]+"`")
+                if lstArgv[i] in ["--output","-o"]:
+                    if not lstArgv[i+1].endswith(".vcf.gz") and not lstArgv[i+1].endswith(".parquet"): NkDBexportUsage(dicoInit,"Output file must end with `.vcf.gz` or `.parquet`")
+                    if not check_file_writable(lstArgv[i+1]): NkDBexportUsage(dicoInit,"Output file not writable `"+lstArgv[i+1]+"`")
+                    dicoInit["pathOutput"] = lstArgv[i+1]
+                elif lstArgv[i] in ["--chunk","-c"]:
+                    try: dicoInit["nbChunk"] = int(lstArgv[i+1])
+                    except: NkDBexportUsage(dicoInit,"Bad integer value for `"+lstArgv[i]+"`")
+                    if dicoInit["nbChunk"]<1: NkDBexportUsage(dicoInit,"Bad integer value for `"+lstArgv[i]+"`")
+                else: NkDBexportUsage(dicoInit,"Unknwon optionnal argument `"+lstArgv[i]+"`")
+                i+=2
+            # Check
+            if dicoInit["pathOutput"]=="": NkDBexportUsage(dicoInit,"Missing value for `--output -o`")
+            if dicoInit["pathOutput"].endswith(".parquet"):
+                if importlib.util.find_spec("pyarrow")==None: NkDBexportUsage(dicoInit,"Python package `pyarrow` required for a parquet output")
+            elif shutil.which("bgzip")==None or shutil.which("tabix")==None: NkDBexportUsage(dicoInit,"`bgzip` and `tabix` required for a VCF output")
+
+        #***** GET SAMPLE VARIANTS *****#
+        elif dicoInit["subCmd"]=="get-sample":
+            if len(lstArgv)<3 or lstArgv[2] in ["--help","-h"]: NkDBgetSampleUsage(dicoInit,"")
+            if len(set(["--run","-r"]) & set(lstArgv))==0: NkDBgetSampleUsage(dicoInit,"Missing argument `--run -r`")
+            if len(set(["--sample","-s"]) & set(lstArgv))==0: NkDBgetSampleUsage(dicoInit,"Missing argument `--sample -s`")
+            if len(set(["--output","-o"]) & set(lstArgv))==0: NkDBgetSampleUsage(dicoInit,"Missing argument `--output -o`")
+            run = ""
+            sample = ""
+            dicoInit["pathOutput"] = ""
+            i = 2
+            while i < len(lstArgv):
+                if lstArgv[i] in ["--quiet","-q"]: i+=1 ; continue
+                if len(lstArgv)<=i+1: NkDBgetSampleUsage(dicoInit,"Missing value for `"+lstArgv[i]+"`")
+                if lstArgv[i] in ["--run","-r"]: run = lstArgv[i+1]
+                elif lstArgv[i] in ["--sample","-s"]: sample = lstArgv[i+1]
+                elif lstArgv[i] in ["--output","-o"]:
+                    if not check_file_writable(lstArgv[i+1]): NkDBgetSampleUsage(dicoInit,"Output file not writable `"+lstArgv[i+1]+"`")
+                    dicoInit["pathOutput"] = lstArgv[i+1]
+                else: NkDBgetSampleUsage(dicoInit,"Unknwon optionnal argument `"+lstArgv[i]+"`")
+                i+=2
+            # Search run & sample entries
+            error = searchRunSample(dicoInit,run,sample)
+            if error!="": NkDBgetSampleUsage(dicoInit,error)
+
+        #***** MIGRATE VARIANT LAYOUT *****#
+        elif dicoInit["subCmd"]=="migrate-varlayout":
+            if len(lstArgv)<3 or lstArgv[2] in ["--help","-h"]: NkDBmigrateVarLayoutUsage(dicoInit,"")
+            dicoInit["targetLayout"] = ""
+            i = 2
+            while i < len(lstArgv):
+                if lstArgv[i] in ["--quiet","-q"]: i+=1 ; continue
+                if len(lstArgv)<=i+1: NkDBmigrateVarLayoutUsage(dicoInit,"Missing value for `"+lstArgv[i]+"`")
+                if lstArgv[i] in ["--layout","-l"]:
+                    if not lstArgv[i+1] in ["field","array"]: NkDBmigrateVarLayoutUsage(dicoInit,"Invalid layout `"+lstArgv[i+1]+"`")
+                    dicoInit["targetLayout"] = lstArgv[i+1]
+                elif lstArgv[i] in ["--chunk","-c"]:
+                    try: dicoInit["nbChunk"] = int(lstArgv[i+1])
+                    except: NkDBmigrateVarLayoutUsage(dicoInit,"Bad integer value for `"+lstArgv[i]+"`")
+                    if dicoInit["nbChunk"]<1: NkDBmigrateVarLayoutUsage(dicoInit,"Bad integer value for `"+lstArgv[i]+"`")
+                else: NkDBmigrateVarLayoutUsage(dicoInit,"Unknwon optionnal argument `"+lstArgv[i]+"`")
+                i+=2
+            if dicoInit["targetLayout"]=="": NkDBmigrateVarLayoutUsage(dicoInit,"Missing value for `--layout -l`")
+
+        #***** MIGRATE DEPTH *****#
+        elif dicoInit["subCmd"]=="migrate-depth":
+            if len(lstArgv)==3 and lstArgv[2] in ["--help","-h"]: NkDBmigrateDepthUsage(dicoInit,"")
+            dicoInit["dropOld"] = False
+            for i in range(2,len(lstArgv),1):
+                if lstArgv[i] in ["--drop","-d"]: dicoInit["dropOld"] = True
+                elif not lstArgv[i] in ["--quiet","-q"]: NkDBmigrateDepthUsage(dicoInit,"Unknwon optionnal argument `"+lstArgv[i]+"`")
+
+        #***** PROFILE REPORT *****#
+        elif dicoInit["subCmd"]=="profile-report":
+            if len(lstArgv)<3 or lstArgv[2] in ["--help","-h"]: NkDBprofileReportUsage(dicoInit,"")
+            dicoInit["pathInput"] = ""
+            dicoInit["pathOutput"] = ""
+            i = 2
+            while i < len(lstArgv):
+                if lstArgv[i] in ["--quiet","-q"]: i+=1 ; continue
+                if len(lstArgv)<=i+1: NkDBprofileReportUsage(dicoInit,"Missing value for `"+lstArgv[i]+"`")
+                if lstArgv[i] in ["--input","-i"]:
+                    if not os.path.exists(lstArgv[i+1]): NkDBprofileReportUsage(dicoInit,"Input file or folder not found `"+lstArgv[i+1]+"`")
+                    dicoInit["pathInput"] = lstArgv[i+1]
+                elif lstArgv[i] in ["--output","-o"]:
+                    if not check_file_writable(lstArgv[i+1]): NkDBprofileReportUsage(dicoInit,"Output file not writable `"+lstArgv[i+1]+"`")
+                    dicoInit["pathOutput"] = lstArgv[i+1]
+                else: NkDBprofileReportUsage(dicoInit,"Unknwon optionnal argument `"+lstArgv[i]+"`")
+                i+=2
+            if dicoInit["pathInput"]=="": NkDBprofileReportUsage(dicoInit,"Missing value for `--input -i`")
+
+        #***** INIT DEPTH STORE *****#
+        elif dicoInit["subCmd"]=="init-covstore":
+            if len(lstArgv)<3 or lstArgv[2] in ["--help","-h"]: NkDBinitCovStoreUsage(dicoInit,"")
+            dicoInit["pathInput"] = ""
+            i = 2
+            while i < len(lstArgv):
+                if lstArgv[i] in ["--quiet","-q"]: i+=1 ; continue
+                if len(lstArgv)<=i+1: NkDBinitCovStoreUsage(dicoInit,"Missing value for `"+lstArgv[i]+"`")
+                if lstArgv[i] in ["--input","-i"]:
+                    if not os.path.isfile(lstArgv[i+1]): NkDBinitCovStoreUsage(dicoInit,"Input file not found `"+lstArgv[i+1]+"`")
+                    dicoInit["pathInput"] = lstArgv[i+1]
+                elif lstArgv[i]=="--covstore":
+                    if os.path.isfile(os.path.join(lstArgv[i+1],"covstore.json")): NkDBinitCovStoreUsage(dicoInit,"Depth store already exists `"+lstArgv[i+1]+"`")
+                    dicoInit["pathCovStore"] = lstArgv[i+1]
+                else: NkDBinitCovStoreUsage(dicoInit,"Unknwon optionnal argument `"+lstArgv[i]+"`")
+                i+=2
+            # Check
+            if dicoInit["pathInput"]=="": NkDBinitCovStoreUsage(dicoInit,"Missing value for `--input -i`")
+            if dicoInit["pathCovStore"]=="": NkDBinitCovStoreUsage(dicoInit,"Missing value for `--covstore`")
 
-        #***** STATS *****#
-        elif dicoInit["subCmd"]=="stats":
+        #***** STATS, INDEXES & AGGREGATES *****#
+        elif dicoInit["subCmd"] in ["stats","init-indexes","rebuild-aggregates"]:
             if len(lstArgv)==3 and lstArgv[2] in ["--help","-h"]: NkDBSimpleUsage(dicoInit,"")
-            if len(lstArgv)>=3: NkDBSimpleUsage(dicoInit,"Any arguments required for `stats`")
+            if len([arg for arg in lstArgv[2:] if not arg in ["--quiet","-q"]])>0: NkDBSimpleUsage(dicoInit,"Any arguments required for `"+dicoInit["subCmd"]+"`")
 
         #***** DISPLAY version or error *****#
         elif dicoInit["subCmd"]=="--version" or dicoInit["subCmd"]=="-v":
@@ -289,6 +701,97 @@ def loadTorrentJson(pathJson):
     if type(HashBarcode)==str: json.load(json.load(StringIO(dataJson["experimentAnalysisSettings"]["barcodedSamples"])))
     return dataJson,HashExp,HashBarcode
 
+#***** READ mosdepth depth BED(.gz) *****#
+# Generator yielding (chrom,start,end,depth) with 0-based start, line by line
+# Malformed lines are counted in dicoStat (and the first line numbers kept)
+def readDepthBed(pathBed,dicoStat):
+    if pathBed.endswith(".gz"): BED = gzip.open(pathBed,'rt')
+    else: BED = open(pathBed,'r',buffering=1048576)
+    for line in BED:
+        dicoStat["lines"]+=1
+        if line=="\n" or line.startswith("#") or line.startswith("track"): continue
+        splitLine = line.rstrip("\n").split("\t")
+        try:
+            start = int(splitLine[1])
+            end = int(splitLine[2])
+            depth = int(float(splitLine[3])) # mosdepth --use-median could output float
+            if end<=start or depth<0: raise ValueError
+        except (IndexError,ValueError):
+            dicoStat["malformed"]+=1
+            if len(dicoStat["lstMalformed"])<5: dicoStat["lstMalformed"].append(dicoStat["lines"])
+            continue
+        if depth>0: yield (splitLine[0],start,end,depth) # zero depth is not stored
+    BED.close()
+
+#***** READ variant ids from a VCF(.gz) or a list file *****#
+# Generator yielding `chrom_pos_ref_alt` ids (one per ALT allele for a VCF)
+# Ids not matching the get-variant format are counted in dicoStat (and the first line numbers kept)
+def readVariantIds(pathInput,dicoStat):
+    if pathInput.endswith(".gz"): FILE = gzip.open(pathInput,'rt')
+    else: FILE = open(pathInput,'r')
+    for line in FILE:
+        dicoStat["lines"]+=1
+        if line.startswith("#") or line.strip()=="": continue
+        splitLine = line.rstrip("\n").split("\t")
+        # VCF record
+        if len(splitLine)>=5: lstVarId = [splitLine[0]+"_"+splitLine[1]+"_"+splitLine[3]+"_"+alt for alt in splitLine[4].split(",") if alt not in [".","*"]]
+        else: lstVarId = [splitLine[0].strip()]
+        if not all([reVarId.fullmatch(varID) for varID in lstVarId]):
+            dicoStat["malformed"]+=1
+            if len(dicoStat["lstMalformed"])<5: dicoStat["lstMalformed"].append(dicoStat["lines"])
+            continue
+        yield from lstVarId
+    FILE.close()
+
+#***** READ regions from a BED(.gz) file *****#
+# Generator yielding (chrom,start,end,name) with 1-based inclusive coordinates
+# Malformed lines are counted in dicoStat (and the first line numbers kept)
+def readRegions(pathInput,dicoStat):
+    if pathInput.endswith(".gz"): FILE = gzip.open(pathInput,'rt')
+    else: FILE = open(pathInput,'r')
+    for line in FILE:
+        dicoStat["lines"]+=1
+        if line.startswith("#") or line.startswith("track") or line.startswith("browser") or line.strip()=="": continue
+        splitLine = line.rstrip("\n").split("\t")
+        try:
+            start = int(splitLine[1])
+            end = int(splitLine[2])
+            if start<0 or end<=start: raise ValueError
+        except (IndexError,ValueError):
+            dicoStat["malformed"]+=1
+            if len(dicoStat["lstMalformed"])<5: dicoStat["lstMalformed"].append(dicoStat["lines"])
+            continue
+        name = ""
+        if len(splitLine)>=4: name = splitLine[3]
+        yield (splitLine[0],start+1,end,name)
+    FILE.close()
+
+#***** LIST add-batch input files *****#
+# Return [(path,run,sample)] from an input folder or a manifest file
+def listBatchFiles(dicoInit):
+    dicoExtension = { "run":[".json"], "depth":[".per-base.bed.gz",".regions.bed.gz",".bed.gz",".bed"], "vcf":["_Nk.vcf.gz","_Nk.vcf",".vcf.gz",".vcf"], "nksample":[".json"] }
+    lstJob = []
+    # Folder: sample name from file name
+    if os.path.isdir(dicoInit["pathInput"]):
+        for fileName in sorted(os.listdir(dicoInit["pathInput"])):
+            for extension in dicoExtension[dicoInit["batchType"]]:
+                if fileName.endswith(extension):
+                    lstJob.append((os.path.join(dicoInit["pathInput"],fileName),dicoInit["batchRun"],fileName[:-len(extension)]))
+                    break
+    # Manifest: path<TAB>run<TAB>sample (relative path from manifest folder)
+    else:
+        MANIFEST = open(dicoInit["pathInput"],'r')
+        for numLine,line in enumerate(MANIFEST,1):
+            if line.strip()=="" or line.startswith("#"): continue
+            splitLine = line.rstrip("\n").split("\t")
+            pathFile = os.path.join(os.path.dirname(os.path.abspath(dicoInit["pathInput"])),splitLine[0])
+            if not os.path.isfile(pathFile): return [],"Input file not found `"+splitLine[0]+"` (manifest line "+str(numLine)+")"
+            if dicoInit["batchType"]=="run": lstJob.append((pathFile,"",""))
+            elif len(splitLine)<3: return [],"Missing run or sample column (manifest line "+str(numLine)+")"
+            else: lstJob.append((pathFile,splitLine[1],splitLine[2]))
+        MANIFEST.close()
+    return lstJob,""
+
 #***** CHECK if output path could be write *****#
 def check_file_writable(fnm):
     if os.path.exists(fnm):
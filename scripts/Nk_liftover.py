@@ -0,0 +1,148 @@
+#=====================================================
+# -*- coding: utf-8 -*-                              |
+# title           : Nk_liftover.py                   |
+# description     : In-memory UCSC chain liftover    |
+# author          : dooguypapua                      |
+# copyright       : CHU Angers                       |
+# date            : 20201020                         |
+# version         : 0.1                              |
+# python_version  : 3.8.2                            |
+#=====================================================
+import os
+import gzip
+import bisect
+import heapq
+import pickle
+
+
+# Chain indexes by path (one parsing per process)
+dicoChainCache = {}
+# Chain index layout version (stored in the disk cache, older caches are rebuilt)
+chainIndexVersion = 2
+
+
+
+#***** PARSE chain file *****#
+# Return { source chrom : [chain] } with chains sorted by decreasing score
+# chain = (score, tStart, tEnd, qName, qSize, qStrand, lstBlockStart, lstBlockEnd, lstBlockQStart) (0-based)
+def parseChain(pathChain):
+    dicoChain = {}
+    if pathChain.endswith(".gz"): CHAIN = gzip.open(pathChain,'rt')
+    else: CHAIN = open(pathChain,'r')
+    chain = None
+    for line in CHAIN:
+        splitLine = line.split()
+        if len(splitLine)==0: continue
+        # chain score tName tSize tStrand tStart tEnd qName qSize qStrand qStart qEnd id
+        if splitLine[0]=="chain":
+            tName = splitLine[2]
+            tPos = int(splitLine[5])
+            qPos = int(splitLine[10])
+            chain = (int(splitLine[1]), int(splitLine[5]), int(splitLine[6]), splitLine[7], int(splitLine[8]), splitLine[9], [], [], [])
+            if not tName in dicoChain: dicoChain[tName] = []
+            dicoChain[tName].append(chain)
+        # size dt dq (last block line only contains size)
+        else:
+            size = int(splitLine[0])
+            chain[6].append(tPos)
+            chain[7].append(tPos+size)
+            chain[8].append(qPos)
+            if len(splitLine)==3:
+                tPos+=size+int(splitLine[1])
+                qPos+=size+int(splitLine[2])
+    CHAIN.close()
+    for tName in dicoChain: dicoChain[tName].sort(key=lambda chain: -chain[0])
+    return dicoChain
+
+#***** INDEX chain blocks *****#
+# Return { source chrom : (lstStart, lstEnd, lstQStart, lstQuery) } = sorted disjoint intervals (0-based)
+# covering all chain blocks, each interval lifted by the highest scoring chain with a block containing it
+# (qPos0 = lstQStart[i]+pos0-lstStart[i] on lstQuery[i] = (qName, qSize, qStrand))
+def indexChain(dicoChain):
+    dicoIndex = {}
+    for tName in dicoChain:
+        # Blocks (start, end, chain rank, qStart, query), rank 0 = highest score
+        lstBlock = []
+        for rank,(score,tStart,tEnd,qName,qSize,qStrand,lstBlockStart,lstBlockEnd,lstBlockQStart) in enumerate(dicoChain[tName]):
+            query = (qName,qSize,qStrand)
+            for i in range(len(lstBlockStart)): lstBlock.append((lstBlockStart[i],lstBlockEnd[i],rank,lstBlockQStart[i],query))
+        lstBlock.sort(key=lambda block: block[0])
+        lstBound = sorted(set([block[0] for block in lstBlock]+[block[1] for block in lstBlock]))
+        # Sweep block bounds with a heap of the open blocks by rank (ended blocks removed when on top)
+        lstStart,lstEnd,lstQStart,lstQuery = [],[],[],[]
+        lstHeap = []
+        b = 0
+        prevBlock = None
+        for k in range(len(lstBound)-1):
+            while b<len(lstBlock) and lstBlock[b][0]==lstBound[k]:
+                heapq.heappush(lstHeap,(lstBlock[b][2],b))
+                b+=1
+            while lstHeap and lstBlock[lstHeap[0][1]][1]<=lstBound[k]: heapq.heappop(lstHeap)
+            if not lstHeap: continue
+            block = lstBlock[lstHeap[0][1]]
+            # Extend the previous interval if lifted by the same block
+            if block is prevBlock and lstEnd[-1]==lstBound[k]: lstEnd[-1] = lstBound[k+1]
+            else:
+                lstStart.append(lstBound[k])
+                lstEnd.append(lstBound[k+1])
+                lstQStart.append(block[3]+lstBound[k]-block[0])
+                lstQuery.append(block[4])
+            prevBlock = block
+        dicoIndex[tName] = (lstStart,lstEnd,lstQStart,lstQuery)
+    return dicoIndex
+
+#***** LOAD chain index *****#
+# Chain index (see indexChain) is cached on disk (next to the chain file or in ~/.cache/niourk)
+# and invalidated when the chain file size or modification time or the index version change
+def loadChainIndex(pathChain):
+    if pathChain in dicoChainCache: return dicoChainCache[pathChain]
+    chainStat = (chainIndexVersion,os.path.getsize(pathChain),os.path.getmtime(pathChain))
+    lstPathCache = [pathChain+".pkl", os.path.join(os.path.expanduser("~"),".cache","niourk",os.path.basename(pathChain)+".pkl")]
+    # Search valid cache
+    for pathCache in lstPathCache:
+        try:
+            PKL = open(pathCache,'rb')
+            cacheStat,dicoChain = pickle.load(PKL)
+            PKL.close()
+            if cacheStat==chainStat:
+                dicoChainCache[pathChain] = dicoChain
+                return dicoChain
+        except: pass
+    # Parse, index & write cache
+    dicoChain = indexChain(parseChain(pathChain))
+    for pathCache in lstPathCache:
+        try:
+            os.makedirs(os.path.dirname(pathCache),exist_ok=True)
+            PKL = open(pathCache+".tmp",'wb')
+            pickle.dump((chainStat,dicoChain),PKL,protocol=pickle.HIGHEST_PROTOCOL)
+            PKL.close()
+            os.replace(pathCache+".tmp",pathCache)
+            break
+        except: pass
+    dicoChainCache[pathChain] = dicoChain
+    return dicoChain
+
+#***** LIFT a position *****#
+# Return (chrom,pos,strand) for a 1-based position or None if unmapped
+# (highest scoring chain with an aligned block containing the position, one bisect in the chain index)
+def liftPosition(dicoChain,chrom,pos):
+    if not chrom in dicoChain: return None
+    pos0 = pos-1
+    lstStart,lstEnd,lstQStart,lstQuery = dicoChain[chrom]
+    i = bisect.bisect_right(lstStart,pos0)-1
+    if i<0 or pos0>=lstEnd[i]: return None
+    qName,qSize,qStrand = lstQuery[i]
+    qPos0 = lstQStart[i]+pos0-lstStart[i]
+    if qStrand=="-": qPos0 = qSize-qPos0-1
+    return (qName,qPos0+1,qStrand)
+
+#***** LIFT a batch of positions *****#
+# lstRecord = [(chrom,pos,payload)] => ([(newChrom,newPos,payload)] , [(chrom,pos,payload)])
+def liftBatch(dicoChain,lstRecord):
+    lstMapped = []
+    lstUnmapped = []
+    for chrom,pos,payload in lstRecord:
+        lifted = liftPosition(dicoChain,chrom,pos)
+        if lifted==None: lstUnmapped.append((chrom,pos,payload))
+        else: lstMapped.append((lifted[0],lifted[1],payload))
+    return lstMapped,lstUnmapped
@@ -8,23 +8,240 @@
 # version         : 0.1                              |
 # python_version  : 3.8.2                            |
 #==========================================================================================================
-# USAGE: Nk_mergeVCF.py niourkVersion path_gatk pathVT pathVcfValidator pathVCFraw pathFasta DPfilter sample VCFin ... VCFin
+# USAGE: Nk_mergeVCF.py niourkVersion path_gatk pathVT pathVcfValidator pathVCFraw pathFasta DPfilter sample [--cpus=N] [--engine=E] VCFin ... VCFin
+#        --cpus=N    callers preprocessed concurrently (default: available cpus)
+#        --engine=E  DP filter & sort engine, `native` (default) or `gatk` (VariantFiltration & SortVcf)
 # OUT  : VCFmergeOut or Errors 
 #==========================================================================================================
 import sys
 import os
+import re
+import heapq
+import itertools
 import shutil
+import signal
 import subprocess
+import tempfile
+import threading
+import warnings
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 import vcfpy
 import numpy
 import collections
 
 
+# TVC contig header `assembly=` attribute
+re_assembly = re.compile(",assembly=[^,]*,")
+# Contig header ID
+re_contig_id = re.compile("^##contig=<ID=([^,>]+)")
+# Records sorted in memory by the native sort (larger VCFs are sorted by chunks merged from temporary files)
+nb_sort_buffer = 1000000
+
+
+def sanitizeVCF(path_vcf,pathFasta):
+    # Single pass replacing the former sed | file | iconv chain, yield UTF-8 lines:
+    # 1 - remove bad tvc <0x00>
+    # 2 - delete assembly info in TVC contig header
+    # 3 - replace reference tag by the pipeline FASTA
+    # 4 - replace AN=1 to AN=2 for octopus
+    # 5 - decode to UTF-8 (lines not valid in UTF-8 are read as latin-1)
+    # (one yield per input line, removed lines are yielded empty)
+    with open(path_vcf,'rb') as IN:
+        for raw_line in IN:
+            raw_line = raw_line.replace(b"\x00",b"")
+            try: line = raw_line.decode('utf-8')
+            except UnicodeDecodeError: line = raw_line.decode('latin-1')
+            line = re_assembly.sub(",",line)
+            if "##reference" in line: line = ""
+            if "#CHROM" in line: line = line.replace("#CHROM","##reference="+pathFasta+"\n#CHROM")
+            yield line.replace("AN=1","AN=2")
+
+
+def writeVCF(lst_line,path_vcf):
+    with open(path_vcf,'w',encoding='utf-8',buffering=1048576) as OUT:
+        OUT.writelines(lst_line)
+
+
+# Running commands of the caller workers (killed at the first caller error)
+set_process = set()
+lock_process = threading.Lock()
+abort_event = threading.Event()
+
+
+def runCmd(cmd):
+    # Own process group so that the whole shell pipeline (java, vt) can be killed
+    # (registered & abort checked under the lock, a command started while aborting is killed at once)
+    if abort_event.is_set(): exit("aborted")
+    process = subprocess.Popen([cmd], stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True, start_new_session=True)
+    with lock_process:
+        set_process.add(process)
+        if abort_event.is_set():
+            try: os.killpg(process.pid,signal.SIGTERM)
+            except OSError: pass
+    out, err = process.communicate()
+    with lock_process: set_process.discard(process)
+    return process.returncode,out,err
+
+
+def abortCmds():
+    abort_event.set()
+    with lock_process:
+        for process in set_process:
+            try: os.killpg(process.pid,signal.SIGTERM)
+            except OSError: pass
+
+
+def filterDP(lst_line,dp_filter,path_vcf):
+    # Native VariantFiltration --filter-expression "DP >= dp_filter" --filter-name "DepthofQuality":
+    # matching records (INFO DP, missing DP never matches) get DepthofQuality added to their filters,
+    # others unfiltered records (".") become PASS, empty lines are removed
+    # (lst_line = sanitized lines of path_vcf, one per input line)
+    bool_header = False
+    for line_number,line in enumerate(lst_line,1):
+        if line.strip()=="": continue
+        if line.startswith("#"):
+            if line.startswith("##FILTER=<ID=DepthofQuality,"): bool_header = True
+            elif "#CHROM" in line and bool_header==False: line = line.replace("#CHROM","##FILTER=<ID=DepthofQuality,Description=\"DP >= "+str(dp_filter)+"\">\n#CHROM")
+            yield line
+            continue
+        split_line = line.split("\t",8)
+        if len(split_line)<8: exit("🅴 🆁 🆁 🅾 🆁\n[Nk_mergeVCF] Malformed VCF record `"+os.path.basename(path_vcf)+"` line "+str(line_number)+" ("+str(len(split_line))+" columns)")
+        bool_match = False
+        for info in split_line[7].split(";"):
+            if info.startswith("DP="):
+                try: bool_match = float(info[3:])>=dp_filter
+                except ValueError: pass
+                break
+        if split_line[6] in [".","PASS"]: lst_filter = []
+        else: lst_filter = split_line[6].split(";")
+        if bool_match==True and not "DepthofQuality" in lst_filter: lst_filter.append("DepthofQuality")
+        if len(lst_filter)==0: split_line[6] = "PASS"
+        else: split_line[6] = ";".join(lst_filter)
+        yield "\t".join(split_line)
+
+
+def contigRank(dico_contig,chrom):
+    # Sort rank of a contig: (header index,"") for header contigs (dico_contig), contigs missing in the
+    # header are ranked after them by name, whatever the order in which their records are met
+    if chrom in dico_contig: return dico_contig[chrom]
+    return (sys.maxsize,chrom)
+
+
+def sortLines(lst_line):
+    # Native SortVcf: records sorted by header ##contig order then position (stable for equal positions),
+    # contigs missing in the header are placed after, by name (see contigRank)
+    dico_contig = {}
+    lst_chunk = []
+    lst_record = []
+    def record_key(line):
+        chrom,pos,_ = line.split("\t",2)
+        return (contigRank(dico_contig,chrom),int(pos))
+    def chunk_reader(CHUNK):
+        CHUNK.seek(0)
+        for line in CHUNK: yield line
+        CHUNK.close()
+    for line in lst_line:
+        if line.startswith("#"):
+            match_contig = re_contig_id.match(line)
+            if match_contig and not match_contig.group(1) in dico_contig: dico_contig[match_contig.group(1)] = (len(dico_contig),"")
+            yield line
+            continue
+        if not line.endswith("\n"): line+="\n"
+        lst_record.append(line)
+        if len(lst_record)==nb_sort_buffer:
+            lst_record.sort(key=record_key)
+            CHUNK = tempfile.TemporaryFile(mode='w+',encoding='utf-8')
+            CHUNK.writelines(lst_record)
+            lst_chunk.append(chunk_reader(CHUNK))
+            lst_record = []
+    lst_record.sort(key=record_key)
+    if len(lst_chunk)==0: yield from lst_record
+    else: yield from heapq.merge(*lst_chunk,lst_record,key=record_key)
+
+
 def sortVCF(pathVCFUnsorted,pathVCFSorted):
     cmd_sort_vcf = path_gatk+" SortVcf -I "+pathVCFUnsorted+" -O "+pathVCFSorted
-    process = subprocess.Popen([cmd_sort_vcf], stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-    out, err = process.communicate()
-    if process.returncode!=0: exit("🅴 🆁 🆁 🅾 🆁\n[Nk_mergeVCF] Sort merged VCF\n    "+err.decode('utf-8'))
+    returncode,out,err = runCmd(cmd_sort_vcf)
+    if returncode!=0: exit("🅴 🆁 🆁 🅾 🆁\n[Nk_mergeVCF] Sort VCF `"+os.path.basename(pathVCFUnsorted)+"`\n    "+err.decode('utf-8'))
+
+
+def callerRecords(vcf_reader,index_caller,dico_contig):
+    # Yield ((contig rank, pos), caller index, record) of a sorted normalized caller VCF
+    # (contigs missing in the merged header are placed after by name, as by sortLines)
+    prev_key = ((-1,""),0)
+    for record in vcf_reader:
+        key = (contigRank(dico_contig,record.CHROM),record.POS)
+        if key<prev_key: exit("🅴 🆁 🆁 🅾 🆁\n[Nk_mergeVCF] Unsorted normalized VCF `"+os.path.basename(vcf_reader.path)+"` at "+record.CHROM+":"+str(record.POS))
+        prev_key = key
+        yield (key,index_caller,record)
+
+
+# Merged variants per feature batch (batch arrays are doubled if a position exceeds it)
+nb_merge_batch = 10000
+# Caller feature columns: (dtype, missing caller value)
+dico_feature_default = { "QUAL":(numpy.float64,numpy.nan), "DP":(numpy.float64,numpy.nan), "AF":(numpy.float64,numpy.nan), \
+                         "GT":(numpy.int32,-1), "PASS":(numpy.bool_,False), "ONLYPASS":(numpy.bool_,False), \
+                         "strQUAL":(object,"."), "strFILTER":(object,".") }
+
+
+class MergedVariant:
+    # Merged variant coordinates, ALT of its first call and row of its caller features in the batch
+    __slots__ = ("chrom","pos","ref","alt","row")
+
+    def __init__(self,chrom,pos,ref,alt,row):
+        self.chrom = chrom
+        self.pos = pos
+        self.ref = ref
+        self.alt = alt
+        self.row = row
+
+
+def initFeatures(nb_row,nb_caller):
+    # Preallocated columnar caller features [merged variant row, caller column]
+    dico_feature = {}
+    for feature,(dtype,missing) in dico_feature_default.items(): dico_feature[feature] = numpy.full((nb_row,nb_caller),missing,dtype=dtype)
+    return dico_feature
+
+
+def joinColumns(arr_str):
+    # "|".join of the caller columns of each row
+    arr_join = arr_str[:,0].astype(str)
+    for col in range(1,arr_str.shape[1]): arr_join = numpy.char.add(numpy.char.add(arr_join,"|"),arr_str[:,col].astype(str))
+    return arr_join
+
+
+def writeBatch(writer,lst_variant,dico_feature,lst_gt,sample_name):
+    # Merge caller features of a batch of variants (vectorized over rows) then write records & reset rows
+    nb_row = len(lst_variant)
+    dico_batch = dict([(feature,dico_feature[feature][:nb_row]) for feature in dico_feature])
+    # QUAL, DP & AF medians of the calling callers (QUAL is NaN if all callers QUAL are missing)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore",RuntimeWarning)
+        arr_qual = numpy.round(numpy.nanmedian(dico_batch["QUAL"],axis=1),0)
+    arr_dp = numpy.round(numpy.nanmedian(dico_batch["DP"],axis=1),0)
+    arr_af = numpy.round(numpy.nanmedian(dico_batch["AF"],axis=1),2)
+    # FILTER: PASS if at least one caller only PASS
+    arr_filter = numpy.where(dico_batch["ONLYPASS"].any(axis=1),"PASS","FILTER")
+    # INFO
+    arr_callnb = numpy.count_nonzero(dico_batch["PASS"],axis=1)
+    arr_callaf = joinColumns(numpy.where(numpy.isnan(dico_batch["AF"]),".",dico_batch["AF"].astype(str)))
+    arr_callfilter = joinColumns(dico_batch["strFILTER"])
+    arr_callqual = joinColumns(dico_batch["strQUAL"])
+    # GT: genotype if all calling callers agree (./. ignored) else ./.
+    arr_gt_max = dico_batch["GT"].max(axis=1)
+    arr_gt_min = numpy.where(dico_batch["GT"]>=0,dico_batch["GT"],numpy.iinfo(numpy.int32).max).min(axis=1)
+    lst_format_id = ['GT', 'DP', 'AF']
+    for variant in lst_variant:
+        row = variant.row
+        if arr_gt_max[row]>=0 and arr_gt_min[row]==arr_gt_max[row]: field_gt = lst_gt[arr_gt_max[row]]
+        else: field_gt = "./."
+        if numpy.isnan(arr_qual[row]): field_qual = None
+        else: field_qual = int(arr_qual[row])
+        dico_info = { "CALLNB":[int(arr_callnb[row])], "CALLAF":[str(arr_callaf[row])], "CALLFILTER":[str(arr_callfilter[row])], "CALLQUAL":[str(arr_callqual[row])] }
+        dico_calls = [vcfpy.Call(sample_name, {'GT':field_gt, 'DP':int(arr_dp[row]), 'AF':[float(arr_af[row])]})]
+        writer.write_record(vcfpy.Record(variant.chrom, variant.pos, ".", variant.ref, variant.alt, field_qual, [str(arr_filter[row])], dico_info, lst_format_id, dico_calls))
+    for feature,(dtype,missing) in dico_feature_default.items(): dico_batch[feature][:] = missing
 
 
 
@@ -36,8 +253,7 @@ def validateVCF(path_vcfvalidator,path_vcf):
     os.mkdir(path_dir_validate)
     # Create process
     cmd_validate = path_vcfvalidator+" -o "+path_dir_validate+" --require-evidence < "+path_vcf
-    process = subprocess.Popen([cmd_validate], stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-    out, err = process.communicate()
+    returncode,out,err = runCmd(cmd_validate)
     # retrieve statuts & summary file path
     statut = ""
     boolvalid = False
@@ -57,28 +273,81 @@ def validateVCF(path_vcfvalidator,path_vcf):
     return (boolvalid,lst_errors)
 
 
+def formatVCF(path_vcf,engine,pathFasta,dp_filter):
+    # CPU-bound caller stage, run in a worker process:
+    # native: format > DP filter > sort in a single streaming pass, without intermediate files
+    # gatk: format only (DP filter & sort by GATK in preprocessVCF)
+    if engine=="native":
+        try: writeVCF(sortLines(filterDP(sanitizeVCF(path_vcf,pathFasta),dp_filter,path_vcf)),path_vcf.replace(".vcf","_filtered_sort.vcf"))
+        except OSError as e: exit("🅴 🆁 🆁 🅾 🆁\n[Nk_mergeVCF] Format, filter & sort `"+os.path.basename(path_vcf)+"`\n    "+str(e))
+    else:
+        try: writeVCF(sanitizeVCF(path_vcf,pathFasta),path_vcf.replace(".vcf","_formatencode.vcf"))
+        except OSError as e: exit("🅴 🆁 🆁 🅾 🆁\n[Nk_mergeVCF] Format & encode\n    "+str(e))
+
+
+def preprocessVCF(path_vcf):
+    # One formatted caller VCF: (gatk DP filter > sort) > validate > decompose & normalize
+    path_temp_vcf = path_vcf.replace(".vcf","_formatencode.vcf")
+    path_filtered_vcf = path_vcf.replace(".vcf","_filtered.vcf")
+    path_filteredSort_vcf = path_vcf.replace(".vcf","_filtered_sort.vcf")
+    path_normalized_vcf = path_vcf.replace(".vcf","_normalize.vcf")
+
+    #***** FILTER by DP > SORT *****#
+    if engine=="gatk":
+        cmd_vcffilter = path_gatk+" VariantFiltration --output "+path_filtered_vcf+" --variant "+path_temp_vcf+" --filter-expression \"DP >= "+str(dp_filter)+"\" --filter-name \"DepthofQuality\""
+        returncode,out,err = runCmd(cmd_vcffilter)
+        if returncode!=0: exit("🅴 🆁 🆁 🅾 🆁\n[Nk_mergeVCF] DP VariantFiltration `"+os.path.basename(path_vcf)+"`\n    "+err.decode('utf-8'))
+        sortVCF(path_filtered_vcf,path_filteredSort_vcf)
+
+    #***** VALIDATE *****#
+    boolvalid,lst_errors = validateVCF(path_vcfvalidator,path_filteredSort_vcf)
+    if boolvalid==False: exit("🅴 🆁 🆁 🅾 🆁\n[Nk_mergeVCF] Validate VCF `"+os.path.basename(path_filteredSort_vcf)+"`\n    "+"\n    ".join(lst_errors))
+
+    #***** COPY VCF to raw output folder *****#
+    shutil.copy(path_filteredSort_vcf,pathVCFraw+"/"+os.path.basename(path_filteredSort_vcf))
+
+    #***** DECOMPOSE & NORMALIZE *****#
+    cmd_vt = path_vt+" decompose -s "+path_filteredSort_vcf+" | "+path_vt+" normalize -r "+pathFasta+" -o "+path_normalized_vcf+" -"
+    returncode,out,err = runCmd(cmd_vt)
+    if returncode!=0: exit("🅴 🆁 🆁 🅾 🆁\n[Nk_mergeVCF] Decompose & Normalize `"+os.path.basename(path_vcf)+"`\n    "+err.decode('utf-8'))
+    return path_normalized_vcf
+
+
 
 #***** ARGUMENTS *****#
-if len(sys.argv)<11: exit("[Nk_mergeVCF] Missing arguments")
+# Options (--cpus=N, --engine=E) can be placed anywhere
+lst_argv = [sys.argv[0]]
+cpus = str(len(os.sched_getaffinity(0)))
+engine = "native"
+for arg in sys.argv[1:]:
+    if arg.startswith("--cpus="): cpus = arg.split("=",1)[1]
+    elif arg.startswith("--engine="): engine = arg.split("=",1)[1]
+    else: lst_argv.append(arg)
+if len(lst_argv)<11: exit("[Nk_mergeVCF] Missing arguments")
 lst_vcf_arg = []
-for i in range(1,len(sys.argv),1):
-    if i==1: niourkVersion = sys.argv[i]
-    elif i==2: path_gatk = sys.argv[i]
-    elif i==3: path_vt = sys.argv[i]
-    elif i==4: path_vcfvalidator = sys.argv[i]
-    elif i==5: pathVCFraw = sys.argv[i]
-    elif i==6: pathFasta = sys.argv[i]
-    elif i==7: DPfilter = sys.argv[i]
-    elif i==8: sample = sys.argv[i]
-    else: lst_vcf_arg.append(sys.argv[i])
+for i in range(1,len(lst_argv),1):
+    if i==1: niourkVersion = lst_argv[i]
+    elif i==2: path_gatk = lst_argv[i]
+    elif i==3: path_vt = lst_argv[i]
+    elif i==4: path_vcfvalidator = lst_argv[i]
+    elif i==5: pathVCFraw = lst_argv[i]
+    elif i==6: pathFasta = lst_argv[i]
+    elif i==7: DPfilter = lst_argv[i]
+    elif i==8: sample = lst_argv[i]
+    else: lst_vcf_arg.append(lst_argv[i])
 # Check errors
 errors = ""
-# tools errors
-if not os.path.isfile(path_gatk): errors+="    Unable to find GATK `"+path_gatk+"`\n"
-process = subprocess.Popen([path_gatk], stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-out, err = process.communicate()
-if process.returncode!=0: errors+="    Unable to launch GATK `"+path_gatk+"`\n"
-elif not str(out).__contains__("GATK"): errors+="    Invalid GATK application `"+path_vt+"`\n"
+try: nb_cpus = int(cpus)
+except: nb_cpus = 0
+if nb_cpus<1: errors+="    Invalid cpus value `"+cpus+"`\n"
+if not engine in ["native","gatk"]: errors+="    Invalid engine `"+engine+"` (native or gatk)\n"
+# tools errors (GATK only used by the gatk engine)
+if engine=="gatk":
+    if not os.path.isfile(path_gatk): errors+="    Unable to find GATK `"+path_gatk+"`\n"
+    process = subprocess.Popen([path_gatk], stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
+    out, err = process.communicate()
+    if process.returncode!=0: errors+="    Unable to launch GATK `"+path_gatk+"`\n"
+    elif not str(out).__contains__("GATK"): errors+="    Invalid GATK application `"+path_vt+"`\n"
 if not os.path.isfile(path_vt): errors+="    Unable to find vt `"+path_vt+"`\n"
 process = subprocess.Popen([path_vt+" -v"], stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
 out, err = process.communicate()
@@ -108,51 +377,32 @@ if errors!="": exit("🅴 🆁 🆁 🅾 🆁\n[Nk_mergeVCF] Arguments\n"+errors
 
 
 #***** VCF INPUT LOOP *****#
-for path_vcf in lst_vcf_sample:
-
-    path_temp_vcf = path_vcf.replace(".vcf","_formatencode.vcf")
-    path_temp_temp_vcf = path_vcf.replace(".vcf","_formatencode_temp.vcf")
-    path_filtered_vcf = path_vcf.replace(".vcf","_filtered.vcf")
-    path_filteredSort_vcf = path_vcf.replace(".vcf","_filtered_sort.vcf")
-    path_normalized_vcf = path_vcf.replace(".vcf","_normalize.vcf")
-
-    #***** FORMAT & ENCODE *****#
-    cmd_format_vcf = "sed -e 's/\\x0//g'" # 1 - replace bad tvc <0x00>
-    cmd_format_vcf+= " -e 's/,assembly=[^,]*,/,/g'" # 2 - delete assembly info in TVC contig header
-    cmd_format_vcf+= " -e '/##reference.*/d' -e 's/#CHROM/##reference="+pathFasta.replace("/","\\/")+"\\n#CHROM/g'" # 3 - add reference tag
-    cmd_format_vcf+= " -e 's/AN=1/AN=2/g' "+path_vcf+" > "+path_temp_vcf # 4 - replace AN=1 to AN=2 for octopus
-    cmd_format_vcf+= " ; old_encoding=$(file --brief --mime-encoding "+path_temp_vcf+")" # 5 - detect VCF encoding
-    cmd_format_vcf+= " ; iconv -f $old_encoding -t utf-8 "+path_temp_vcf+" > "+path_temp_temp_vcf # 6 - convert encoding
-    cmd_format_vcf+= " ; mv "+path_temp_temp_vcf+" "+path_temp_vcf
-    process = subprocess.Popen([cmd_format_vcf], stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-    out, err = process.communicate()
-    if process.returncode!=0: exit("🅴 🆁 🆁 🅾 🆁\n[Nk_mergeVCF] Format & encode\n    "+err.decode('utf-8'))
-
-    #***** FILTER by DP *****#
-    cmd_vcffilter = path_gatk+" VariantFiltration --output "+path_filtered_vcf+" --variant "+path_temp_vcf+" --filter-expression \"DP >= "+str(dp_filter)+"\" --filter-name \"DepthofQuality\""
-    process = subprocess.Popen([cmd_vcffilter], stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-    out, err = process.communicate()
-    if process.returncode!=0: exit("🅴 🆁 🆁 🅾 🆁\n[Nk_mergeVCF] DP VariantFiltration\n    "+err.decode('utf-8'))
-    # reencode gatk date
-    cmd_format_vcf+= "old_encoding=$(file --brief --mime-encoding "+path_filtered_vcf+")" # 5 - detect VCF encoding
-    cmd_format_vcf+= " ; iconv -f $old_encoding -t utf-8 "+path_filtered_vcf+" > "+path_temp_temp_vcf # 6 - convert encoding
-    cmd_format_vcf+= " ; mv "+path_temp_temp_vcf+" "+path_filtered_vcf
-
-    #***** SORT VCF *****#
-    sortVCF(path_filtered_vcf,path_filteredSort_vcf)
-
-    #***** VALIDATE *****#
-    boolvalid,lst_errors = validateVCF(path_vcfvalidator,path_filteredSort_vcf)
-    if boolvalid==False: exit("🅴 🆁 🆁 🅾 🆁\n[Nk_mergeVCF] Validate VCF `"+os.path.basename(path_filteredSort_vcf)+"`\n    "+"\n    ".join(lst_errors))
-
-    #***** COPY VCF to raw output folder *****#
-    shutil.copy(path_filteredSort_vcf,pathVCFraw+"/"+os.path.basename(path_filteredSort_vcf))
-    
-    #***** DECOMPOSE & NORMALIZE *****#
-    cmd_vt = path_vt+" decompose -s "+path_filteredSort_vcf+" | "+path_vt+" normalize -r "+pathFasta+" -o "+path_normalized_vcf+" -"
-    process = subprocess.Popen([cmd_vt], stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-    out, err = process.communicate()
-    if process.returncode!=0: exit("🅴 🆁 🆁 🅾 🆁\n[Nk_mergeVCF] Decompose & Normalize\n    "+err.decode('utf-8'))
+# Callers are independent: formatted in nb_cpus worker processes (forked before any caller thread,
+# the native filter & sort is CPU-bound) then preprocessed concurrently by nb_cpus threads waiting
+# on the external tools, the first caller error stops the others
+nb_worker = min(nb_cpus,max(1,len(lst_vcf_sample)))
+process_executor = ProcessPoolExecutor(max_workers=nb_worker,mp_context=multiprocessing.get_context("fork"))
+lst_future = [process_executor.submit(formatVCF,path_vcf,engine,pathFasta,dp_filter) for path_vcf in lst_vcf_sample]
+try:
+    for future in as_completed(lst_future): future.result()
+except BaseException:
+    for future in lst_future: future.cancel()
+    process_executor.shutdown(wait=True)
+    raise
+process_executor.shutdown(wait=True)
+# Results collected in input order
+executor = ThreadPoolExecutor(max_workers=nb_worker)
+dico_future = {}
+for i in range(len(lst_vcf_sample)): dico_future[executor.submit(preprocessVCF,lst_vcf_sample[i])] = i
+lst_normalized_vcf = [None]*len(lst_vcf_sample)
+try:
+    for future in as_completed(dico_future): lst_normalized_vcf[dico_future[future]] = future.result()
+except BaseException:
+    abortCmds()
+    for future in dico_future: future.cancel()
+    executor.shutdown(wait=True)
+    raise
+executor.shutdown(wait=True)
 
 
 
@@ -160,21 +410,19 @@ for path_vcf in lst_vcf_sample:
 lst_caller_name = []
 lst_contig_line = []
 dico_filter_line = {}
-dico_vcf = {}
+lst_reader = []
 pathMergeVCF = sample+"_Nk.vcf"
-pathMergeUnsortedVCF = pathMergeVCF.replace(".vcf","_unsorted.vcf")
 #***** INIT new vcf header *****#
 new_header = vcfpy.Header(lines=None, samples=None)
 new_header.add_line(vcfpy.HeaderLine("fileformat","VCFv4.2"))
 new_header.add_line(vcfpy.HeaderLine("Nk_version",niourkVersion))
-#***** BROWSE caller vcf *****#
-for path_vcf in lst_vcf_sample:
+#***** READ caller headers *****#
+for path_vcf,path_normalized_vcf in zip(lst_vcf_sample,lst_normalized_vcf):
     caller_name = os.path.basename(path_vcf).split("_")[2].replace(".vcf","")
     lst_caller_name.append(caller_name)
-    path_normalized_vcf = path_vcf.replace(".vcf","_normalize.vcf")
     vcf_tool_reader = vcfpy.Reader.from_path(path_normalized_vcf)
+    lst_reader.append(vcf_tool_reader)
     vcf_header = vcf_tool_reader.header
-    #***** READ HEADERS *****#
     # check header sample
     if new_header.samples==None: new_header.samples = vcf_header.samples
     # check header filters
@@ -184,22 +432,6 @@ for path_vcf in lst_vcf_sample:
     # check header contigs
     for contig_line in vcf_header.get_lines("contig"):
         if not contig_line in lst_contig_line: lst_contig_line.append(contig_line)
-    #***** READ VARIANTS *****#
-    for record in vcf_tool_reader:
-        var_id = record.CHROM+"_"+str(record.POS)+"_"+record.REF+"_"+str(record.ALT[0].value)
-        if not var_id in dico_vcf: dico_vcf[var_id] = { "features":{}, "ALT":record.ALT, "sample":new_header.samples.names[0]}
-        dico_vcf[var_id]["features"][caller_name] = {}
-        # Variant calling score (QUAL) field
-        dico_vcf[var_id]["features"][caller_name]["QUAL"] = record.QUAL
-        # Filter field
-        dico_vcf[var_id]["features"][caller_name]["FILTER"] = record.FILTER
-        # Genotype (GT) field
-        dico_vcf[var_id]["features"][caller_name]["GT"] = record.calls[0].data.get('GT').replace("|","/")
-        # Read Depth (DP) field
-        dico_vcf[var_id]["features"][caller_name]["DP"] = record.calls[0].data.get('DP')
-        # Allele Frequency (AF) field
-        if caller_name in ["strelka","deepvariant"]: dico_vcf[var_id]["features"][caller_name]["AF"] = round((float(record.calls[0].data['AD'][1])/(float(record.calls[0].data['AD'][0])+float(record.calls[0].data['AD'][1]))),2) # for strelka and deepvariant AD for ref and alt is in FORMAT
-        else: dico_vcf[var_id]["features"][caller_name]["AF"] = round(float(record.INFO['AF'][0]),2)
 #***** CREATE new vcf header *****#
 # Callers list
 new_header.add_line(vcfpy.HeaderLine("Nk_calls","|".join(lst_caller_name)))
@@ -226,65 +458,69 @@ for contig_line in lst_contig_line: new_header.add_line(contig_line)
 # REFERENCE
 new_header.add_line(vcfpy.HeaderLine("reference",pathFasta))
 # Write header
-writer = vcfpy.Writer.from_path(pathMergeUnsortedVCF, new_header)
-#***** CREATE new vcf variant lines *****#
-for var_id in dico_vcf:
-    # Main
-    split_var_id = var_id.split("_")
-    chrom = split_var_id[0]
-    pos = int(split_var_id[1])
-    ref = split_var_id[2]
-    # Compute others fields
-    set_gt = set()
-    lst_dp = []
-    lst_af = []
-    lst_qual = []
-    lst_filter = []
-    nb_call = 0
-    for caller_name in lst_caller_name:
-        if caller_name in dico_vcf[var_id]["features"]:
-            set_gt.add(dico_vcf[var_id]["features"][caller_name]["GT"])
-            if dico_vcf[var_id]["features"][caller_name]["DP"]==None: lst_dp.append(0)
-            else: lst_dp.append(dico_vcf[var_id]["features"][caller_name]["DP"])
-            lst_af.append(dico_vcf[var_id]["features"][caller_name]["AF"])
-            lst_qual.append(dico_vcf[var_id]["features"][caller_name]["QUAL"])
-            lst_filter.append(" ".join(dico_vcf[var_id]["features"][caller_name]["FILTER"]))
-            if "PASS" in dico_vcf[var_id]["features"][caller_name]["FILTER"]: nb_call+=1
+writer = vcfpy.Writer.from_path(pathMergeVCF, new_header)
+#***** K-WAY MERGE of sorted caller VCFs *****#
+# Normalized caller VCFs are walked together by contig (merged header order) and position,
+# only the variants of the current position are kept in memory
+dico_contig = {}
+for contig_line in lst_contig_line:
+    if not contig_line.id in dico_contig: dico_contig[contig_line.id] = (len(dico_contig),"")
+lst_caller_record = [callerRecords(lst_reader[i],i,dico_contig) for i in range(len(lst_reader))]
+sample_name = new_header.samples.names[0]
+dico_feature = initFeatures(nb_merge_batch,len(lst_caller_name))
+lst_variant = []
+# Genotypes ids (GT feature), ./. is stored as missing
+dico_gt = {}
+lst_gt = []
+for var_pos,group in itertools.groupby(heapq.merge(*lst_caller_record,key=lambda item: item[:2]),key=lambda item: item[0]):
+    #***** READ VARIANTS *****#
+    dico_pos_variant = {}
+    for var_pos,index_caller,record in group:
+        caller_name = lst_caller_name[index_caller]
+        var_key = (record.REF,str(record.ALT[0].value))
+        if not var_key in dico_pos_variant:
+            if len(lst_variant)==len(dico_feature["GT"]):
+                dico_new_feature = initFeatures(len(lst_variant),len(lst_caller_name))
+                for feature in dico_feature: dico_feature[feature] = numpy.concatenate((dico_feature[feature],dico_new_feature[feature]))
+            dico_pos_variant[var_key] = MergedVariant(record.CHROM,record.POS,record.REF,record.ALT,len(lst_variant))
+            lst_variant.append(dico_pos_variant[var_key])
+        row = dico_pos_variant[var_key].row
+        # Variant calling score (QUAL) field
+        if record.QUAL==None:
+            dico_feature["QUAL"][row,index_caller] = numpy.nan
+            dico_feature["strQUAL"][row,index_caller] = "."
         else:
-            lst_af.append(".")
-            lst_filter.append(".")
-            lst_qual.append(".")
-    # Qual
-    field_qual = int(round(numpy.median(list(filter((".").__ne__, lst_qual))),0))
-    # Filter
-    if "PASS" in lst_filter: field_filter = "PASS"
-    else: field_filter = "FILTER"
-    # Info
-    dico_info = { "CALLNB":[nb_call], "CALLAF":["|".join(numpy.array(lst_af,dtype=str))], "CALLFILTER":["|".join(lst_filter).replace(" ","")], "CALLQUAL":["|".join(numpy.array(lst_qual,dtype=str))] }
-    #***** FORMAT *****#
-    lst_format_id = ['GT', 'DP', 'AF']
-    # Merge GT field
-    try: set_gt.remove('./.')
-    except: pass
-    if len(set_gt)==1: field_gt = set_gt.pop()
-    else: field_gt = "./."
-    # Merge DP field
-    field_dp = int(round(numpy.median(lst_dp),0))
-    # Merge AF field
-    while lst_af.count(".")>0: lst_af.remove(".")
-    field_af = float(round(numpy.median(lst_af),2))
-    # Create call
-    dico_calls = [vcfpy.Call(dico_vcf[var_id]["sample"], {'GT':field_gt, 'DP':field_dp, 'AF':[field_af]})] 
-    #***** WRITE VARIANT *****#
-    new_record = vcfpy.Record(chrom, pos, ".", ref, dico_vcf[var_id]["ALT"], field_qual, [field_filter], dico_info, lst_format_id, dico_calls)
-    writer.write_record(new_record)
+            dico_feature["QUAL"][row,index_caller] = record.QUAL
+            dico_feature["strQUAL"][row,index_caller] = str(record.QUAL)
+        # Filter field
+        dico_feature["PASS"][row,index_caller] = "PASS" in record.FILTER
+        dico_feature["ONLYPASS"][row,index_caller] = record.FILTER==["PASS"]
+        dico_feature["strFILTER"][row,index_caller] = "".join(record.FILTER)
+        # Genotype (GT) field
+        gt = record.calls[0].data.get('GT').replace("|","/")
+        if gt=="./.": dico_feature["GT"][row,index_caller] = -1
+        else:
+            if not gt in dico_gt:
+                dico_gt[gt] = len(lst_gt)
+                lst_gt.append(gt)
+            dico_feature["GT"][row,index_caller] = dico_gt[gt]
+        # Read Depth (DP) field
+        if record.calls[0].data.get('DP')==None: dico_feature["DP"][row,index_caller] = 0
+        else: dico_feature["DP"][row,index_caller] = record.calls[0].data.get('DP')
+        # Allele Frequency (AF) field
+        if caller_name in ["strelka","deepvariant"]: dico_feature["AF"][row,index_caller] = round((float(record.calls[0].data['AD'][1])/(float(record.calls[0].data['AD'][0])+float(record.calls[0].data['AD'][1]))),2) # for strelka and deepvariant AD for ref and alt is in FORMAT
+        else: dico_feature["AF"][row,index_caller] = round(float(record.INFO['AF'][0]),2)
+    #***** WRITE merged variants by batch *****#
+    if len(lst_variant)>=nb_merge_batch:
+        writeBatch(writer,lst_variant,dico_feature,lst_gt,sample_name)
+        lst_variant = []
+writeBatch(writer,lst_variant,dico_feature,lst_gt,sample_name)
 writer.close()
+for vcf_tool_reader in lst_reader: vcf_tool_reader.close()
 
 
 
 #***** POST-PROCESSING *****#
-# Sort
-sortVCF(pathMergeUnsortedVCF,pathMergeVCF)
 # Validate
 boolvalid,lst_errors = validateVCF(path_vcfvalidator,pathMergeVCF)
 if boolvalid==False: exit("🅴 🆁 🆁 🅾 🆁\n[Nk_mergeVCF] Validate VCF `"+os.path.basename(pathMergeVCF)+"`\n    "+"\n    ".join(lst_errors))
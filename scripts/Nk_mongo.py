@@ -9,12 +9,21 @@
 # python_version  : 3.8.2                            |
 #=====================================================
 import os
+import re
 import json
+import time
+import bisect
+import heapq
+import multiprocessing
+import threading
+import queue
+import socket
+import subprocess
+import datetime
 import pymongo
-import vcfpy
 from tqdm import *
-from tabulate import tabulate
 from Nk_functions import *
+from Nk_liftover import *
 
 
 #---------------------------------------------------------------#
@@ -23,46 +32,759 @@ from Nk_functions import *
 #---------------------------------------------------------------#
 #---------------------------------------------------------------#
 
+#***** GRCh38 CHROMOSOMES SIZE *****#
+dicoChrSize = {
+               "chr1":248956422,"chr2":242193529,"chr3":198295559,"chr4":190214555,"chr5":181538259,"chr6":170805979, \
+               "chr7":159345973,"chr8":145138636,"chr9":138394717,"chr10":133797422,"chr11":135086622,"chr12":133275309, \
+               "chr13":114364328,"chr14":107043718,"chr15":101991189,"chr16":90338345,"chr17":83257441,"chr18":80373285, \
+               "chr19":58617616,"chr20":64444167,"chr21":46709983,"chr22":50818468,"chrM":16569,"chrX":156040895,"chrY":57227415 \
+              }
+
+#***** CLIENTS *****#
+# One client (connection pool) per process, keyed by pid so that forked workers open their own
+dicoClient = {}
+
 #***** CONNECT *****#
 def connectMongo(dicoInit):
+    if "db" in dicoInit: return
+    clientKey = (os.getpid(),dicoInit["mongoHost"],dicoInit["mongoPort"])
     try :
-        myclient = pymongo.MongoClient("mongodb://"+dicoInit["mongoHost"]+":"+dicoInit["mongoPort"]+"/",serverSelectionTimeoutMS=dicoInit["maxSevSelDelay"])
-        myclient.server_info()
+        if not clientKey in dicoClient:
+            # Query profile (see Nk_profile.py)
+            lstListener = []
+            if dicoInit["pathProfile"]!="":
+                from Nk_profile import QueryListener
+                lstListener.append(QueryListener())
+            myclient = pymongo.MongoClient("mongodb://"+dicoInit["mongoHost"]+":"+dicoInit["mongoPort"]+"/",serverSelectionTimeoutMS=dicoInit["maxSevSelDelay"],event_listeners=lstListener)
+            myclient.server_info()
+            dicoClient[clientKey] = myclient
+        myclient = dicoClient[clientKey]
         dicoInit["db"] = myclient.NiourK_db
         dicoInit["collect_nk_run"] = dicoInit["db"].nk_run
         dicoInit["collect_nk_sample"] = dicoInit["db"].nk_sample
         dicoInit["collect_nk_var"] = dicoInit["db"].nk_var
         dicoInit["collect_nk_depth"] = dicoInit["db"].nk_depth
+        dicoInit["collect_nk_depthseg"] = dicoInit["db"].nk_depthseg
+        dicoInit["collect_nk_varstat"] = dicoInit["db"].nk_varstat
+        dicoInit["collect_nk_ingest"] = dicoInit["db"].nk_ingest
+        dicoInit["collect_nk_samplevar"] = dicoInit["db"].nk_samplevar
+        dicoInit["collect_nk_config"] = dicoInit["db"].nk_config
     except:
         exit("\nUnable to connect to `"+"mongodb://"+dicoInit["mongoHost"]+":"+dicoInit["mongoPort"]+"/"+"`\n\nAre you sure mongod is running ?\n `sudo mongod --port 27018 --dbpath /media/dooguy/ultima_thule/niourkdb`\n")
+    # nk_var layout
+    dicoInit["varLayout"] = readVarLayout(dicoInit)
+    # Create missing indexes
+    ensureIndexes(dicoInit)
+
+
+
+
+
+#---------------------------------------------------------------#
+#---------------------------------------------------------------#
+#                            INDEXES                            #
+#---------------------------------------------------------------#
+#---------------------------------------------------------------#
+# Indexes required by NiourK-db access paths (collection => [(name,keys)])
+dicoIndexes = {
+               "nk_var":      [ ("chrom_pos",[("chrom",pymongo.ASCENDING),("pos",pymongo.ASCENDING)]) ],
+               "nk_run":      [ ("name_num",[("name",pymongo.ASCENDING),("num",pymongo.ASCENDING)]), ("num",[("num",pymongo.ASCENDING)]) ],
+               "nk_sample":   [ ("runid_bc",[("runid",pymongo.ASCENDING),("bc",pymongo.ASCENDING)]), ("runid_name",[("runid",pymongo.ASCENDING),("name",pymongo.ASCENDING)]), ("name",[("name",pymongo.ASCENDING)]) ],
+               "nk_depthseg": [ ("chrom_start",[("chrom",pymongo.ASCENDING),("start",pymongo.ASCENDING)]), ("sample",[("sample",pymongo.ASCENDING)]) ],
+               "nk_varstat":  [ ("chrom_pos",[("chrom",pymongo.ASCENDING),("pos",pymongo.ASCENDING)]) ],
+               "nk_samplevar":[ ("sample",[("sample",pymongo.ASCENDING)]) ]
+              }
+# Indexes of a nk_var layout (see VARIANT CALLS LAYOUT)
+dicoLayoutIndexes = {
+                     "field": {},
+                     "array": { "nk_var": [ ("calls_sample",[("calls.sample",pymongo.ASCENDING)]) ] }
+                    }
+
+#***** CREATE missing indexes *****#
+# Return the list of created "collection.index"
+def ensureIndexes(dicoInit):
+    lstCreated = []
+    dicoLayout = dicoLayoutIndexes[dicoInit["varLayout"]]
+    for collection in list(dicoIndexes)+list(dicoLayout):
+        lstExisting = dicoInit["collect_"+collection].index_information().keys()
+        for indexName,indexKeys in dicoIndexes.get(collection,[])+dicoLayout.get(collection,[]):
+            if not indexName in lstExisting:
+                dicoInit["collect_"+collection].create_index(indexKeys,name=indexName)
+                lstCreated.append(collection+"."+indexName)
+    return lstCreated
+
+#***** Winning plan index *****#
+# Return the index used by a cursor ("COLLSCAN" if none) and if an in-memory sort is required
+def explainIndex(cursor):
+    winningPlan = cursor.explain()["queryPlanner"]["winningPlan"]
+    lstStage = [winningPlan.get("queryPlan",winningPlan)] # slot based engine nest the plan
+    indexName = "COLLSCAN"
+    boolSort = False
+    while lstStage:
+        stage = lstStage.pop()
+        if stage.get("stage") in ["IXSCAN","EXPRESS_IXSCAN"]: indexName = stage["indexName"]
+        if stage.get("stage") in ["IDHACK","EXPRESS_IDHACK"]: indexName = "_id_"
+        if stage.get("stage")=="SORT": boolSort = True
+        if "inputStage" in stage: lstStage.append(stage["inputStage"])
+        if "inputStages" in stage: lstStage.extend(stage["inputStages"])
+    return indexName,boolSort
+
+#***** INIT INDEXES *****#
+def initIndexes(dicoInit):
+    from tabulate import tabulate
+    printcolor("\nSub-command: init-indexes\n\n","1",dicoInit['blue1'],None,dicoInit['colorBool'])
+    # Creation (connectMongo already create missing indexes, so also list existing ones)
+    lstCreated = ensureIndexes(dicoInit)
+    for collection in dicoIndexes:
+        for indexName,indexKeys in dicoIndexes[collection]:
+            if collection+"."+indexName in lstCreated: status = "created"
+            else: status = "present"
+            printcolor("    "+(collection+"."+indexName).ljust(30)+" "+status+"\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    # Access paths report
+    dicoQuery = {
+                 "run by id (searchRunSample)":             (dicoInit["collect_nk_run"].find({"_id":""})),
+                 "run by name (searchRunSample)":           (dicoInit["collect_nk_run"].find({"name":""})),
+                 "run by name+num (searchRunSample)":       (dicoInit["collect_nk_run"].find({"name":"","num":0})),
+                 "runs sorted by num (list-run)":           (dicoInit["collect_nk_run"].find().sort("num",pymongo.ASCENDING)),
+                 "sample by runid+bc (searchRunSample)":    (dicoInit["collect_nk_sample"].find({"runid":"","bc":""})),
+                 "sample by runid+name (searchRunSample)":  (dicoInit["collect_nk_sample"].find({"runid":"","name":""})),
+                 "samples sorted by name (list-sample)":    (dicoInit["collect_nk_sample"].find().sort("name",pymongo.ASCENDING)),
+                 "variant by id (get-variant)":             (dicoInit["collect_nk_var"].find({"_id":""})),
+                 "variants by region (get-region)":         (dicoInit["collect_nk_var"].find({"chrom":"chr1","pos":{"$gte":1,"$lte":2}})),
+                 "depth overlap (get-variant)":             (dicoInit["collect_nk_depthseg"].find(depthOverlapQuery(dicoInit,"chr1",1))),
+                 "depth by sample":                         (dicoInit["collect_nk_depthseg"].find({"sample":""})),
+                 "aggregates by position (add-depth)":      (dicoInit["collect_nk_varstat"].find({"chrom":"chr1","pos":{"$gte":1,"$lte":2}}))
+                }
+    table = []
+    for queryName in dicoQuery:
+        indexName,boolSort = explainIndex(dicoQuery[queryName])
+        if boolSort: indexName+=" + in-memory sort"
+        table.append([queryName,indexName])
+    printcolor("\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    for line in tabulate(table, ["query","index"], tablefmt="fancy_grid").split("\n"):
+        printcolor("  "+line+"\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+
+
+
+
+
+#***** BULK WRITE *****#
+# Send a batch of write operations in one unordered bulk_write and report its errors
+def bulkWrite(dicoInit,collection,lstOps,batchNum):
+    if len(lstOps)==0: return 0
+    try:
+        collection.bulk_write(lstOps,ordered=False)
+    except pymongo.errors.BulkWriteError as bwe:
+        lstWriteErrors = bwe.details["writeErrors"]
+        printcolor("      batch "+str(batchNum)+": "+str(len(lstWriteErrors))+"/"+str(len(lstOps))+" write errors ("+lstWriteErrors[0]["errmsg"]+")\n","0",dicoInit['red'],None,dicoInit['colorBool'])
+        return len(lstWriteErrors)
+    return 0
+
+#***** BULK WRITE pending operations *****#
+# dicoOps = { collection name : [operations] }, lists are emptied after writing
+def flushOps(dicoInit,dicoOps,batchNum):
+    nbError = 0
+    for collection in dicoOps:
+        nbError+=bulkWrite(dicoInit,dicoInit["collect_"+collection],dicoOps[collection],batchNum)
+        dicoOps[collection] = []
+    return nbError
+
+#***** PIPELINED variant writes *****#
+# The parser (caller thread) submits chunks of operations to a bounded queue drained by
+# writer threads, so parsing and network time overlap and a full queue blocks the parser
+# Chunks already committed by an interrupted load are skipped (dicoIngest, see INGEST MANIFEST)
+def startWriters(dicoInit,dicoIngest):
+    dicoPipe = { "queue":queue.Queue(maxsize=2*dicoInit["nbWriter"]), "lock":threading.Lock(), "nbError":0, "error":None, "threads":[], \
+                 "ingest":dicoIngest, "committed":dicoIngest["chunk"], "setDone":set() }
+    for i in range(dicoInit["nbWriter"]):
+        thread = threading.Thread(target=writerLoop,args=(dicoInit,dicoPipe),daemon=True)
+        thread.start()
+        dicoPipe["threads"].append(thread)
+    return dicoPipe
+
+#***** Writer thread *****#
+# Variant aggregates of a chunk are recomputed after its writes (one refresh at a time,
+# so the last refresh of a position always sees all previous writes)
+def writerLoop(dicoInit,dicoPipe):
+    while True:
+        chunk = dicoPipe["queue"].get()
+        if chunk==None: break
+        if dicoPipe["error"]!=None: continue # keep draining after a failure, the parser must not block
+        dicoOps,lstChunkVar,batchNum = chunk
+        try:
+            nbError = flushOps(dicoInit,dicoOps,batchNum)
+            with dicoPipe["lock"]:
+                nbError+=refreshVarStat(dicoInit,lstChunkVar,batchNum)
+                dicoPipe["nbError"]+=nbError
+                # Checkpoint = last chunk of the contiguous run of written chunks
+                if nbError==0:
+                    dicoPipe["setDone"].add(batchNum)
+                    while dicoPipe["committed"]+1 in dicoPipe["setDone"]:
+                        dicoPipe["committed"]+=1
+                        dicoPipe["setDone"].remove(dicoPipe["committed"])
+                    checkpointIngest(dicoInit,dicoPipe["ingest"],dicoPipe["committed"])
+        except Exception as error:
+            dicoPipe["error"] = error
+
+#***** Submit a chunk of operations *****#
+# Pending lists are handed to the writers and emptied, a writer failure is raised here
+# (chunk variants are also listed in nk_samplevar, see DELETE)
+def submitWrites(dicoPipe,dicoOps,lstChunkVar,batchNum):
+    if dicoPipe["error"]!=None: raise dicoPipe["error"]
+    if batchNum>dicoPipe["ingest"]["chunk"]:
+        dicoChunkOps = dict(dicoOps)
+        dicoChunkOps["nk_samplevar"] = [sampleVarOp(dicoPipe["ingest"],lstChunkVar,batchNum)]
+        dicoPipe["queue"].put((dicoChunkOps,list(lstChunkVar),batchNum))
+    for collection in dicoOps: dicoOps[collection] = []
+    del lstChunkVar[:]
+
+#***** Wait for writers *****#
+# Return the number of write errors
+def stopWriters(dicoPipe):
+    for thread in dicoPipe["threads"]: dicoPipe["queue"].put(None)
+    for thread in dicoPipe["threads"]: thread.join()
+    if dicoPipe["error"]!=None: raise dicoPipe["error"]
+    return dicoPipe["nbError"]
+
+
+
+#---------------------------------------------------------------#
+#---------------------------------------------------------------#
+#                        INGEST MANIFEST                        #
+#---------------------------------------------------------------#
+#---------------------------------------------------------------#
+# nk_ingest document = progress of one sample file load
+# { "_id":"depth_runId_sample", "kind":"depth", "sample":"runId_sample", "path":"...", "size":123, "mtime":1600000000.0,
+#   "chunkSize":25000, "status":"running", "owner":"host:pid", "chunk":12, "started":date, "heartbeat":date, "ended":date }
+# (chunk = number of committed write chunks, a restarted load of the same file with the same
+#  chunk size skips them; a running load without heartbeat for staleDelay seconds can be taken over,
+#  heartbeat is refreshed at each checkpoint and every staleDelay/4 seconds, see HEARTBEAT)
+
+#***** Loader identifier *****#
+def ingestOwner():
+    return socket.gethostname()+":"+str(os.getpid())
+
+#***** CLAIM a sample load *****#
+# Return ("claimed"|"done"|"busy", ingest document)
+def claimIngest(dicoInit,kind,sampleID):
+    ingestID = kind+"_"+sampleID
+    now = datetime.datetime.utcnow()
+    fileStat = os.stat(dicoInit["pathInput"])
+    findIngest = dicoInit["collect_nk_ingest"].find_one({"_id":ingestID})
+    boolSameFile = findIngest!=None and findIngest["size"]==fileStat.st_size and findIngest["mtime"]==fileStat.st_mtime
+    if boolSameFile and findIngest["status"]=="done": return "done",findIngest
+    dicoSet = { "kind":kind, "sample":sampleID, "path":os.path.abspath(dicoInit["pathInput"]), "size":fileStat.st_size, "mtime":fileStat.st_mtime, \
+                "chunkSize":dicoInit["nbChunk"], "status":"running", "owner":ingestOwner(), "heartbeat":now }
+    # Resume only the same file cut in the same chunks
+    if not boolSameFile or findIngest["chunkSize"]!=dicoInit["nbChunk"]:
+        dicoSet["chunk"] = 0
+        dicoSet["started"] = now
+    query = { "_id":ingestID, "$or":[ {"status":{"$ne":"running"}}, {"heartbeat":{"$lt":now-datetime.timedelta(seconds=dicoInit["staleDelay"])}}, {"owner":ingestOwner()} ] }
+    try:
+        dicoIngest = dicoInit["collect_nk_ingest"].find_one_and_update(query,{"$set":dicoSet},upsert=True,return_document=pymongo.ReturnDocument.AFTER)
+    except pymongo.errors.DuplicateKeyError:
+        return "busy",findIngest
+    return "claimed",dicoIngest
+
+#***** CHECKPOINT committed chunks *****#
+def checkpointIngest(dicoInit,dicoIngest,chunk):
+    now = datetime.datetime.utcnow()
+    updateIngest = dicoInit["collect_nk_ingest"].update_one({"_id":dicoIngest["_id"],"owner":dicoIngest["owner"]},{"$set":{"chunk":chunk,"heartbeat":now}})
+    if updateIngest.matched_count==0: raise RuntimeError("load of `"+dicoIngest["sample"]+"` taken over by another loader")
+
+#***** HEARTBEAT of a running load *****#
+# Background thread refreshing heartbeat every staleDelay/4 seconds (parsing or liftover may run
+# longer than staleDelay between two checkpoints), stops when stopEvent is set or the load is taken over
+def startHeartbeat(dicoInit,dicoIngest):
+    stopEvent = threading.Event()
+    thread = threading.Thread(target=heartbeatLoop,args=(dicoInit,dicoIngest,stopEvent),daemon=True)
+    thread.start()
+    return stopEvent,thread
+
+#***** Heartbeat thread *****#
+def heartbeatLoop(dicoInit,dicoIngest,stopEvent):
+    while not stopEvent.wait(dicoInit["staleDelay"]/4):
+        try:
+            updateIngest = dicoInit["collect_nk_ingest"].update_one({"_id":dicoIngest["_id"],"owner":dicoIngest["owner"]},{"$set":{"heartbeat":datetime.datetime.utcnow()}})
+        except pymongo.errors.PyMongoError: continue # retried at next tick
+        if updateIngest.matched_count==0: break # taken over, raised at the next checkpoint
+
+#***** RELEASE a sample load *****#
+def releaseIngest(dicoInit,dicoIngest,status):
+    now = datetime.datetime.utcnow()
+    dicoInit["collect_nk_ingest"].update_one({"_id":dicoIngest["_id"],"owner":dicoIngest["owner"]},{"$set":{"status":status,"heartbeat":now,"ended":now}})
+
+#***** Display claim result *****#
+# Return True if the load must go on
+def reportClaim(dicoInit,status,dicoIngest,collection):
+    if status=="done":
+        if not dicoInit["quiet"]: printcolor("      already inserted in NiourK-db ("+collection+").\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+        return False
+    if status=="busy":
+        printcolor("      being inserted by `"+dicoIngest["owner"]+"` (nk_ingest), skipped.\n","0",dicoInit['red'],None,dicoInit['colorBool'])
+        return False
+    if dicoIngest["chunk"]>0 and not dicoInit["quiet"]: printcolor("      resume after "+str(dicoIngest["chunk"])+" committed chunks (nk_ingest).\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    return True
+
+#***** RUN a claimed sample load *****#
+# ingestFunction(dicoInit,dicoIngest,*args) returns its number of write errors,
+# the load is released as failed on any error or interruption (resumed by the next run)
+def runIngest(dicoInit,dicoIngest,ingestFunction,*args):
+    stopEvent,thread = startHeartbeat(dicoInit,dicoIngest)
+    try:
+        nbError = ingestFunction(dicoInit,dicoIngest,*args)
+    except BaseException:
+        stopEvent.set()
+        thread.join()
+        releaseIngest(dicoInit,dicoIngest,"failed")
+        raise
+    stopEvent.set()
+    thread.join()
+    if nbError==0: releaseIngest(dicoInit,dicoIngest,"done")
+    else: releaseIngest(dicoInit,dicoIngest,"failed")
+    return nbError
+
+
+
+
+
+#---------------------------------------------------------------#
+#---------------------------------------------------------------#
+#                      VARIANT CALLS LAYOUT                     #
+#---------------------------------------------------------------#
+#---------------------------------------------------------------#
+# nk_var document = calls of one variant, in the layout of the nk_config "varlayout" document
+#  - field : { "_id":"chr1_1000_A_G", "chrom":"chr1", "pos":1000, "runId_sample":{ "af":0.45, "call":{...}, "filter":{...} }, ... }
+#  - array : { "_id":"chr1_1000_A_G", "chrom":"chr1", "pos":1000, "calls":[ { "sample":"runId_sample", "af":0.45, "call":{...}, "filter":{...} }, ... ] }
+# (array layout indexes calls.sample, readers yield the union of both layouts per document so that
+#  an interrupted migrate-varlayout leaves a readable collection, an array call hides the field call
+#  of the same sample; writes of a sample call remove its call in the other layout)
+# (chrom/pos are indexed for region queries, documents written before them are
+#  completed by `migrate-varlayout` with the current layout)
+
+# Fields of a nk_var document which are not field layout sample calls
+lstVarReserved = ["_id","chrom","pos","calls"]
+
+#***** Current layout *****#
+def readVarLayout(dicoInit):
+    findLayout = dicoInit["collect_nk_config"].find_one({"_id":"varlayout"})
+    if findLayout==None: return "field"
+    return findLayout["value"]
 
-#***** INIT whole genome nk_depth *****# (deprecated)
-def initNkDepth(dicoInit,dicoChrSize):
-    printcolor("\n`nk_depth` collection is incomplete.\n","0",dicoInit['red'],None,dicoInit['colorBool'])
-    printcolor(" Initialization can take a long time.\n Do you want to start initialization (y/n) :","0",dicoInit['red'],None,dicoInit['colorBool'])
-    choice = input().lower()
-    if choice=="y":
-        dicoChrSize = {
-                   "chr1":248956422,"chr2":242193529,"chr3":198295559,"chr4":190214555,"chr5":181538259,"chr6":170805979, \
-                   "chr7":159345973,"chr8":145138636,"chr9":138394717,"chr10":133797422,"chr11":135086622,"chr12":133275309, \
-                   "chr13":114364328,"chr14":107043718,"chr15":101991189,"chr16":90338345,"chr17":83257441,"chr18":80373285, \
-                   "chr19":58617616,"chr20":64444167,"chr21":46709983,"chr22":50818468,"chrM":16569,"chrX":156040895,"chrY":57227415 \
-                  }
-        printcolor("\nInit nk_depth collection\n","1",dicoInit['blue1'],None,dicoInit['colorBool'])
+#***** Completed layout migration *****#
+# False while documents may still hold calls in the previous layout
+def varLayoutComplete(dicoInit):
+    findLayout = dicoInit["collect_nk_config"].find_one({"_id":"varlayout"})
+    return findLayout==None or findLayout.get("complete",True)
+
+#***** Sample calls of a nk_var document *****#
+# Generator yielding (sampleID,dicoVar) of both layouts
+def iterVarCalls(findVar):
+    setArraySample = set()
+    if isinstance(findVar.get("calls"),list):
+        for dicoCall in findVar["calls"]:
+            dicoVar = dict(dicoCall)
+            sampleID = dicoVar.pop("sample")
+            setArraySample.add(sampleID)
+            yield (sampleID,dicoVar)
+    for key in findVar:
+        if not key in lstVarReserved and not key in setArraySample: yield (key,findVar[key])
+
+#***** Coordinates fields of a variant *****#
+def varCoordinates(varId):
+    return { "chrom":varId.split("_")[0], "pos":int(varId.split("_")[1]) }
+
+#***** Write operations setting the call of a sample *****#
+# Array layout: replace the sample element, push it or create the document
+# (order independent, so they can be sent in an unordered bulk)
+def varCallOps(dicoInit,varId,sampleID,dicoVar):
+    dicoSet = varCoordinates(varId)
+    if dicoInit["varLayout"]=="field":
+        dicoSet[sampleID] = dicoVar
+        return [pymongo.UpdateOne({"_id":varId},{"$set":dicoSet,"$pull":{"calls":{"sample":sampleID}}},upsert=True)]
+    dicoCall = dict(dicoVar)
+    dicoCall["sample"] = sampleID
+    dicoInsert = dict(dicoSet)
+    dicoInsert["calls"] = [dicoCall]
+    dicoSetCall = dict(dicoSet)
+    dicoSetCall["calls.$"] = dicoCall
+    return [ pymongo.UpdateOne({"_id":varId,"calls.sample":sampleID},{"$set":dicoSetCall,"$unset":{sampleID:""}}), \
+             pymongo.UpdateOne({"_id":varId,"calls.sample":{"$ne":sampleID}},{"$push":{"calls":dicoCall},"$set":dicoSet,"$unset":{sampleID:""}}), \
+             pymongo.UpdateOne({"_id":varId},{"$setOnInsert":dicoInsert},upsert=True) ]
+
+#***** Field layout calls (aggregation expression) *****#
+# boolArray: also exclude the samples with an array call (hidden by it)
+def varFieldCallsExpr(boolArray):
+    lstCond = [ {"$eq":[{"$in":["$$this.k",lstVarReserved]},False]} ]
+    if boolArray: lstCond.append({"$eq":[{"$in":["$$this.k",{"$ifNull":["$calls.sample",[]]}]},False]})
+    return {"$filter":{"input":{"$objectToArray":"$$ROOT"},"cond":{"$and":lstCond}}}
+
+#***** Number of sample calls (aggregation expression) *****#
+# Union of both layouts, as iterVarCalls
+def varCarrierExpr():
+    return {"$add":[ {"$size":{"$ifNull":["$calls",[]]}}, {"$size":varFieldCallsExpr(True)} ]}
+
+#***** Update removing the call of a sample (both layouts) *****#
+def varUnsetSample(sampleID):
+    return {"$unset":{sampleID:""},"$pull":{"calls":{"sample":sampleID}}}
+
+#***** Query of documents without any call (both layouts) *****#
+def varEmptyQuery():
+    return {"$expr":{"$eq":[varCarrierExpr(),0]}}
+
+#***** MIGRATE nk_var layout *****#
+# Layout is switched first (new writes use it), then documents still holding calls of the other layout
+# or without coordinates are rewritten by chunks (an interrupted migration is resumed by running it again)
+# Each document is replaced only if unchanged since it was read, documents written meanwhile are left
+# for the next run, the layout is marked complete when none remains
+def migrateVarLayout(dicoInit):
+    if not dicoInit["quiet"]:
+        printcolor("\nSub-command: migrate-varlayout\n","1",dicoInit['blue1'],None,dicoInit['colorBool'])
+        printcolor("  layout: "+dicoInit["varLayout"]+" => "+dicoInit["targetLayout"]+"\n","1",dicoInit['blue2'],None,dicoInit['colorBool'])
+    # Running loads keep writing the layout they started with
+    now = datetime.datetime.utcnow()
+    findRunning = dicoInit["collect_nk_ingest"].find_one({"status":"running","heartbeat":{"$gte":now-datetime.timedelta(seconds=dicoInit["staleDelay"])}})
+    if findRunning: exit("\nLoad of `"+findRunning["sample"]+"` running (nk_ingest `"+findRunning["owner"]+"`), run `migrate-varlayout` after it.\n")
+    dicoInit["collect_nk_config"].update_one({"_id":"varlayout"},{"$set":{"value":dicoInit["targetLayout"],"complete":False}},upsert=True)
+    dicoInit["varLayout"] = dicoInit["targetLayout"]
+    lstCreated = ensureIndexes(dicoInit)
+    if lstCreated and not dicoInit["quiet"]: printcolor("      index created ("+", ".join(lstCreated)+").\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    if dicoInit["targetLayout"]=="array": query = {"$or":[ {"pos":{"$exists":False}}, {"$expr":{"$gt":[{"$size":varFieldCallsExpr(False)},0]}} ]}
+    else: query = {"$or":[ {"calls":{"$exists":True}}, {"pos":{"$exists":False}} ]}
+    startTime = time.time()
+    nbVar = 0
+    nbError = 0
+    nbBatch = 0
+    lstOps = []
+    cursor = dicoInit["collect_nk_var"].find(query,batch_size=dicoInit["nbChunk"])
+    for findVar in tqdm(cursor,ncols=30,leave=True,disable=dicoInit["quiet"],bar_format="      {n_fmt} variants [{rate_fmt}]"):
+        if dicoInit["targetLayout"]=="array":
+            lstCall = []
+            for sampleID,dicoVar in iterVarCalls(findVar):
+                dicoCall = dict(dicoVar) # findVar is kept unchanged for the replace filter
+                dicoCall["sample"] = sampleID
+                lstCall.append(dicoCall)
+            newVar = { "_id":findVar["_id"], "calls":lstCall }
+        else:
+            newVar = { "_id":findVar["_id"] }
+            for sampleID,dicoVar in iterVarCalls(findVar): newVar[sampleID] = dicoVar
+        newVar.update(varCoordinates(findVar["_id"]))
+        lstOps.append(pymongo.ReplaceOne({"_id":findVar["_id"],"$expr":{"$eq":["$$ROOT",{"$literal":findVar}]}},newVar))
+        nbVar+=1
+        if len(lstOps)>=dicoInit["nbChunk"]:
+            nbBatch+=1
+            nbError+=bulkWrite(dicoInit,dicoInit["collect_nk_var"],lstOps,nbBatch)
+            lstOps = []
+    nbError+=bulkWrite(dicoInit,dicoInit["collect_nk_var"],lstOps,nbBatch+1)
+    if not dicoInit["quiet"]:
+        elapsed = time.time()-startTime
+        printcolor("      "+str(nbVar-nbError)+" variants rewritten in "+str(round(elapsed,1))+"s ("+str(round(nbVar/max(elapsed,0.001),1))+" variants/s).\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    if nbError>0: exit("\n"+str(nbError)+" variant writes failed, run `migrate-varlayout` again.\n")
+    nbLeft = dicoInit["collect_nk_var"].count_documents(query)
+    if nbLeft>0: exit("\n"+str(nbLeft)+" variants changed during the migration, run `migrate-varlayout` again.\n")
+    dicoInit["collect_nk_config"].update_one({"_id":"varlayout"},{"$set":{"complete":True}})
+
+
+
+#---------------------------------------------------------------#
+#---------------------------------------------------------------#
+#                      DEPTH SEGMENTS LAYOUT                    #
+#---------------------------------------------------------------#
+#---------------------------------------------------------------#
+# nk_depthseg document = one run of constant depth for one sample
+# { "_id":"chr1_1000_runId_sample", "sample":"runId_sample", "chrom":"chr1", "start":1000, "end":1150, "depth":42 }
+# (1-based inclusive positions, segments longer than maxSegLen are split
+#  so that an overlap query only scans a bounded `start` range)
+# Single positions written by add-vcf/add-nksample have their own `_id` namespace and a flag
+# { "_id":"point_chr1_1000_runId_sample", "sample":"runId_sample", "chrom":"chr1", "start":1000, "end":1000, "depth":42, "point":true }
+
+#***** Segment ID *****#
+def depthSegId(chrom,start,sampleID):
+    return chrom+"_"+str(start)+"_"+sampleID
+
+#***** Segment document(s) for a depth run *****#
+def depthSegments(dicoInit,sampleID,chrom,start,end,depth):
+    lstSeg = []
+    for segStart in range(start,end+1,dicoInit["maxSegLen"]):
+        segEnd = min(end,segStart+dicoInit["maxSegLen"]-1)
+        lstSeg.append({ "_id":depthSegId(chrom,segStart,sampleID), "sample":sampleID, "chrom":chrom, "start":segStart, "end":segEnd, "depth":depth })
+    return lstSeg
+
+#***** Query segments overlapping a position *****#
+def depthOverlapQuery(dicoInit,chrom,pos):
+    return depthWindowQuery(dicoInit,chrom,pos,pos)
+
+#***** Query segments overlapping an interval *****#
+def depthWindowQuery(dicoInit,chrom,start,end):
+    return { "chrom":chrom, "start":{"$gte":start-dicoInit["maxSegLen"]+1, "$lte":end}, "end":{"$gte":start} }
+
+#***** Single position ID *****#
+def depthPointId(chrom,pos,sampleID):
+    return "point_"+depthSegId(chrom,pos,sampleID)
+
+#***** Upsert operation setting depth at a single position for a sample *****#
+# (boolOverwrite False => depth only set if the position is absent, BED segments are never modified)
+def pointDepthOp(sampleID,chrom,pos,depth,boolOverwrite=True):
+    dicoUpdate = { "$setOnInsert": { "sample":sampleID, "chrom":chrom, "start":pos, "end":pos, "point":True } }
+    if boolOverwrite: dicoUpdate["$set"] = { "depth":depth }
+    else: dicoUpdate["$setOnInsert"]["depth"] = depth
+    return pymongo.UpdateOne({"_id":depthPointId(chrom,pos,sampleID)},dicoUpdate,upsert=True)
+
+#***** Depth BED intervals to segments *****#
+# Generator merging adjacent intervals with same depth (1-based output)
+def depthBedSegments(dicoInit,sampleID,bedReader):
+    lstRun = [] # current run [chrom,start,end,depth]
+    for chrom,start,end,depth in bedReader:
+        if lstRun and lstRun[0]==chrom and lstRun[2]==start and lstRun[3]==depth:
+            lstRun[2] = end
+            continue
+        if lstRun: yield from depthSegments(dicoInit,sampleID,lstRun[0],lstRun[1]+1,lstRun[2],lstRun[3])
+        lstRun = [chrom,start,end,depth]
+    if lstRun: yield from depthSegments(dicoInit,sampleID,lstRun[0],lstRun[1]+1,lstRun[2],lstRun[3])
+
+#***** Samples covering a position *****#
+def coveringSamples(dicoInit,chrom,pos,mindepth):
+    query = depthOverlapQuery(dicoInit,chrom,pos)
+    query["depth"] = {"$gte":mindepth}
+    return dicoInit["collect_nk_depthseg"].distinct("sample",query)
+
+#***** Depth of samples covering several positions of a chromosome *****#
+# One `$or` of bounded overlap queries per chunk of positions => { pos: { sample: depth } }
+# (max depth if a sample has several segments at a position)
+def coveringDepths(dicoInit,chrom,lstPos,mindepth,nbPosQuery=500):
+    lstPos = sorted(set(lstPos))
+    dicoDepth = {}
+    for pos in lstPos: dicoDepth[pos] = {}
+    for i in range(0,len(lstPos),nbPosQuery):
+        lstChunk = lstPos[i:i+nbPosQuery]
+        query = { "$or":[depthOverlapQuery(dicoInit,chrom,pos) for pos in lstChunk], "depth":{"$gte":mindepth} }
+        for segment in dicoInit["collect_nk_depthseg"].find(query,{"_id":0,"sample":1,"start":1,"end":1,"depth":1}):
+            j = bisect.bisect_left(lstChunk,segment["start"])
+            while j<len(lstChunk) and lstChunk[j]<=segment["end"]:
+                dicoPos = dicoDepth[lstChunk[j]]
+                dicoPos[segment["sample"]] = max(dicoPos.get(segment["sample"],0),segment["depth"])
+                j+=1
+    return dicoDepth
+
+#***** Number of samples covering several positions of a chromosome *****#
+def coveringCounts(dicoInit,chrom,lstPos,mindepth):
+    dicoCount = {}
+    for pos,dicoPos in coveringDepths(dicoInit,chrom,lstPos,mindepth).items(): dicoCount[pos] = len(dicoPos)
+    return dicoCount
+
+#***** MIGRATE per-base nk_depth to nk_depthseg *****#
+# Positions of each contig are streamed in numeric order with one open run per sample
+# (memory independent of the chromosome size), segments are written by nbChunk
+def migrateDepth(dicoInit):
+    if not dicoInit["quiet"]: printcolor("\nSub-command: migrate-depth\n","1",dicoInit['blue1'],None,dicoInit['colorBool'])
+    nbSeg = 0
+    nbError = 0
+    nbBatch = 0
+    lstOps = []
+    for chrom in depthContigs(dicoInit):
+        if not dicoInit["quiet"]: printcolor("    Migrate "+chrom+"\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+        dicoRun = {} # { sample: [start,end,depth] }
+        lstPipeline = [ {"$match":{"_id":{"$regex":"^"+re.escape(chrom)+"_[0-9]+$"}}}, \
+                        {"$addFields":{"_pos":{"$toLong":{"$arrayElemAt":[{"$split":["$_id","_"]},-1]}}}}, \
+                        {"$sort":{"_pos":1}} ]
+        for depthEntry in dicoInit["collect_nk_depth"].aggregate(lstPipeline,allowDiskUse=True):
+            pos = depthEntry["_pos"]
+            for key in depthEntry:
+                if key=="_id" or key=="_pos": continue
+                run = dicoRun.get(key)
+                if run and pos==run[1]+1 and depthEntry[key]==run[2]:
+                    run[1] = pos
+                    continue
+                if run: lstOps.extend([pymongo.ReplaceOne({"_id":segment["_id"]},segment,upsert=True) for segment in depthSegments(dicoInit,key,chrom,run[0],run[1],run[2])])
+                dicoRun[key] = [pos,pos,depthEntry[key]]
+            if len(lstOps)>=dicoInit["nbChunk"]:
+                nbBatch+=1
+                nbError+=bulkWrite(dicoInit,dicoInit["collect_nk_depthseg"],lstOps,nbBatch)
+                nbSeg+=len(lstOps)
+                lstOps = []
+        for sampleID,run in dicoRun.items():
+            lstOps.extend([pymongo.ReplaceOne({"_id":segment["_id"]},segment,upsert=True) for segment in depthSegments(dicoInit,sampleID,chrom,run[0],run[1],run[2])])
+    if lstOps:
+        nbBatch+=1
+        nbError+=bulkWrite(dicoInit,dicoInit["collect_nk_depthseg"],lstOps,nbBatch)
+        nbSeg+=len(lstOps)
+    if not dicoInit["quiet"]: printcolor("      "+str(nbSeg-nbError)+" depth segments inserted in NiourK-db (nk_depthseg).\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    # Per-base layout kept and samples not marked as inserted on failure
+    if nbError>0: exit("\n"+str(nbError)+" depth segment writes failed, nk_depth kept (run `migrate-depth` again).\n")
+    # Inserted samples bookkeeping
+    findInsertStatut = dicoInit["collect_nk_depth"].find_one({"_id":"insertsample"})
+    if findInsertStatut:
+        dicoInit["collect_nk_depthseg"].update_one({"_id":"insertsample"},{"$addToSet": {"lstrunid": {"$each":findInsertStatut["lstrunid"]}}},upsert=True)
+    if not dicoInit["quiet"]: printcolor("      run `rebuild-aggregates` to update variant aggregates (nk_varstat).\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    # Drop old per-base layout
+    if dicoInit["dropOld"]:
         dicoInit["db"].drop_collection("nk_depth")
-        for chrom in dicoChrSize:
-            printcolor("  Insert "+chrom+"\n","0",dicoInit['blue1'],None,dicoInit['colorBool'])
-            lstPos = list(range(1,dicoChrSize[chrom]+1,1))
-            lstChunk = [lstPos[i * dicoInit["nbChunk"]:(i + 1) * dicoInit["nbChunk"]] for i in range((len(lstPos) + dicoInit["nbChunk"] - 1) // dicoInit["nbChunk"] )]  
-            for i in tqdm(range(len(lstChunk)),ncols=60,bar_format="    {percentage:3.0f}%|{bar}| {n_fmt}/{total_fmt}"):
-                chunk = lstChunk[i]
-                insertList = []
-                for pos in chunk: insertList.append({ "_id":chrom+"_"+str(pos) })
-                dicoInit["collect_nk_depth"].insert_many(insertList,ordered=False)
+        if not dicoInit["quiet"]: printcolor("      per-base collection dropped (nk_depth).\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
 
+#***** Contigs of the per-base layout *****#
+# Skip scan of the `_id` index: after contig X, the next `_id` greater than "X_:" (":" follows the digits)
+def depthContigs(dicoInit):
+    lstContig = []
+    lastId = ""
+    while True:
+        findDepth = dicoInit["collect_nk_depth"].find_one({"_id":{"$gt":lastId}},{"_id":1},sort=[("_id",pymongo.ASCENDING)])
+        if findDepth==None: return lstContig
+        matchId = re.match("^(.+)_[0-9]+$",findDepth["_id"])
+        if matchId==None: lastId = findDepth["_id"] # insertsample
+        else:
+            lstContig.append(matchId.group(1))
+            lastId = matchId.group(1)+"_:"
 
 
 
+#---------------------------------------------------------------#
+#---------------------------------------------------------------#
+#                  MEMORY-MAPPED DEPTH STORE                    #
+#---------------------------------------------------------------#
+#---------------------------------------------------------------#
+# Optional coverage backend restricted to target regions (see Nk_covstore.py)
+# filled by `add-depth --covstore` and read by `get-variant --covstore`
+
+#***** INIT depth store *****#
+def initDepthStore(dicoInit):
+    from Nk_covstore import initCovStore
+    if not dicoInit["quiet"]:
+        printcolor("\nSub-command: init-covstore\n","1",dicoInit['blue1'],None,dicoInit['colorBool'])
+        printcolor("    Index target regions\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    dicoMeta = initCovStore(dicoInit["pathCovStore"],dicoInit["pathInput"])
+    if not dicoInit["quiet"]:
+        nbPos = sum([dicoMeta["chroms"][chrom]["offsets"][-1] for chrom in dicoMeta["chroms"]])
+        nbRegion = sum([len(dicoMeta["chroms"][chrom]["starts"]) for chrom in dicoMeta["chroms"]])
+        printcolor("      "+str(nbRegion)+" regions ("+str(nbPos)+" positions) on "+str(len(dicoMeta["chroms"]))+" chromosomes\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+        printcolor("      "+convertByteSize(nbPos*2)+" per sample in `"+dicoInit["pathCovStore"]+"`\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+
+
+
+#---------------------------------------------------------------#
+#---------------------------------------------------------------#
+#                      VARIANT AGGREGATES                       #
+#---------------------------------------------------------------#
+#---------------------------------------------------------------#
+# nk_varstat document = precomputed frequency counters of one variant
+# { "_id":"chr1_1000_A_G", "chrom":"chr1", "pos":1000, "carriers":3, "cov":{"1":12,"10":12,"20":9,...} }
+# (cov = number of samples with depth>=threshold at the variant position, for each lstCovThreshold)
+#  - add-vcf & add-nksample recompute counters of the positions written in each chunk
+#  - add-depth increments counters of the positions covered by the new sample
+#  - rebuild-aggregates recomputes the whole collection
+
+#***** Variant carriers *****#
+# Number of sample calls of nk_var documents (without transferring them) => { varId: nbSample }
+def variantCarriers(dicoInit,lstVarId):
+    dicoCarrier = {}
+    pipeline = [ {"$match":{"_id":{"$in":lstVarId}}}, {"$project":{"nbSample":varCarrierExpr()}} ]
+    for findVar in dicoInit["collect_nk_var"].aggregate(pipeline): dicoCarrier[findVar["_id"]] = findVar["nbSample"]
+    return dicoCarrier
+
+#***** Aggregates write operations for a list of variants *****#
+# Variants absent from nk_var are removed from nk_varstat
+def varStatOps(dicoInit,lstVarId):
+    lstOps = []
+    dicoCarrier = variantCarriers(dicoInit,lstVarId)
+    dicoChromPos = {}
+    for varID in lstVarId:
+        chrom = varID.split("_")[0]
+        if not chrom in dicoChromPos: dicoChromPos[chrom] = []
+        dicoChromPos[chrom].append(int(varID.split("_")[1]))
+    dicoDepth = {}
+    for chrom in dicoChromPos:
+        for pos,dicoPos in coveringDepths(dicoInit,chrom,dicoChromPos[chrom],dicoInit["lstCovThreshold"][0]).items(): dicoDepth[(chrom,pos)] = dicoPos
+    for varID in lstVarId:
+        if not varID in dicoCarrier:
+            lstOps.append(pymongo.DeleteOne({"_id":varID}))
+            continue
+        chrom = varID.split("_")[0]
+        pos = int(varID.split("_")[1])
+        dicoCov = {}
+        for threshold in dicoInit["lstCovThreshold"]:
+            dicoCov[str(threshold)] = len([sample for sample,depth in dicoDepth[(chrom,pos)].items() if depth>=threshold])
+        lstOps.append(pymongo.ReplaceOne({"_id":varID},{ "_id":varID, "chrom":chrom, "pos":pos, "carriers":dicoCarrier[varID], "cov":dicoCov },upsert=True))
+    return lstOps
+
+#***** Recompute aggregates of variants and of the other variants at their positions *****#
+def refreshVarStat(dicoInit,lstVarId,batchNum):
+    if len(lstVarId)==0: return 0
+    setVarId = set(lstVarId)
+    dicoChromPos = {}
+    for varID in setVarId:
+        chrom = varID.split("_")[0]
+        if not chrom in dicoChromPos: dicoChromPos[chrom] = set()
+        dicoChromPos[chrom].add(int(varID.split("_")[1]))
+    # Depth written with variants also change counters of variants sharing the position
+    for chrom in dicoChromPos:
+        for findStat in dicoInit["collect_nk_varstat"].find({"chrom":chrom,"pos":{"$in":list(dicoChromPos[chrom])}},{"_id":1}): setVarId.add(findStat["_id"])
+    return bulkWrite(dicoInit,dicoInit["collect_nk_varstat"],varStatOps(dicoInit,list(setVarId)),batchNum)
+
+#***** Threshold runs of a depth BED *****#
+# Pass-through generator collecting in lstRun the (chrom,start,end,nbThreshold) runs of
+# adjacent intervals reaching the same number of thresholds (1-based inclusive positions)
+def covThresholdRuns(dicoInit,bedReader,lstRun):
+    run = None
+    for chrom,start,end,depth in bedReader:
+        nbThreshold = bisect.bisect_right(dicoInit["lstCovThreshold"],depth)
+        if run and run[0]==chrom and run[2]==start and run[3]==nbThreshold: run[2] = end
+        else:
+            if run and run[3]>0: lstRun.append((run[0],run[1]+1,run[2],run[3]))
+            run = [chrom,start,end,nbThreshold]
+        yield (chrom,start,end,depth)
+    if run and run[3]>0: lstRun.append((run[0],run[1]+1,run[2],run[3]))
+
+#***** Aggregates increments for the depth runs of a new sample *****#
+# dicoPoint = { chrom: ([sorted pos], { pos: depth }) } single positions already loaded for the sample
+# (add-vcf/add-nksample) so already counted up to their depth (step=-1 for a deleted sample)
+def varStatDepthOps(dicoInit,lstRun,dicoPoint,step=1):
+    lstOps = []
+    lstThreshold = dicoInit["lstCovThreshold"]
+    for chrom,start,end,nbThreshold in lstRun:
+        query = { "chrom":chrom, "pos":{"$gte":start,"$lte":end} }
+        lstPoint = []
+        if chrom in dicoPoint:
+            lstPointPos = dicoPoint[chrom][0]
+            lstPoint = lstPointPos[bisect.bisect_left(lstPointPos,start):bisect.bisect_right(lstPointPos,end)]
+        if lstPoint: query["pos"]["$nin"] = lstPoint
+        lstOps.append(pymongo.UpdateMany(query,{"$inc":dict([("cov."+str(threshold),step) for threshold in lstThreshold[:nbThreshold]])}))
+        for pos in lstPoint:
+            nbPointThreshold = bisect.bisect_right(lstThreshold,dicoPoint[chrom][1][pos])
+            if nbThreshold>nbPointThreshold:
+                lstOps.append(pymongo.UpdateMany({"chrom":chrom,"pos":pos},{"$inc":dict([("cov."+str(threshold),step) for threshold in lstThreshold[nbPointThreshold:nbThreshold]])}))
+    return lstOps
+
+#***** REBUILD aggregates *****#
+# Computed in a temporary collection then renamed over nk_varstat
+def rebuildAggregates(dicoInit):
+    if not dicoInit["quiet"]:
+        printcolor("\nSub-command: rebuild-aggregates\n","1",dicoInit['blue1'],None,dicoInit['colorBool'])
+        printcolor("    Compute variant aggregates (nk_varstat)\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    startTime = time.time()
+    collectTmp = dicoInit["db"]["nk_varstat_rebuild"]
+    collectTmp.drop()
+    nbVar = 0
+    nbError = 0
+    nbBatch = 0
+    lstVarId = []
+    cursor = dicoInit["collect_nk_var"].find({},{"_id":1},batch_size=dicoInit["nbChunk"])
+    for findVar in tqdm(cursor,ncols=30,leave=True,disable=dicoInit["quiet"],bar_format="      {n_fmt} variants [{rate_fmt}]"):
+        lstVarId.append(findVar["_id"])
+        if len(lstVarId)>=dicoInit["nbChunk"]:
+            nbBatch+=1
+            nbError+=bulkWrite(dicoInit,collectTmp,[op for op in varStatOps(dicoInit,lstVarId) if isinstance(op,pymongo.ReplaceOne)],nbBatch)
+            nbVar+=len(lstVarId)
+            lstVarId = []
+    if lstVarId:
+        nbBatch+=1
+        nbError+=bulkWrite(dicoInit,collectTmp,[op for op in varStatOps(dicoInit,lstVarId) if isinstance(op,pymongo.ReplaceOne)],nbBatch)
+        nbVar+=len(lstVarId)
+    if nbError>0: exit("\n"+str(nbError)+" aggregates failed, `nk_varstat` unchanged.\n")
+    if nbVar>0: collectTmp.rename("nk_varstat",dropTarget=True)
+    else: dicoInit["collect_nk_varstat"].delete_many({})
+    ensureIndexes(dicoInit)
+    if not dicoInit["quiet"]: printcolor("      "+str(nbVar)+" variant aggregates computed in "+str(round(time.time()-startTime,1))+"s.\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+
+
 
 #---------------------------------------------------------------#
 #---------------------------------------------------------------#
@@ -89,10 +811,10 @@ def listRun(dicoInit):
     runKeys = ["instrument","project","ref","target","name","num","date","seqname","seqnum","seqdate","seqstatus","chip","seqkit","libKit"]
     prettyRunKeys = ["instrument","project","ref","name","num","date"]
     table = []
-    # Output CSV
+    # Output CSV (streamed)
     OUT = open(dicoInit["pathOutput"],'w')
     OUT.write("\t".join(runKeys)+"\n")
-    for runEntry in dicoInit["collect_nk_run"].find().sort("num",pymongo.ASCENDING):
+    for runEntry in dicoInit["collect_nk_run"].find(runFilterQuery(dicoInit,"")).sort("num",pymongo.ASCENDING):
         ToWrite = ""
         row = []
         for key in runKeys:
@@ -104,39 +826,57 @@ def listRun(dicoInit):
                     if len(text)<=dicoInit["truncateWidth"][1]: row.append(text)
                     else: row.append(text[0:dicoInit["truncateWidth"][1]-3]+"...")
         OUT.write(ToWrite[:-1]+"\n")
-        table.append(row)
+        if row: table.append(row)
+        if len(table)>=dicoInit["nbPrettyRow"]: printPrettyTable(table,prettyRunKeys)
     OUT.close()
-    if dicoInit["listPretty"]==True: print("\n"+tabulate(table, prettyRunKeys, tablefmt="fancy_grid"))
+    printPrettyTable(table,prettyRunKeys)
 
 #***** LIST SAMPLE *****#
+# One aggregation joining each sample to its run ($lookup on nk_run _id), rows are streamed
 def listSample(dicoInit):
     sampleKeys = ["name","runid","bc"]
     runKeys = ["instrument","project","ref","target","name","num","date","seqname","seqnum","seqdate","seqstatus","chip","seqkit","libKit"]
     prettyRunKeys = ["instrument","project","name","num","date","ref"]
     table = []
-    # Output CSV
+    pipeline = [ {"$sort":{"name":pymongo.ASCENDING}},
+                 {"$lookup":{"from":"nk_run","localField":"runid","foreignField":"_id","as":"run"}},
+                 {"$unwind":"$run"} ]
+    dicoFilter = runFilterQuery(dicoInit,"run.")
+    if dicoFilter: pipeline.append({"$match":dicoFilter})
+    # Output CSV (streamed)
     OUT = open(dicoInit["pathOutput"],'w')
     OUT.write("\t".join(sampleKeys+runKeys)+"\n")
-    for runEntry in dicoInit["collect_nk_sample"].find().sort("name",pymongo.ASCENDING):
-        ToWrite = ""
-        row = []
-        for key in sampleKeys:
-            ToWrite+=str(runEntry[key])+"\t"
-            if dicoInit["listPretty"]==True:
-                text = str(runEntry[key])
-                if len(text)<=dicoInit["truncateWidth"][0]: row.append(text)
-                else: row.append(text[0:dicoInit["truncateWidth"][0]-3]+"...")
-        findRun = dicoInit["collect_nk_run"].find_one({"_id": runEntry["runid"]})
-        for key in runKeys:
-            ToWrite+=str(findRun[key])+"\t"
-            if dicoInit["listPretty"]==True and key in prettyRunKeys:
-                text = str(findRun[key])
+    for sampleEntry in dicoInit["collect_nk_sample"].aggregate(pipeline,allowDiskUse=True):
+        lstCell = [str(sampleEntry[key]) for key in sampleKeys]+[str(sampleEntry["run"][key]) for key in runKeys]
+        OUT.write("\t".join(lstCell)+"\n")
+        if dicoInit["listPretty"]==True:
+            row = []
+            for text in [str(sampleEntry[key]) for key in sampleKeys]+[str(sampleEntry["run"][key]) for key in prettyRunKeys]:
                 if len(text)<=dicoInit["truncateWidth"][0]: row.append(text)
                 else: row.append(text[0:dicoInit["truncateWidth"][0]-3]+"...")
-        OUT.write(ToWrite[:-1]+"\n")
-        table.append(row)
+            table.append(row)
+            if len(table)>=dicoInit["nbPrettyRow"]: printPrettyTable(table,sampleKeys+prettyRunKeys)
     OUT.close()
-    if dicoInit["listPretty"]==True: print("\n"+tabulate(table, sampleKeys+prettyRunKeys, tablefmt="fancy_grid"))
+    printPrettyTable(table,sampleKeys+prettyRunKeys)
+
+#***** PRETTY TABLE *****#
+# Printed by pages of nbPrettyRow rows, so the whole table is never kept in memory
+def printPrettyTable(table,header):
+    from tabulate import tabulate
+    if len(table)>0: print("\n"+tabulate(table, header, tablefmt="fancy_grid"))
+    del table[:]
+
+#***** Run filters *****#
+# Server-side match on run project, instrument & date range (prefix = joined run field)
+def runFilterQuery(dicoInit,prefix):
+    dicoFilter = {}
+    if dicoInit["listProject"]!="": dicoFilter[prefix+"project"] = dicoInit["listProject"]
+    if dicoInit["listInstrument"]!="": dicoFilter[prefix+"instrument"] = dicoInit["listInstrument"]
+    if dicoInit["listFrom"]!="" or dicoInit["listTo"]!="":
+        dicoFilter[prefix+"date"] = {}
+        if dicoInit["listFrom"]!="": dicoFilter[prefix+"date"]["$gte"] = dicoInit["listFrom"]
+        if dicoInit["listTo"]!="": dicoFilter[prefix+"date"]["$lte"] = dicoInit["listTo"]
+    return dicoFilter
     
 
 
@@ -198,6 +938,7 @@ def addRun(dicoInit):
 
 #***** Add VCF *****#
 def addVcf(dicoInit):
+    import vcfpy
     if not dicoInit["quiet"]: printcolor("\nSub-command: add-vcf\n","1",dicoInit['blue2'],None,dicoInit['colorBool'])
     # Read input VCF file
     if not dicoInit["quiet"]: printcolor("    Load VCF file\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])    
@@ -215,21 +956,56 @@ def addVcf(dicoInit):
     if nkVersion=="": mainUsage(dicoInit,"Missing or empty `Nk_version` tag in input vcf header `"+dicoInit["pathInput"]+"`")
     if refGenome=="": mainUsage(dicoInit,"Any reference genome found in input vcf `"+dicoInit["pathInput"]+"`")
     if len(lstCaller)==0: mainUsage(dicoInit,"Missing or empty `Nk_calls` tag in input vcf header `"+dicoInit["pathInput"]+"`")
-    # Output GRCh38 liftovered BED
-    if refGenome=="GRCh37":
-        BED = open(dicoInit["pathDirTmp"]+"/temp_GRCh37.bed",'w')
-        dicoLiftOver = {}
-    # Browse variants
-    dicoCall = {}
+    # Claim sample load (nk_ingest)
+    sampleID = dicoInit["runId"]+"_"+dicoInit["sampleName"]
+    status,dicoIngest = claimIngest(dicoInit,"vcf",sampleID)
+    if reportClaim(dicoInit,status,dicoIngest,"nk_var"):
+        runIngest(dicoInit,dicoIngest,insertVcfRecords,sampleID,vcfReader,nkVersion,refGenome,lstCaller)
+
+#***** Insert VCF records *****#
+# Return the number of write errors
+def insertVcfRecords(dicoInit,dicoIngest,sampleID,vcfReader,nkVersion,refGenome,lstCaller):
+    # Browse variants, GRCh37 variants are lifted to GRCh38 by chunks
+    lstUnmapped = [] # unmapped GRCh37 variant ids
+    iterVariant = readVcfVariants(vcfReader,nkVersion,lstCaller)
+    if refGenome=="GRCh38" or refGenome=="chrM":
+        if not dicoInit["quiet"]: printcolor("    Insert/Update NiourK-db (nk_var)\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    else:
+        if not dicoInit["quiet"]: printcolor("    Liftover to GRCh38 & Insert/Update NiourK-db (nk_var)\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+        iterVariant = liftRecords(dicoInit,iterVariant,lstUnmapped)
+    dicoOps = { "nk_var":[], "nk_depthseg":[] }
+    lstChunkVar = [] # chunk variants for nk_varstat
+    dicoPipe = startWriters(dicoInit,dicoIngest) # writer threads (writes overlap parsing)
+    nbVar = 0
+    nbBatch = 0
+    for chrom,pos,(ref,alt,dicoVar,depth) in iterVariant:
+        varId = chrom+"_"+str(pos)+"_"+ref+"_"+alt
+        # Update depth to Nk_depthseg
+        if refGenome!="chrM":
+            dicoOps["nk_depthseg"].append(pointDepthOp(sampleID,chrom,pos,depth))
+        # Insert/update variant to Nk_var (upsert => creates the document if absent)
+        dicoOps["nk_var"].extend(varCallOps(dicoInit,varId,sampleID,dicoVar))
+        lstChunkVar.append(varId)
+        nbVar+=1
+        if len(lstChunkVar)>=dicoInit["nbChunk"]:
+            nbBatch+=1
+            submitWrites(dicoPipe,dicoOps,lstChunkVar,nbBatch)
+    # Send remaining operations
+    if lstChunkVar:
+        nbBatch+=1
+        submitWrites(dicoPipe,dicoOps,lstChunkVar,nbBatch)
+    nbError = stopWriters(dicoPipe)
+    reportUnmapped(dicoInit,lstUnmapped)
+    if not dicoInit["quiet"]: printcolor("      "+str(nbVar)+" variants inserted in NiourK-db (nk_var) in "+str(nbBatch)+" batches ("+str(nbError)+" write errors).\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    return nbError
+
+#***** Read VCF variants *****#
+# Yield (chrom,pos,(ref,alt,dicoVar,depth))
+def readVcfVariants(vcfReader,nkVersion,lstCaller):
     for record in vcfReader:
         dicoVar = { "nkversion":nkVersion , "call":{}, "filter":{} }
-        varId = record.CHROM+"_"+str(record.POS)+"_"+record.REF+"_"+str(record.ALT[0].value)
         dicoVar["af"] = round(float(record.calls[0].data.get('AF')[0]),2)
-        # Update depth to Nk_depth
-        depthId = record.CHROM+"_"+str(record.POS)
         depth = int(record.calls[0].data.get('DP'))
-        if refGenome=="GRCh38":
-            dicoInit["collect_nk_depth"].update_one({"_id" : depthId},{"$set": { dicoInit["runId"]+"_"+dicoInit["sampleName"]: depth }})
         # Calling results
         for i in range(len(lstCaller)):
             if record.INFO["CALLFILTER"][0].split("|")[i]!=".":
@@ -238,54 +1014,31 @@ def addVcf(dicoInit):
                 dicoVar["call"][lstCaller[i]] = record.INFO["CALLQUAL"][0].split("|")[i]
             if record.INFO["CALLAF"][0].split("|")[i]!=".":
                 dicoVar["callaf"] = float(record.INFO["CALLAF"][0].split("|")[i])
-        # Prepare Insert/update variant to Nk_var
-        if refGenome=="GRCh38" or refGenome=="chrM": 
-            dicoCall[varId] = dicoVar
-        # Write to temp GRCh37 BED (0-based position)
-        else:
-            bedLine = record.CHROM+"\t"+str(record.POS-1)+"\t"+str(record.POS)+"\t"+record.REF+"#"+record.ALT[0].value+"#"+str(dicoVar["af"])+"#"+str(depth)+"#"+json.dumps(dicoVar).replace(" ","")+"\n"
-            BED.write(bedLine)
-    # For GRCh38 direct Insert/update variant to Nk_var
-    if refGenome=="GRCh38" or refGenome=="chrM":
-        if not dicoInit["quiet"]: printcolor("    Insert/Update NiourK-db (nk_var)\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
-        lstVarId = list(dicoCall.keys())
-        for i in tqdm(range(len(lstVarId)),ncols=30,leave=False,bar_format="      {percentage:3.0f}%|{bar}|"):
-            findVar = dicoInit["collect_nk_var"].find_one({"_id": lstVarId[i]})
-            if findVar==None:
-                insertRun = dicoInit["collect_nk_var"].insert_one({ "_id":lstVarId[i]})
-            dicoInit["collect_nk_var"].update_one({"_id" : lstVarId[i]},{"$set": { dicoInit["runId"]+"_"+dicoInit["sampleName"]: dicoCall[lstVarId[i]] }})
-        if not dicoInit["quiet"]: printcolor("      "+str(len(lstVarId))+" variants inserted in NiourK-db (nk_var).\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
-    # Liftover
-    else:
-        BED.close()
-        if not dicoInit["quiet"]: printcolor("    Liftover to GRCh38\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])    
-        cmd_liftover = dicoInit["pathLiftover"]+" "+dicoInit["pathDirTmp"]+"/temp_GRCh37.bed "+dicoInit["pathLiftChain"]+" "+dicoInit["pathDirTmp"]+"/temp_GRCh38.bed "+dicoInit["pathDirTmp"]+"/temp_unmapped.bed 2>/dev/null"
-        os.system(cmd_liftover)
-        # Read GRCh38 variants
-        if not dicoInit["quiet"]: printcolor("    Insert/Update NiourK-db (nk_var)\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])    
-        BED = open(dicoInit["pathDirTmp"]+"/temp_GRCh38.bed",'r')
-        lstLines = BED.read().split("\n")
-        BED.close()
-        for i in tqdm(range(len(lstLines)),ncols=30,leave=False,bar_format="      {percentage:3.0f}%|{bar}|"):
-            if lstLines[i]!="":
-                splitLine = lstLines[i].split("\t")
-                splitField = splitLine[3].split("#")
-                splitLine
-                ref = splitField[0]
-                alt = splitField[1]
-                varId = splitLine[0]+"_"+str(int(splitLine[1])+1)+"_"+ref+"_"+alt
-                dicoVar = json.loads(splitField[4])
-                dicoVar["af"] = float(splitField[2])
-                # Update depth to Nk_depth
-                depthId = splitLine[0]+"_"+str(int(splitLine[1])+1)
-                depth = int(splitField[3])
-                dicoInit["collect_nk_depth"].update_one({"_id" : depthId},{"$set": { dicoInit["runId"]+"_"+dicoInit["sampleName"]: depth }})
-                # Insert/update variant to Nk_var
-                findVar = dicoInit["collect_nk_var"].find_one({"_id": varId})
-                if findVar==None:
-                    insertRun = dicoInit["collect_nk_var"].insert_one({ "_id":varId})
-                dicoInit["collect_nk_var"].update_one({"_id" : varId},{"$set": { dicoInit["runId"]+"_"+dicoInit["sampleName"]: dicoVar }})
-        if not dicoInit["quiet"]: printcolor("      "+str(len(lstLines)-1)+" variants inserted in NiourK-db (nk_var).\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+        yield (record.CHROM,record.POS,(record.REF,str(record.ALT[0].value),dicoVar,depth))
+
+
+
+#***** Liftover variants by chunks *****#
+# Yield GRCh38 (chrom,pos,payload) of GRCh37 (chrom,pos,(ref,alt,...)) variants lifted by nbChunk,
+# only the current chunk is kept in memory and unmapped variant ids are appended to lstUnmapped
+def liftRecords(dicoInit,iterVariant,lstUnmapped):
+    dicoChain = loadChainIndex(dicoInit["pathLiftChain"])
+    lstLift = []
+    for variant in iterVariant:
+        lstLift.append(variant)
+        if len(lstLift)>=dicoInit["nbChunk"]:
+            lstMapped,lstChunkUnmapped = liftBatch(dicoChain,lstLift)
+            lstUnmapped.extend([chrom+"_"+str(pos)+"_"+payload[0]+"_"+payload[1] for chrom,pos,payload in lstChunkUnmapped])
+            yield from lstMapped
+            lstLift = []
+    lstMapped,lstChunkUnmapped = liftBatch(dicoChain,lstLift)
+    lstUnmapped.extend([chrom+"_"+str(pos)+"_"+payload[0]+"_"+payload[1] for chrom,pos,payload in lstChunkUnmapped])
+    yield from lstMapped
+
+#***** Report unmapped liftover variants *****#
+def reportUnmapped(dicoInit,lstVarId):
+    if len(lstVarId)>0:
+        printcolor("      "+str(len(lstVarId))+" variants unmapped to GRCh38 ("+", ".join(lstVarId[:5])+("..." if len(lstVarId)>5 else "")+")\n","0",dicoInit['red'],None,dicoInit['colorBool'])
 
 
 
@@ -295,17 +1048,55 @@ def addNkSample(dicoInit):
     if not dicoInit["quiet"]:
         printcolor("\nSub-command: add-nksample\n","1",dicoInit['blue1'],None,dicoInit['colorBool'])
         printcolor("  sampleId: "+sampleID+"\n","1",dicoInit['blue2'],None,dicoInit['colorBool'])
+    # Claim sample load (nk_ingest)
+    status,dicoIngest = claimIngest(dicoInit,"nksample",sampleID)
+    if reportClaim(dicoInit,status,dicoIngest,"nk_var"):
+        runIngest(dicoInit,dicoIngest,insertNkSampleRecords,sampleID)
+
+#***** Insert NkSample records *****#
+# Return the number of write errors
+# (the NkSample JSON is a single object loaded at once, its variants are lifted & inserted by chunks)
+def insertNkSampleRecords(dicoInit,dicoIngest,sampleID):
     # Load JSON
     if not dicoInit["quiet"]: printcolor("    Load NkSample JSON file\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])    
     JSON = open(dicoInit["pathInput"],'r')
     dataSampleJson = json.load(JSON)
     JSON.close()
-    # Output GRCh38 liftovered BED
-    BED = open(dicoInit["pathDirTmp"]+"/temp_GRCh37.bed",'w')
-    dicoLiftOver = {}
     # Browse sample variants
-    if not dicoInit["quiet"]: printcolor("    Read NkSample variants\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])    
-    for key in dataSampleJson:
+    if not dicoInit["quiet"]: printcolor("    Liftover to GRCh38 & Insert/Update NiourK-db (nk_var)\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])    
+    # Sample depth already inserted from its depth BED
+    findInsertStatut = dicoInit["collect_nk_depthseg"].find_one({"_id":"insertsample"})
+    boolDepthLoaded = findInsertStatut!=None and sampleID in findInsertStatut["lstrunid"]
+    lstUnmapped = [] # unmapped GRCh37 variant ids
+    dicoOps = { "nk_var":[], "nk_depthseg":[] }
+    lstChunkVar = [] # chunk variants for nk_varstat
+    dicoPipe = startWriters(dicoInit,dicoIngest) # writer threads (writes overlap parsing)
+    nbVar = 0
+    nbBatch = 0
+    for chrom,pos,(ref,alt,dicoVar,depth) in liftRecords(dicoInit,readNkSampleVariants(dicoInit,sampleID,dataSampleJson),lstUnmapped):
+        varId = chrom+"_"+str(pos)+"_"+ref+"_"+alt
+        # Add depth to Nk_depthseg if absent
+        if not boolDepthLoaded:
+            dicoOps["nk_depthseg"].append(pointDepthOp(sampleID,chrom,pos,depth,False))
+        # Insert/update variant to Nk_var
+        dicoOps["nk_var"].extend(varCallOps(dicoInit,varId,sampleID,dicoVar))
+        lstChunkVar.append(varId)
+        nbVar+=1
+        if len(lstChunkVar)>=dicoInit["nbChunk"]:
+            nbBatch+=1
+            submitWrites(dicoPipe,dicoOps,lstChunkVar,nbBatch)
+    if lstChunkVar:
+        nbBatch+=1
+        submitWrites(dicoPipe,dicoOps,lstChunkVar,nbBatch)
+    nbError = stopWriters(dicoPipe)
+    reportUnmapped(dicoInit,lstUnmapped)
+    if not dicoInit["quiet"]: printcolor("      "+str(nbVar)+" variants inserted in NiourK-db (nk_var) in "+str(nbBatch)+" batches ("+str(nbError)+" write errors).\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    return nbError
+
+#***** Read NkSample variants *****#
+# Yield GRCh37 (chrom,pos,(ref,alt,dicoCall,depth)), the sample haplogroup is updated in nk_sample
+def readNkSampleVariants(dicoInit,sampleID,dataSampleJson):
+    for key in tqdm(dataSampleJson,ncols=30,leave=False,disable=dicoInit["quiet"],bar_format="      {percentage:3.0f}%|{bar}|"):
         dicoCall = {"version":"1.7", "call":{}, "filter":{}}
         # Haplo features
         if key=="haplo": # H1b2 (0.64)
@@ -329,89 +1120,191 @@ def addNkSample(dicoInit):
                     dicoCall["call"][caller.lower()] = dataSampleJson[varId][caller+"_pseudo"]
                 elif caller+"filtered" in dataSampleJson[varId]:
                     dicoCall["filter"][caller.lower()] = dataSampleJson[varId][caller+"filtered"]
-        # Write to temp GRCh37 BED (0-based position)
-        bedLine = chrom+"\t"+str(pos-1)+"\t"+str(pos)+"\t"+ref+"#"+alt+"#"+str(af)+"#"+str(sb)+"#"+str(depth)+"#"+json.dumps(dicoCall).replace(" ","")+"\n"
-        BED.write(bedLine)
-    BED.close()
-    # Liftover
-    if not dicoInit["quiet"]: printcolor("    Liftover to GRCh38\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])    
-    cmd_liftover = dicoInit["pathLiftover"]+" "+dicoInit["pathDirTmp"]+"/temp_GRCh37.bed "+dicoInit["pathLiftChain"]+" "+dicoInit["pathDirTmp"]+"/temp_GRCh38.bed "+dicoInit["pathDirTmp"]+"/temp_unmapped.bed 2>/dev/null"
-    os.system(cmd_liftover)
-    # Read GRCh38 variants
-    if not dicoInit["quiet"]: printcolor("    Insert/Update NiourK-db (nk_var)\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])    
-    BED = open(dicoInit["pathDirTmp"]+"/temp_GRCh38.bed",'r')
-    lstLines = BED.read().split("\n")
-    BED.close()
-    for i in tqdm(range(len(lstLines)),ncols=30,leave=False,bar_format="      {percentage:3.0f}%|{bar}|"):
-        if lstLines[i]!="":
-            splitLine = lstLines[i].split("\t")
-            splitField = splitLine[3].split("#")
-            ref = splitField[0]
-            alt = splitField[1]
-            varId = splitLine[0]+"_"+str(int(splitLine[1])+1)+"_"+ref+"_"+alt
-            dicoVar = json.loads(splitField[5])
-            dicoVar["af"] = float(splitField[2])
-            dicoVar["sb"] = float(splitField[3])
-            # Add depth to Nk_depth if absent
-            depthId = splitLine[0]+"_"+str(int(splitLine[1])+1)
-            depth = int(splitField[4])
-            findDepth = dicoInit["collect_nk_depth"].find_one({"_id": depthId})
-            if not findDepth:
-                insertDepth = dicoInit["collect_nk_depth"].insert_one({"_id" : depthId},{"$set": { sampleID: depth }})
-            elif not sampleID in findDepth:
-                dicoInit["collect_nk_depth"].update_one({"_id" : depthId},{"$set": { sampleID: depth }})
-            # Insert/update variant to Nk_var
-            findVar = dicoInit["collect_nk_var"].find_one({"_id": varId})
-            if findVar==None:
-                insertRun = dicoInit["collect_nk_var"].insert_one({ "_id":varId})
-            dicoInit["collect_nk_var"].update_one({"_id" : varId},{"$set": { sampleID: dicoVar }})
-    if not dicoInit["quiet"]: printcolor("      "+str(len(lstLines)-1)+" variants inserted in NiourK-db (nk_var).\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+            dicoCall["af"] = float(af)
+            dicoCall["sb"] = float(sb)
+            yield (chrom,pos,(ref,alt,dicoCall,int(depth)))
 
 
 
 #***** Add Depth *****#
 def addDepth(dicoInit):
+    from Nk_covstore import openCovStore,lockCovStore,unlockCovStore,covStoreWriter,commitCovStore
     sampleID = dicoInit["runId"]+"_"+dicoInit["sampleName"]
     if not dicoInit["quiet"]:
         printcolor("\nSub-command: add-depth\n","1",dicoInit['blue1'],None,dicoInit['colorBool'])
         printcolor("  sampleId: "+sampleID+"\n","1",dicoInit['blue2'],None,dicoInit['colorBool'])
     # Check if sample already inserted:
-    findInsertStatut = dicoInit["collect_nk_depth"].find_one({"_id":"insertsample"})
+    findInsertStatut = dicoInit["collect_nk_depthseg"].find_one({"_id":"insertsample"})
     boolInsert = True
     if findInsertStatut==None:
-        dicoInit["collect_nk_depth"].insert_one({"_id" : "insertsample", "lstrunid": []})
+        dicoInit["collect_nk_depthseg"].insert_one({"_id" : "insertsample", "lstrunid": []})
     elif sampleID in findInsertStatut["lstrunid"]:
-        if not dicoInit["quiet"]: printcolor("      already inserted in NiourK-db (nk_depth).\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+        if not dicoInit["quiet"]: printcolor("      already inserted in NiourK-db (nk_depthseg).\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
         boolInsert = False
+    # Claim sample load (nk_ingest)
     if boolInsert:
-        # Insert GRCH38 sample positions
-        if not dicoInit["quiet"]: printcolor("    Load depth BED file\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])            
-        # Accept bed and bed.gz
-        if ".gz" in dicoInit["pathInput"]: BED = gzip.open(dicoInit["pathInput"], 'rb')
-        else: BED = open(dicoInit["pathInput"],'r')
-        lstLines = BED.read().split("\n")
-        BED.close()
-        if not dicoInit["quiet"]: printcolor("    Insert/Update NiourK-db (nk_depth)\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])            
-        for i in tqdm(range(len(lstLines)),ncols=30,leave=True,bar_format="  {percentage:3.0f}%|{bar}|"):
-            try:
-                splitLine = lstLines[i].split("\t")
-                chrom = splitLine[0]
-                start = int(splitLine[1])+1 # 1-based in nk_depth
-                end = int(splitLine[2])
-                depth = int(splitLine[3]) # zero depth was already filtered from input bed
-                for pos in range(start,end+1,1):
-                    depthId = chrom+"_"+str(pos)
-                    # upsert => creates a new document if no documents match the filter.
-                    dicoInit["collect_nk_depth"].update_one({"_id" : depthId},{"$set": { sampleID: depth }},upsert=True)
-            except: pass
-        if not dicoInit["quiet"]: printcolor("      "+str(len(lstLines))+" positions depth inserted in NiourK-db (nk_depth).\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
-        # add to InsertStatut
-        dicoInit["collect_nk_depth"].update_one({"_id" : "insertsample"}, {'$push': {'lstrunid': sampleID}})
+        status,dicoIngest = claimIngest(dicoInit,"depth",sampleID)
+        boolInsert = reportClaim(dicoInit,status,dicoIngest,"nk_depthseg")
+    # Memory-mapped depth store written while streaming the BED
+    dicoStat = { "lines":0, "malformed":0, "lstMalformed":[] }
+    bedReader = readDepthBed(dicoInit["pathInput"],dicoStat)
+    covStore = None
+    if dicoInit["pathCovStore"]!="":
+        covStore = openCovStore(dicoInit["pathCovStore"])
+        lockCovStore(covStore) # parallel loads of the store wait until commitCovStore
+        if sampleID in covStore["meta"]["samples"]:
+            if not dicoInit["quiet"]: printcolor("      already inserted in depth store.\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+            unlockCovStore(covStore)
+            covStore = None
+        else: bedReader = covStoreWriter(covStore,bedReader)
+    if boolInsert:
+        runIngest(dicoInit,dicoIngest,insertDepthSegments,sampleID,bedReader,dicoStat)
+    elif covStore:
+        if not dicoInit["quiet"]: printcolor("    Stream depth BED file to depth store\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+        for interval in bedReader: pass
+    if covStore:
+        commitCovStore(covStore,sampleID)
+        if not dicoInit["quiet"]: printcolor("      sample added to depth store ("+str(len(covStore["meta"]["samples"]))+" samples).\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+
+#***** Insert depth segments *****#
+# Return the number of write errors (chunks committed by an interrupted load are skipped)
+def insertDepthSegments(dicoInit,dicoIngest,sampleID,bedReader,dicoStat):
+    # Insert GRCH38 sample positions (BED is streamed, never loaded in memory)
+    if not dicoInit["quiet"]: printcolor("    Stream depth BED file to NiourK-db (nk_depthseg)\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])            
+    nbSeg = 0
+    nbError = 0
+    nbBatch = 0
+    lstOps = []
+    # Variant aggregates increments (none to update before any variant)
+    lstRun = None
+    if dicoInit["collect_nk_varstat"].estimated_document_count()>0:
+        lstRun = []
+        dicoPoint = {}
+        # Single positions only (segments of an interrupted load are not already counted)
+        for findSeg in dicoInit["collect_nk_depthseg"].find({"sample":sampleID,"point":True},{"_id":0,"chrom":1,"start":1,"depth":1}):
+            if not findSeg["chrom"] in dicoPoint: dicoPoint[findSeg["chrom"]] = ([],{})
+            dicoPoint[findSeg["chrom"]][1][findSeg["start"]] = findSeg["depth"]
+        for chrom in dicoPoint: dicoPoint[chrom][0].extend(sorted(dicoPoint[chrom][1]))
+        bedReader = covThresholdRuns(dicoInit,bedReader,lstRun)
+    segReader = depthBedSegments(dicoInit,sampleID,bedReader)
+    for segment in tqdm(segReader,ncols=30,leave=True,disable=dicoInit["quiet"],bar_format="      {n_fmt} segments [{rate_fmt}]"):
+        # upsert => creates a new document if no documents match the filter.
+        lstOps.append(pymongo.ReplaceOne({"_id" : segment["_id"]},segment,upsert=True))
+        nbSeg+=1
+        # Send full batch
+        if len(lstOps)>=dicoInit["nbChunk"]:
+            nbBatch+=1
+            nbError+=writeDepthChunk(dicoInit,dicoIngest,lstOps,lstRun,dicoPoint if lstRun!=None else None,nbBatch,nbError)
+            lstOps = []
+            if lstRun: del lstRun[:]
+    if lstOps or lstRun:
+        nbBatch+=1
+        nbError+=writeDepthChunk(dicoInit,dicoIngest,lstOps,lstRun,dicoPoint if lstRun!=None else None,nbBatch,nbError)
+    # Malformed lines
+    if dicoStat["malformed"]>0:
+        printcolor("      "+str(dicoStat["malformed"])+"/"+str(dicoStat["lines"])+" malformed BED lines skipped (line "+", ".join(map(str,dicoStat["lstMalformed"]))+("..." if dicoStat["malformed"]>len(dicoStat["lstMalformed"]) else "")+")\n","0",dicoInit['red'],None,dicoInit['colorBool'])
+    if not dicoInit["quiet"]: printcolor("      "+str(nbSeg-nbError)+" depth segments inserted in NiourK-db (nk_depthseg) in "+str(nbBatch)+" batches.\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    if nbError>0: exit("\n"+str(nbError)+" depth writes failed, `"+sampleID+"` not marked as inserted (run `rebuild-aggregates` after reloading it).\n")
+    if dicoIngest["chunk"]>0 and lstRun!=None and not dicoInit["quiet"]:
+        printcolor("      resumed load, run `rebuild-aggregates` to correct variant aggregates (nk_varstat).\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    # add to InsertStatut
+    dicoInit["collect_nk_depthseg"].update_one({"_id" : "insertsample"}, {'$addToSet': {'lstrunid': sampleID}})
+    return nbError
+
+#***** Write a depth chunk *****#
+# Skipped when committed by an interrupted load, checkpointed when written without error
+def writeDepthChunk(dicoInit,dicoIngest,lstOps,lstRun,dicoPoint,nbBatch,nbPreviousError):
+    if nbBatch<=dicoIngest["chunk"]: return 0
+    nbError = 0
+    if lstOps: nbError+=bulkWrite(dicoInit,dicoInit["collect_nk_depthseg"],lstOps,nbBatch)
+    if lstRun: nbError+=bulkWrite(dicoInit,dicoInit["collect_nk_varstat"],varStatDepthOps(dicoInit,lstRun,dicoPoint),nbBatch)
+    # checkpoint only while every previous chunk is written
+    if nbError==0 and nbPreviousError==0: checkpointIngest(dicoInit,dicoIngest,nbBatch)
+    return nbError
+
+
+
+#***** Add batch *****#
+# Ingest a list of files with a pool of processes, each worker keeps one connection
+def addBatch(dicoInit):
+    if not dicoInit["quiet"]:
+        printcolor("\nSub-command: add-batch\n","1",dicoInit['blue1'],None,dicoInit['colorBool'])
+        printcolor("  "+str(len(dicoInit["lstBatchJob"]))+" "+dicoInit["batchType"]+" files, "+str(dicoInit["nbThread"])+" processes\n","1",dicoInit['blue2'],None,dicoInit['colorBool'])
+    # Shared configuration (without connection objects)
+    dicoConfig = {}
+    for key in dicoInit:
+        if key!="db" and not key.startswith("collect_") and key!="lstBatchJob": dicoConfig[key] = dicoInit[key]
+    nbOk = 0
+    nbFailed = 0
+    totalSize = 0
+    startTime = time.time()
+    pool = multiprocessing.get_context("fork").Pool(processes=dicoInit["nbThread"],initializer=initBatchWorker,initargs=(dicoConfig,))
+    for pathFile,sampleID,status,message,elapsed,dicoJobProfile in pool.imap_unordered(runBatchJob,dicoInit["lstBatchJob"]):
+        if dicoJobProfile:
+            from Nk_profile import mergeProfile
+            mergeProfile(dicoJobProfile)
+        if status=="ok":
+            nbOk+=1
+            totalSize+=os.path.getsize(pathFile)
+            color = dicoInit['green']
+        else:
+            nbFailed+=1
+            color = dicoInit['red']
+        printcolor("    ["+str(nbOk+nbFailed).rjust(len(str(len(dicoInit["lstBatchJob"]))))+"/"+str(len(dicoInit["lstBatchJob"]))+"] "+status.ljust(6)+" "+str(round(elapsed,1)).rjust(7)+"s  "+os.path.basename(pathFile)+("  ("+sampleID+")" if sampleID else "")+"\n","0",color,None,dicoInit['colorBool'])
+        if message!="": printcolor("            "+message+"\n","0",dicoInit['red'],None,dicoInit['colorBool'])
+    pool.close()
+    pool.join()
+    # Throughput summary
+    elapsed = time.time()-startTime
+    printcolor("\n  "+str(nbOk)+" files inserted, "+str(nbFailed)+" failed in "+str(round(elapsed,1))+"s","1",dicoInit['white'],None,dicoInit['colorBool'])
+    if elapsed>0: printcolor(" ("+str(round((nbOk+nbFailed)/elapsed,2))+" files/s, "+convertByteSize(int(totalSize/elapsed))+"/s)","0",dicoInit['white'],None,dicoInit['colorBool'])
+    printcolor("\n","0",dicoInit['white'],None,dicoInit['colorBool'])
+
+#***** Add batch worker initialization *****#
+def initBatchWorker(dicoConfig):
+    global dicoBatchInit
+    dicoBatchInit = dict(dicoConfig)
+    dicoBatchInit["quiet"] = True
+    dicoBatchInit["pathDirTmp"] = "" # created on demand (getTmpDir)
+    connectMongo(dicoBatchInit)
+    # Forked process profile already contains the parent commands
+    if dicoBatchInit["pathProfile"]!="":
+        from Nk_profile import takeProfile
+        takeProfile()
+
+#***** Add batch single file *****#
+# (worker query profile is sent back with the job result)
+def runBatchJob(job):
+    result = runBatchFile(job)
+    if dicoBatchInit["pathProfile"]=="": return result+(None,)
+    from Nk_profile import takeProfile
+    return result+(takeProfile(),)
+
+#***** Add batch single file (without profile) *****#
+def runBatchFile(job):
+    pathFile,run,sample = job
+    dicoAddFunction = { "run":addRun, "depth":addDepth, "vcf":addVcf, "nksample":addNkSample }
+    startTime = time.time()
+    dicoBatchInit["pathInput"] = pathFile
+    sampleID = ""
+    try:
+        if dicoBatchInit["batchType"]!="run":
+            error = searchRunSample(dicoBatchInit,run,sample)
+            if error!="": return (pathFile,run+"_"+sample,"failed",error,time.time()-startTime)
+            sampleID = dicoBatchInit["runId"]+"_"+dicoBatchInit["sampleName"]
+        dicoAddFunction[dicoBatchInit["batchType"]](dicoBatchInit)
+    except SystemExit as e:
+        if str(e.code).strip()!="": return (pathFile,sampleID,"failed",str(e.code).strip(),time.time()-startTime)
+    except Exception as e:
+        return (pathFile,sampleID,"failed",type(e).__name__+": "+str(e),time.time()-startTime)
+    return (pathFile,sampleID,"ok","",time.time()-startTime)
 
 
 
 #***** Get variant features *****#
 def getVariant(dicoInit):
+    from tabulate import tabulate
+    from Nk_covstore import openCovStore,covStoreCount
     varID = dicoInit["varInput"]
     if not dicoInit["quiet"]:
         printcolor("\nSub-command: get-variant\n","1",dicoInit['blue1'],None,dicoInit['colorBool'])
@@ -420,16 +1313,19 @@ def getVariant(dicoInit):
     findVar = dicoInit["collect_nk_var"].find_one({"_id":varID})
     if not findVar: printcolor("  find   : 0 occurence in NiourK-db\n","1",dicoInit['red'],None,dicoInit['colorBool'])
     else:
-        countSamples = len(findVar)-1
+        lstCall = list(iterVarCalls(findVar))
+        countSamples = len(lstCall)
         printcolor("  find     : "+str(countSamples)+" occurences in NiourK-db\n","1",dicoInit['green'],None,dicoInit['colorBool'])
         # Search number of samples with depth at this position in nk_depth
-        depthId = "_".join(varID.split("_")[:-2])
-        nbOverlapSample = 1
-        findDepth = dicoInit["collect_nk_depth"].find_one({"_id":depthId})
-        if findDepth:
-            for key in findDepth:
-                if key!="_id" and findDepth[key]>=dicoInit["mindepth"]:
-                    nbOverlapSample+=1
+        chrom = varID.split("_")[0]
+        pos = int(varID.split("_")[1])
+        nbCovering = None
+        if dicoInit["pathCovStore"]!="": nbCovering = covStoreCount(openCovStore(dicoInit["pathCovStore"]),chrom,pos,dicoInit["mindepth"])
+        elif dicoInit["mindepth"] in dicoInit["lstCovThreshold"]:
+            findStat = dicoInit["collect_nk_varstat"].find_one({"_id":varID})
+            if findStat: nbCovering = findStat["cov"][str(dicoInit["mindepth"])]
+        if nbCovering==None: nbCovering = len(coveringSamples(dicoInit,chrom,pos,dicoInit["mindepth"]))
+        nbOverlapSample = 1+nbCovering
         # Compute variant DB frequency
         varDBfreq = round(((countSamples*100)/nbOverlapSample),1)
         printcolor("  DB depth : "+str(nbOverlapSample)+" samples","1",dicoInit['white'],None,dicoInit['colorBool'])
@@ -438,16 +1334,604 @@ def getVariant(dicoInit):
         # Display samples summary table
         header = ["sample","af","sb","call","filter","version"]
         table = []
-        for key in findVar:
-            if key!="_id":
-                row = [key,str(findVar[key]['af']),str(findVar[key]['sb'])]
-                callCell = " "
-                filterCell = " "
-                for tool in findVar[key]['call']: callCell+=tool+" ("+str(findVar[key]['call'][tool])+")"+"\n"
-                for tool in findVar[key]['filter']: callCell+=tool+" ("+str(findVar[key]['filter'][tool])+")"+"\n"
-                row.append(callCell[:-1])
-                row.append(filterCell[:-1])
-                row.append(findVar[key]['version'])
-                table.append(row)
+        for sampleID,dicoVar in lstCall:
+            # add-vcf entries have no strand bias and a `nkversion`
+            row = [sampleID,str(dicoVar.get('af',"")),str(dicoVar.get('sb',""))]
+            callCell = " "
+            filterCell = " "
+            for tool in dicoVar['call']: callCell+=tool+" ("+str(dicoVar['call'][tool])+")"+"\n"
+            for tool in dicoVar['filter']: filterCell+=tool+" ("+str(dicoVar['filter'][tool])+")"+"\n"
+            row.append(callCell[:-1])
+            row.append(filterCell[:-1])
+            row.append(dicoVar.get('version',dicoVar.get('nkversion',"")))
+            table.append(row)
         for line in tabulate(table, header, tablefmt="fancy_grid").split("\n"):
             printcolor("  "+line+"\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+
+
+
+#***** Get features of a file of variants *****#
+# Variants are resolved by chunks: `$in` on nk_varstat aggregates, then for the
+# remaining ones `$in` on nk_var & `$or` overlap queries on nk_depthseg
+def getVariantBatch(dicoInit):
+    from Nk_covstore import openCovStore,covStoreCounts
+    if not dicoInit["quiet"]:
+        printcolor("\nSub-command: get-variant\n","1",dicoInit['blue1'],None,dicoInit['colorBool'])
+        printcolor("  input    : "+os.path.basename(dicoInit["varInput"])+"\n","1",dicoInit['blue2'],None,dicoInit['colorBool'])
+    # Unique variants (input order)
+    lstVarId = []
+    setVarId = set()
+    dicoStat = { "lines":0, "malformed":0, "lstMalformed":[] }
+    for varID in readVariantIds(dicoInit["varInput"],dicoStat):
+        if not varID in setVarId:
+            setVarId.add(varID)
+            lstVarId.append(varID)
+    if dicoStat["malformed"]>0:
+        printcolor("      "+str(dicoStat["malformed"])+"/"+str(dicoStat["lines"])+" malformed variant lines skipped (line "+", ".join(map(str,dicoStat["lstMalformed"]))+("..." if dicoStat["malformed"]>len(dicoStat["lstMalformed"]) else "")+")\n","0",dicoInit['red'],None,dicoInit['colorBool'])
+    covStore = None
+    if dicoInit["pathCovStore"]!="": covStore = openCovStore(dicoInit["pathCovStore"])
+    lstResult = []
+    startTime = time.time()
+    for i in tqdm(range(0,len(lstVarId),dicoInit["nbChunk"]),ncols=30,leave=False,disable=dicoInit["quiet"],bar_format="      {percentage:3.0f}%|{bar}|"):
+        lstChunk = lstVarId[i:i+dicoInit["nbChunk"]]
+        dicoOccur = {}
+        dicoCovering = {}
+        # Precomputed aggregates
+        lstPending = lstChunk
+        if dicoInit["pathCovStore"]=="" and dicoInit["mindepth"] in dicoInit["lstCovThreshold"]:
+            for findStat in dicoInit["collect_nk_varstat"].find({"_id":{"$in":lstChunk}}):
+                dicoOccur[findStat["_id"]] = findStat["carriers"]
+                dicoCovering[(findStat["chrom"],findStat["pos"])] = findStat["cov"][str(dicoInit["mindepth"])]
+            lstPending = [varID for varID in lstChunk if not varID in dicoOccur]
+        # Occurences (number of sample fields, without transferring them)
+        dicoOccur.update(variantCarriers(dicoInit,lstPending))
+        # Covering samples by chromosome
+        dicoChromPos = {}
+        for varID in lstPending:
+            chrom = varID.split("_")[0]
+            if not chrom in dicoChromPos: dicoChromPos[chrom] = []
+            dicoChromPos[chrom].append(int(varID.split("_")[1]))
+        for chrom in dicoChromPos:
+            lstPos = dicoChromPos[chrom]
+            lstPosDB = lstPos
+            if covStore:
+                lstPosDB = []
+                for pos,count in zip(lstPos,covStoreCounts(covStore,chrom,lstPos,dicoInit["mindepth"])):
+                    if count==-1: lstPosDB.append(pos)
+                    else: dicoCovering[(chrom,pos)] = int(count)
+            if len(lstPosDB)>0:
+                for pos,count in coveringCounts(dicoInit,chrom,lstPosDB,dicoInit["mindepth"]).items(): dicoCovering[(chrom,pos)] = count
+        # Same DB frequency as single variant mode
+        for varID in lstChunk:
+            countSamples = dicoOccur.get(varID,0)
+            nbOverlapSample = 1+dicoCovering[(varID.split("_")[0],int(varID.split("_")[1]))]
+            lstResult.append({ "variant":varID, "occurences":countSamples, "covering":nbOverlapSample, "freq":round(((countSamples*100)/nbOverlapSample),1) })
+    # Write output
+    if dicoInit["pathOutput"].endswith(".json"):
+        OUT = open(dicoInit["pathOutput"],'w')
+        json.dump({ "mindepth":dicoInit["mindepth"], "variants":lstResult },OUT,indent=1)
+        OUT.close()
+    else:
+        OUT = open(dicoInit["pathOutput"],'w')
+        OUT.write("#variant\toccurences\tcovering(depth>="+str(dicoInit["mindepth"])+")\tfreq\n")
+        for dicoResult in lstResult: OUT.write(dicoResult["variant"]+"\t"+str(dicoResult["occurences"])+"\t"+str(dicoResult["covering"])+"\t"+str(dicoResult["freq"])+"\n")
+        OUT.close()
+    if not dicoInit["quiet"]:
+        nbFound = len([dicoResult for dicoResult in lstResult if dicoResult["occurences"]>0])
+        elapsed = time.time()-startTime
+        printcolor("  find     : "+str(nbFound)+"/"+str(len(lstResult))+" variants in NiourK-db\n","1",dicoInit['green'],None,dicoInit['colorBool'])
+        printcolor("      "+str(len(lstResult))+" variants in "+str(round(elapsed,1))+"s ("+str(round(len(lstResult)/max(elapsed,0.001),1))+" variants/s)\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+
+
+
+#***** Get sample variants *****#
+# Variant ids from nk_samplevar (and calls.sample index in array layout, see sampleVariants)
+# then only the sample field and the sample array element are transferred
+def getSample(dicoInit):
+    sampleID = dicoInit["runId"]+"_"+dicoInit["sampleName"]
+    if not dicoInit["quiet"]:
+        printcolor("\nSub-command: get-sample\n","1",dicoInit['blue1'],None,dicoInit['colorBool'])
+        printcolor("  sampleId : "+sampleID+"\n","1",dicoInit['blue2'],None,dicoInit['colorBool'])
+    startTime = time.time()
+    lstCall = [] # [(varID,dicoVar)]
+    lstVarId = sampleVariants(dicoInit,sampleID)
+    for i in range(0,len(lstVarId),dicoInit["nbChunk"]):
+        pipeline = [ {"$match":{"_id":{"$in":lstVarId[i:i+dicoInit["nbChunk"]]}}}, \
+                     {"$project":{sampleID:1,"calls":{"$filter":{"input":"$calls","cond":{"$eq":["$$this.sample",sampleID]}}}}} ]
+        for findVar in dicoInit["collect_nk_var"].aggregate(pipeline):
+            for callSampleID,dicoVar in iterVarCalls(findVar):
+                if callSampleID==sampleID: lstCall.append((findVar["_id"],dicoVar))
+    # Coordinate order
+    lstChrom = list(dicoChrSize)
+    lstCall.sort(key=lambda call: (lstChrom.index(call[0].split("_")[0]) if call[0].split("_")[0] in lstChrom else len(lstChrom),call[0].split("_")[0],int(call[0].split("_")[1]),call[0]))
+    # Write output
+    lstField = ["variant","af","sb","callaf","call","filter","version"]
+    lstResult = []
+    for varID,dicoVar in lstCall:
+        lstResult.append({ "variant":varID, "af":dicoVar.get("af",""), "sb":dicoVar.get("sb",""), "callaf":dicoVar.get("callaf",""), "call":exportCallString(dicoVar.get("call",{})), \
+                           "filter":exportCallString(dicoVar.get("filter",{})), "version":dicoVar.get("version",dicoVar.get("nkversion","")) })
+    OUT = open(dicoInit["pathOutput"],'w')
+    if dicoInit["pathOutput"].endswith(".json"): json.dump({ "sample":sampleID, "variants":lstResult },OUT,indent=1)
+    else:
+        OUT.write("#"+"\t".join(lstField)+"\n")
+        for dicoResult in lstResult: OUT.write("\t".join([str(dicoResult[field]) for field in lstField])+"\n")
+    OUT.close()
+    if not dicoInit["quiet"]:
+        printcolor("  find     : "+str(len(lstResult))+" variants in NiourK-db ("+dicoInit["varLayout"]+" layout)\n","1",dicoInit['green'],None,dicoInit['colorBool'])
+        printcolor("      in "+str(round((time.time()-startTime)*1000,1))+" ms\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+
+
+
+#***** Get region variants & coverage *****#
+# Variants from the nk_var chrom_pos index (covering samples from nk_varstat aggregates
+# when possible) and per-sample depth summary from the overlapping nk_depthseg segments
+def getRegion(dicoInit):
+    from tabulate import tabulate
+    if not dicoInit["quiet"]:
+        printcolor("\nSub-command: get-region\n","1",dicoInit['blue1'],None,dicoInit['colorBool'])
+        printcolor("  input    : "+os.path.basename(dicoInit["regionInput"])+"\n","1",dicoInit['blue2'],None,dicoInit['colorBool'])
+    dicoStat = dicoInit["regionStat"]
+    if dicoStat["malformed"]>0:
+        printcolor("      "+str(dicoStat["malformed"])+"/"+str(dicoStat["lines"])+" malformed BED lines skipped (line "+", ".join(map(str,dicoStat["lstMalformed"]))+("..." if dicoStat["malformed"]>len(dicoStat["lstMalformed"]) else "")+")\n","0",dicoInit['red'],None,dicoInit['colorBool'])
+    startTime = time.time()
+    lstResult = []
+    for chrom,start,end,name in tqdm(dicoInit["lstRegion"],ncols=30,leave=False,disable=dicoInit["quiet"] or len(dicoInit["lstRegion"])==1,bar_format="      {percentage:3.0f}%|{bar}|"):
+        lstResult.append({ "region":chrom+":"+str(start)+"-"+str(end), "name":name, "variants":regionVariants(dicoInit,chrom,start,end), "coverage":regionCoverage(dicoInit,chrom,start,end) })
+    # Write output
+    if dicoInit["pathOutput"].endswith(".json"):
+        OUT = open(dicoInit["pathOutput"],'w')
+        json.dump({ "mindepth":dicoInit["mindepth"], "regions":lstResult },OUT,indent=1)
+        OUT.close()
+    elif dicoInit["pathOutput"]!="":
+        OUT = open(dicoInit["pathOutput"],'w')
+        OUT.write("#region\tname\tvariant\toccurences\tcovering(depth>="+str(dicoInit["mindepth"])+")\tfreq\tcarriers\n")
+        for dicoRegion in lstResult:
+            for dicoResult in dicoRegion["variants"]:
+                OUT.write(dicoRegion["region"]+"\t"+dicoRegion["name"]+"\t"+dicoResult["variant"]+"\t"+str(dicoResult["occurences"])+"\t"+str(dicoResult["covering"])+"\t"+str(dicoResult["freq"])+"\t"+",".join(dicoResult["carriers"])+"\n")
+        OUT.close()
+        OUT = open(os.path.splitext(dicoInit["pathOutput"])[0]+".coverage.tsv",'w')
+        OUT.write("#region\tname\tsample\tmeandepth\tcovered(depth>="+str(dicoInit["mindepth"])+")%\n")
+        for dicoRegion in lstResult:
+            for sampleID,dicoDepth in dicoRegion["coverage"]["depth"].items():
+                OUT.write(dicoRegion["region"]+"\t"+dicoRegion["name"]+"\t"+sampleID+"\t"+str(dicoDepth["mean"])+"\t"+str(dicoDepth["covered"])+"\n")
+        OUT.close()
+    if not dicoInit["quiet"]:
+        nbVar = sum([len(dicoRegion["variants"]) for dicoRegion in lstResult])
+        printcolor("  find     : "+str(nbVar)+" variants in "+str(len(lstResult))+" regions\n","1",dicoInit['green'],None,dicoInit['colorBool'])
+        # Single region without output file: display tables
+        if dicoInit["pathOutput"]=="":
+            dicoRegion = lstResult[0]
+            printcolor("  DB depth : "+str(dicoRegion["coverage"]["samples"])+" samples, "+str(dicoRegion["coverage"]["covered"])+" fully covered","1",dicoInit['white'],None,dicoInit['colorBool'])
+            printcolor(" (depth>="+str(dicoInit["mindepth"])+")\n","0",dicoInit['white'],None,dicoInit['colorBool'])
+            table = [[dicoResult["variant"],dicoResult["occurences"],dicoResult["covering"],dicoResult["freq"]] for dicoResult in dicoRegion["variants"]]
+            for line in tabulate(table, ["variant","occurences","covering","freq"], tablefmt="fancy_grid").split("\n"):
+                printcolor("  "+line+"\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+            table = [[sampleID,dicoDepth["mean"],dicoDepth["covered"]] for sampleID,dicoDepth in dicoRegion["coverage"]["depth"].items()]
+            for line in tabulate(table, ["sample","mean depth","covered %"], tablefmt="fancy_grid").split("\n"):
+                printcolor("  "+line+"\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+        printcolor("      in "+str(round((time.time()-startTime)*1000,1))+" ms\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+
+#***** Variants of a region *****#
+# Return [{ variant, pos, occurences, covering, freq, carriers }] in coordinate order
+def regionVariants(dicoInit,chrom,start,end):
+    query = { "chrom":chrom, "pos":{"$gte":start,"$lte":end} }
+    lstVar = []
+    for findVar in dicoInit["collect_nk_var"].find(query,batch_size=dicoInit["nbChunk"]):
+        lstVar.append((findVar["pos"],findVar["_id"],[sampleID for sampleID,dicoVar in iterVarCalls(findVar)]))
+    lstVar.sort()
+    # Covering samples (precomputed aggregates then depth segments)
+    dicoCovering = {}
+    if dicoInit["mindepth"] in dicoInit["lstCovThreshold"]:
+        for findStat in dicoInit["collect_nk_varstat"].find(query,{"pos":1,"cov":1}): dicoCovering[findStat["pos"]] = findStat["cov"][str(dicoInit["mindepth"])]
+    lstPending = [pos for pos,varID,lstCarrier in lstVar if not pos in dicoCovering]
+    if lstPending: dicoCovering.update(coveringCounts(dicoInit,chrom,lstPending,dicoInit["mindepth"]))
+    # Same DB frequency as get-variant
+    lstResult = []
+    for pos,varID,lstCarrier in lstVar:
+        nbOverlapSample = 1+dicoCovering[pos]
+        lstResult.append({ "variant":varID, "pos":pos, "occurences":len(lstCarrier), "covering":nbOverlapSample, "freq":round(((len(lstCarrier)*100)/nbOverlapSample),1), "carriers":lstCarrier })
+    return lstResult
+
+#***** Depth summary of a region *****#
+# Mean depth & percentage of positions with depth>=mindepth for each sample with segments in the region
+# (a position covered by several segments of a sample, e.g. add-vcf single positions, counts once with the max depth)
+def regionCoverage(dicoInit,chrom,start,end):
+    length = end-start+1
+    dicoSegment = {} # { sample: [(start,end,depth)] } clipped to the region
+    for segment in dicoInit["collect_nk_depthseg"].find(depthWindowQuery(dicoInit,chrom,start,end),{"_id":0,"sample":1,"start":1,"end":1,"depth":1}):
+        segStart = max(start,segment["start"])
+        segEnd = min(end,segment["end"])
+        if segStart>segEnd: continue
+        if not segment["sample"] in dicoSegment: dicoSegment[segment["sample"]] = []
+        dicoSegment[segment["sample"]].append((segStart,segEnd,segment["depth"]))
+    dicoDepth = {}
+    nbCovered = 0
+    for sampleID in sorted(dicoSegment):
+        sumDepth,nbPosCovered = sampleRegionDepth(dicoSegment[sampleID],dicoInit["mindepth"])
+        dicoDepth[sampleID] = { "mean":round(sumDepth/length,1), "covered":round(min(nbPosCovered,length)*100/length,1) }
+        if nbPosCovered>=length: nbCovered+=1
+    return { "samples":len(dicoDepth), "covered":nbCovered, "depth":dicoDepth }
+
+#***** Depth sum & covered positions of overlapping segments *****#
+# Sweep over segment boundaries keeping the max depth of the active segments
+def sampleRegionDepth(lstSegment,mindepth):
+    lstSegment = sorted(lstSegment)
+    lstBound = sorted(set([segStart for segStart,segEnd,depth in lstSegment]+[segEnd+1 for segStart,segEnd,depth in lstSegment]))
+    lstActive = [] # heap of (-depth,end)
+    i = 0
+    sumDepth = 0
+    nbPosCovered = 0
+    for j in range(len(lstBound)-1):
+        boundStart,boundEnd = lstBound[j],lstBound[j+1]
+        while i<len(lstSegment) and lstSegment[i][0]<=boundStart:
+            heapq.heappush(lstActive,(-lstSegment[i][2],lstSegment[i][1]))
+            i+=1
+        while lstActive and lstActive[0][1]<boundStart: heapq.heappop(lstActive)
+        if not lstActive: continue
+        sumDepth+=-lstActive[0][0]*(boundEnd-boundStart)
+        if -lstActive[0][0]>=mindepth: nbPosCovered+=boundEnd-boundStart
+    return sumDepth,nbPosCovered
+
+
+
+#---------------------------------------------------------------#
+#---------------------------------------------------------------#
+#                  DELETE OBJECTS FROM DATABASE                 #
+#---------------------------------------------------------------#
+#---------------------------------------------------------------#
+# nk_samplevar document = variants written by one chunk of a sample load
+# { "_id":"vcf_runId_sample_12", "sample":"runId_sample", "kind":"vcf", "vars":["chr1_1000_A_G",...] }
+# (indexed by sample, so the nk_var documents of a sample are found without scanning nk_var;
+#  samples loaded before nk_samplevar fall back to a nk_var scan of field calls, and calls.sample
+#  index in array layout, both while a layout migration is not complete)
+
+#***** Sample variants operation for a written chunk *****#
+def sampleVarOp(dicoIngest,lstChunkVar,batchNum):
+    return pymongo.ReplaceOne({"_id":dicoIngest["_id"]+"_"+str(batchNum)},{ "sample":dicoIngest["sample"], "kind":dicoIngest["kind"], "vars":list(lstChunkVar) },upsert=True)
+
+#***** Variants of a sample *****#
+def sampleVariants(dicoInit,sampleID):
+    setVarId = set()
+    for findSampleVar in dicoInit["collect_nk_samplevar"].find({"sample":sampleID},{"_id":0,"vars":1}): setVarId.update(findSampleVar["vars"])
+    boolComplete = varLayoutComplete(dicoInit)
+    if (dicoInit["varLayout"]=="field" or not boolComplete) and len(setVarId)==0:
+        for findVar in dicoInit["collect_nk_var"].find({sampleID:{"$exists":True}},{"_id":1}): setVarId.add(findVar["_id"])
+    if dicoInit["varLayout"]=="array" or not boolComplete:
+        for findVar in dicoInit["collect_nk_var"].find({"calls.sample":sampleID},{"_id":1}): setVarId.add(findVar["_id"])
+    return sorted(setVarId)
+
+#***** Display deletion throughput *****#
+def reportDelete(dicoInit,nbDoc,label,startTime):
+    if dicoInit["quiet"]: return
+    elapsed = time.time()-startTime
+    printcolor("      "+str(nbDoc)+" "+label+" in "+str(round(elapsed,1))+"s ("+str(round(nbDoc/max(elapsed,0.001),1))+"/s)\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+
+#***** Delete sample depth *****#
+# Aggregates are decremented from the sample segments before deleting them
+# Return the number of write errors
+def delSampleDepth(dicoInit,sampleID):
+    nbError = 0
+    startTime = time.time()
+    if dicoInit["collect_nk_varstat"].estimated_document_count()>0:
+        # Single positions (add-vcf/add-nksample) then runs of the other segments
+        dicoPoint = {}
+        for findSeg in dicoInit["collect_nk_depthseg"].find({"sample":sampleID,"point":True},{"_id":0,"chrom":1,"start":1,"depth":1}):
+            if not findSeg["chrom"] in dicoPoint: dicoPoint[findSeg["chrom"]] = ([],{})
+            dicoPoint[findSeg["chrom"]][1][findSeg["start"]] = findSeg["depth"]
+        for chrom in dicoPoint: dicoPoint[chrom][0].extend(sorted(dicoPoint[chrom][1]))
+        lstOps = []
+        lstThreshold = dicoInit["lstCovThreshold"]
+        for chrom in dicoPoint:
+            for pos in dicoPoint[chrom][0]:
+                nbThreshold = bisect.bisect_right(lstThreshold,dicoPoint[chrom][1][pos])
+                if nbThreshold>0: lstOps.append(pymongo.UpdateMany({"chrom":chrom,"pos":pos},{"$inc":dict([("cov."+str(threshold),-1) for threshold in lstThreshold[:nbThreshold]])}))
+        lstRun = []
+        cursor = dicoInit["collect_nk_depthseg"].find({"sample":sampleID,"point":{"$exists":False}},{"_id":0,"chrom":1,"start":1,"end":1,"depth":1}).sort([("chrom",pymongo.ASCENDING),("start",pymongo.ASCENDING)])
+        segReader = ((findSeg["chrom"],findSeg["start"]-1,findSeg["end"],findSeg["depth"]) for findSeg in cursor)
+        nbBatch = 0
+        for interval in covThresholdRuns(dicoInit,segReader,lstRun):
+            if len(lstRun)>=dicoInit["nbChunk"]:
+                nbBatch+=1
+                nbError+=bulkWrite(dicoInit,dicoInit["collect_nk_varstat"],lstOps+varStatDepthOps(dicoInit,lstRun,dicoPoint,-1),nbBatch)
+                lstOps = []
+                del lstRun[:]
+        nbError+=bulkWrite(dicoInit,dicoInit["collect_nk_varstat"],lstOps+varStatDepthOps(dicoInit,lstRun,dicoPoint,-1),nbBatch+1)
+    deleteSeg = dicoInit["collect_nk_depthseg"].delete_many({"sample":sampleID})
+    reportDelete(dicoInit,deleteSeg.deleted_count,"depth segments deleted (nk_depthseg)",startTime)
+    # Per-base layout not migrated (no sample index, full scan)
+    if "nk_depth" in dicoInit["db"].list_collection_names():
+        startTime = time.time()
+        updateDepth = dicoInit["collect_nk_depth"].update_many({sampleID:{"$exists":True}},{"$unset":{sampleID:""}})
+        dicoInit["collect_nk_depth"].delete_many({"_id":{"$ne":"insertsample"},"$expr":{"$eq":[{"$size":{"$objectToArray":"$$ROOT"}},1]}})
+        dicoInit["collect_nk_depth"].update_one({"_id":"insertsample"},{"$pull":{"lstrunid":sampleID}})
+        reportDelete(dicoInit,updateDepth.modified_count,"per-base positions deleted (nk_depth, see `migrate-depth`)",startTime)
+    dicoInit["collect_nk_depthseg"].update_one({"_id":"insertsample"},{"$pull":{"lstrunid":sampleID}})
+    return nbError
+
+#***** Delete sample variants *****#
+# Sample fields are unset by chunks of variants, emptied documents are removed
+# and aggregates of the chunk positions recomputed
+# Return the number of write errors
+def delSampleVariants(dicoInit,sampleID):
+    nbError = 0
+    startTime = time.time()
+    lstVarId = sampleVariants(dicoInit,sampleID)
+    nbDeleted = 0
+    nbBatch = 0
+    for i in tqdm(range(0,len(lstVarId),dicoInit["nbChunk"]),ncols=30,leave=False,disable=dicoInit["quiet"],bar_format="      {percentage:3.0f}%|{bar}|"):
+        lstChunk = lstVarId[i:i+dicoInit["nbChunk"]]
+        nbBatch+=1
+        dicoInit["collect_nk_var"].update_many({"_id":{"$in":lstChunk}},varUnsetSample(sampleID))
+        queryEmpty = varEmptyQuery()
+        queryEmpty["_id"] = {"$in":lstChunk}
+        nbDeleted+=dicoInit["collect_nk_var"].delete_many(queryEmpty).deleted_count
+        nbError+=refreshVarStat(dicoInit,lstChunk,nbBatch)
+    reportDelete(dicoInit,len(lstVarId),"variant calls deleted (nk_var, "+str(nbDeleted)+" emptied variants removed)",startTime)
+    dicoInit["collect_nk_samplevar"].delete_many({"sample":sampleID})
+    return nbError
+
+#***** Delete sample data *****#
+# Depth first, so that recomputed aggregates of its variants no longer count it
+def delSampleData(dicoInit,sampleID,covStore):
+    from Nk_covstore import removeCovStoreSample
+    if not dicoInit["quiet"]: printcolor("  sampleId: "+sampleID+"\n","1",dicoInit['blue2'],None,dicoInit['colorBool'])
+    nbError = delSampleDepth(dicoInit,sampleID)
+    nbError+=delSampleVariants(dicoInit,sampleID)
+    dicoInit["collect_nk_ingest"].delete_many({"sample":sampleID})
+    if covStore and removeCovStoreSample(covStore,sampleID) and not dicoInit["quiet"]:
+        printcolor("      sample removed from depth store ("+str(len(covStore["meta"]["samples"]))+" samples).\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    return nbError
+
+#***** Del Sample *****#
+def delSample(dicoInit):
+    from Nk_covstore import openCovStore
+    if not dicoInit["quiet"]: printcolor("\nSub-command: del-sample\n","1",dicoInit['blue1'],None,dicoInit['colorBool'])
+    covStore = None
+    if dicoInit["pathCovStore"]!="": covStore = openCovStore(dicoInit["pathCovStore"])
+    nbError = delSampleData(dicoInit,dicoInit["runId"]+"_"+dicoInit["sampleName"],covStore)
+    if nbError>0: exit("\n"+str(nbError)+" aggregates writes failed (run `rebuild-aggregates`).\n")
+
+#***** Del Run *****#
+def delRun(dicoInit):
+    from Nk_covstore import openCovStore
+    if not dicoInit["quiet"]: printcolor("\nSub-command: del-run\n","1",dicoInit['blue1'],None,dicoInit['colorBool'])
+    covStore = None
+    if dicoInit["pathCovStore"]!="": covStore = openCovStore(dicoInit["pathCovStore"])
+    nbError = 0
+    startTime = time.time()
+    lstSampleID = [findSample["_id"] for findSample in dicoInit["collect_nk_sample"].find({"runid":dicoInit["runId"]},{"_id":1})]
+    for sampleID in lstSampleID: nbError+=delSampleData(dicoInit,sampleID,covStore)
+    dicoInit["collect_nk_sample"].delete_many({"runid":dicoInit["runId"]})
+    dicoInit["collect_nk_run"].delete_one({"_id":dicoInit["runId"]})
+    if not dicoInit["quiet"]: printcolor("  `"+dicoInit["runId"]+"` and its "+str(len(lstSampleID))+" samples deleted in "+str(round(time.time()-startTime,1))+"s (nk_run, nk_sample).\n","1",dicoInit['green'],None,dicoInit['colorBool'])
+    if nbError>0: exit("\n"+str(nbError)+" aggregates writes failed (run `rebuild-aggregates`).\n")
+
+
+
+#---------------------------------------------------------------#
+#---------------------------------------------------------------#
+#                            EXPORT                             #
+#---------------------------------------------------------------#
+#---------------------------------------------------------------#
+# Variants are streamed in coordinate order from the nk_var chrom_pos index (documents
+# without coordinates are completed by `migrate-varlayout`), only one chunk is kept in memory
+#  - .vcf.gz  : cohort VCF piped through bgzip then indexed with tabix
+#  - .parquet : one row per variant call, one row group per chunk (pyarrow)
+
+#***** Variants of a chromosome in coordinate order *****#
+# Generator of chunks of (pos,varId,{ sampleID: dicoVar })
+# (chunks end on a position change so that variants of a position are sorted by id)
+def exportChunks(dicoInit,chrom):
+    lstChunk = []
+    cursor = dicoInit["collect_nk_var"].find({"chrom":chrom},batch_size=dicoInit["nbChunk"]).sort([("pos",pymongo.ASCENDING)])
+    for findVar in cursor:
+        if len(lstChunk)>=dicoInit["nbChunk"] and findVar["pos"]!=lstChunk[-1][0]:
+            yield sorted(lstChunk,key=lambda call: (call[0],call[1]))
+            lstChunk = []
+        dicoSampleVar = dict(iterVarCalls(findVar))
+        if dicoSampleVar: lstChunk.append((findVar["pos"],findVar["_id"],dicoSampleVar))
+    if lstChunk: yield sorted(lstChunk,key=lambda call: (call[0],call[1]))
+
+#***** Calling results to a string *****#
+# { "gatkhc":"50", "tvc":"40" } => gatkhc|50,tvc|40
+def exportCallString(dicoCaller):
+    return ",".join([caller+"|"+str(dicoCaller[caller]) for caller in sorted(dicoCaller)])
+
+#***** VCF header *****#
+def exportVcfHeader(dicoInit,lstChrom,lstSampleID):
+    lstHeader = [ "##fileformat=VCFv4.2", "##source=NiourK-db" ]
+    for chrom in lstChrom:
+        if chrom in dicoChrSize: lstHeader.append("##contig=<ID="+chrom+",length="+str(dicoChrSize[chrom])+">")
+        else: lstHeader.append("##contig=<ID="+chrom+">")
+    lstHeader.append("##INFO=<ID=NS,Number=1,Type=Integer,Description=\"Number of samples carrying the variant\">")
+    lstHeader.append("##FORMAT=<ID=GT,Number=1,Type=String,Description=\"Genotype, not stored in NiourK-db: ./. for carriers (see AF & CALL), 0/0 covered non-carrier with --depth\">")
+    lstHeader.append("##FORMAT=<ID=AF,Number=1,Type=Float,Description=\"Allele frequency\">")
+    lstHeader.append("##FORMAT=<ID=CALL,Number=1,Type=String,Description=\"Calling callers (caller|quality,...)\">")
+    lstHeader.append("##FORMAT=<ID=FILT,Number=1,Type=String,Description=\"Filtering callers (caller|filter,...)\">")
+    if dicoInit["exportDepth"]: lstHeader.append("##FORMAT=<ID=DP,Number=1,Type=Integer,Description=\"Sample depth (NiourK-db depth segments)\">")
+    lstHeader.append("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t"+"\t".join(lstSampleID))
+    return "\n".join(lstHeader)+"\n"
+
+#***** VCF sample column *****#
+# Carrier genotype is missing (nk_var only stores the allele frequency)
+def exportVcfSample(dicoInit,dicoVar,depth):
+    if dicoVar==None:
+        if depth>0: lstValue = ["0/0",".",".","."]
+        else: lstValue = ["./.",".",".","."]
+    else: lstValue = [ "./.", str(dicoVar.get("af",".")), exportCallString(dicoVar.get("call",{})) or ".", exportCallString(dicoVar.get("filter",{})) or "." ]
+    if dicoInit["exportDepth"]: lstValue.append(str(depth) if depth>0 else ".")
+    return ":".join(lstValue)
+
+#***** EXPORT database *****#
+def exportDb(dicoInit):
+    if not dicoInit["quiet"]:
+        printcolor("\nSub-command: export\n","1",dicoInit['blue1'],None,dicoInit['colorBool'])
+        printcolor("  output: "+dicoInit["pathOutput"]+"\n","1",dicoInit['blue2'],None,dicoInit['colorBool'])
+    # Coordinate order requires the coordinates fields of every variant
+    if dicoInit["collect_nk_var"].find_one({"chrom":None},{"_id":1}):
+        exit("\nVariants without coordinates in nk_var, run `migrate-varlayout` before `export`.\n")
+    lstChrom = [chrom for chrom in dicoChrSize]
+    lstChrom.extend(sorted(set(dicoInit["collect_nk_var"].distinct("chrom"))-set(lstChrom)))
+    lstSampleID = sorted([findSample["_id"] for findSample in dicoInit["collect_nk_sample"].find({},{"_id":1})])
+    boolParquet = dicoInit["pathOutput"].endswith(".parquet")
+    startTime = time.time()
+    nbExport = 0
+    # Output writer
+    if boolParquet:
+        import pyarrow
+        import pyarrow.parquet
+        lstField = [ ("chrom",pyarrow.string()), ("pos",pyarrow.int64()), ("ref",pyarrow.string()), ("alt",pyarrow.string()), ("sample",pyarrow.string()), \
+                     ("af",pyarrow.float64()), ("callaf",pyarrow.float64()), ("call",pyarrow.string()), ("filter",pyarrow.string()), ("version",pyarrow.string()) ]
+        if dicoInit["exportDepth"]: lstField.append(("depth",pyarrow.int64()))
+        schema = pyarrow.schema(lstField)
+        parquetWriter = pyarrow.parquet.ParquetWriter(dicoInit["pathOutput"],schema,compression="zstd")
+    else:
+        OUT = open(dicoInit["pathOutput"],'wb')
+        process = subprocess.Popen(["bgzip","-c"],stdin=subprocess.PIPE,stdout=OUT)
+        process.stdin.write(exportVcfHeader(dicoInit,lstChrom,lstSampleID).encode())
+    # Stream chunks
+    for chrom in lstChrom:
+        for lstCall in tqdm(exportChunks(dicoInit,chrom),ncols=30,leave=False,disable=dicoInit["quiet"],bar_format="      "+chrom+" {n_fmt} chunks"):
+            dicoDepth = {}
+            if dicoInit["exportDepth"]: dicoDepth = coveringDepths(dicoInit,chrom,[pos for pos,varID,dicoSampleVar in lstCall],1)
+            if boolParquet:
+                dicoColumn = dict([(field,[]) for field,fieldType in lstField])
+                for pos,varID,dicoSampleVar in lstCall:
+                    splitVar = varID.split("_")
+                    for sampleID in sorted(dicoSampleVar):
+                        dicoVar = dicoSampleVar[sampleID]
+                        for field,value in [ ("chrom",chrom), ("pos",pos), ("ref",splitVar[2]), ("alt",splitVar[3]), ("sample",sampleID), ("af",dicoVar.get("af")), ("callaf",dicoVar.get("callaf")), \
+                                             ("call",exportCallString(dicoVar.get("call",{}))), ("filter",exportCallString(dicoVar.get("filter",{}))), ("version",str(dicoVar.get("nkversion",dicoVar.get("version",""))))]:
+                            dicoColumn[field].append(value)
+                        if dicoInit["exportDepth"]: dicoColumn["depth"].append(dicoDepth[pos].get(sampleID))
+                parquetWriter.write_table(pyarrow.Table.from_pydict(dicoColumn,schema=schema))
+            else:
+                lstLine = []
+                for pos,varID,dicoSampleVar in lstCall:
+                    splitVar = varID.split("_")
+                    dicoPos = dicoDepth.get(pos,{})
+                    lstSample = [exportVcfSample(dicoInit,dicoSampleVar.get(sampleID),dicoPos.get(sampleID,0)) for sampleID in lstSampleID]
+                    lstLine.append(chrom+"\t"+str(pos)+"\t.\t"+splitVar[2]+"\t"+splitVar[3]+"\t.\t.\tNS="+str(len(dicoSampleVar))+"\t"+"GT:AF:CALL:FILT"+(":DP" if dicoInit["exportDepth"] else "")+"\t"+"\t".join(lstSample)+"\n")
+                process.stdin.write("".join(lstLine).encode())
+            nbExport+=len(lstCall)
+    # Close output
+    if boolParquet: parquetWriter.close()
+    else:
+        process.stdin.close()
+        process.wait()
+        OUT.close()
+        if process.returncode!=0: exit("\nbgzip failed for `"+dicoInit["pathOutput"]+"`\n")
+        process = subprocess.Popen(["tabix","-f","-p","vcf",dicoInit["pathOutput"]],stdout=subprocess.PIPE,stderr=subprocess.PIPE)
+        out,err = process.communicate()
+        if process.returncode!=0: exit("\ntabix failed for `"+dicoInit["pathOutput"]+"`\n"+err.decode())
+    if not dicoInit["quiet"]:
+        elapsed = time.time()-startTime
+        printcolor("      "+str(nbExport)+" variants exported ("+str(len(lstSampleID))+" samples) in "+str(round(elapsed,1))+"s ("+str(round(nbExport/max(elapsed,0.001),1))+" variants/s)\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+
+
+
+#---------------------------------------------------------------#
+#---------------------------------------------------------------#
+#                        QUERY PROFILING                        #
+#---------------------------------------------------------------#
+#---------------------------------------------------------------#
+# `--profile` JSON = round trips & time by "collection.command" and query shapes
+# with their winning index (COLLSCAN => lookup without index)
+# { "subcommand":"add-vcf", "argv":[...], "elapsed":12.3, "roundtrips":420, "dbtime":10.1,
+#   "operations":{ "nk_var.update":{ "count":40, "time":8.2, "max":0.4, "errors":0 }, ... },
+#   "queries":[ { "collection":"nk_var", "command":"update", "shape":"{'_id': '?'}", "count":40, "time":8.2, "index":"_id_", "sort":false }, ... ] }
+
+#***** WRITE profile of the subcommand *****#
+# Folder => one `<subcommand>_<date>_<pid>.json` file per invocation
+def writeProfile(dicoInit):
+    from Nk_profile import dicoProfile,lockProfile
+    elapsed = time.time()-dicoInit["profileStart"]
+    # Winning plans (explain commands are not profiled)
+    with lockProfile: dicoProfile["active"] = False
+    lstQuery = []
+    for (collection,commandName,shape),(count,duration,example) in sorted(dicoProfile["queries"].items(),key=lambda item: -item[1][1]):
+        try: indexName,boolSort = explainIndex(dicoInit["db"][collection].find(example))
+        except Exception: indexName,boolSort = "unknown",False
+        lstQuery.append({ "collection":collection, "command":commandName, "shape":shape, "count":count, "time":round(duration,4), "index":indexName, "sort":boolSort })
+    dicoOperation = {}
+    for operation,(count,duration,maxDuration,nbError) in sorted(dicoProfile["operations"].items(),key=lambda item: -item[1][1]):
+        dicoOperation[operation] = { "count":count, "time":round(duration,4), "max":round(maxDuration,4), "errors":nbError }
+    dicoOut = { "subcommand":dicoInit["subCmd"], "argv":dicoInit["profileArgv"], "host":socket.gethostname(), "pid":os.getpid(), \
+                "started":datetime.datetime.fromtimestamp(dicoInit["profileStart"]).isoformat(), "elapsed":round(elapsed,4), \
+                "roundtrips":sum([dicoOperation[operation]["count"] for operation in dicoOperation]), \
+                "dbtime":round(sum([dicoOperation[operation]["time"] for operation in dicoOperation]),4), \
+                "operations":dicoOperation, "queries":lstQuery }
+    pathProfile = dicoInit["pathProfile"]
+    if os.path.isdir(pathProfile): pathProfile = os.path.join(pathProfile,dicoInit["subCmd"]+"_"+datetime.datetime.fromtimestamp(dicoInit["profileStart"]).strftime("%Y%m%d-%H%M%S")+"_"+str(os.getpid())+".json")
+    OUT = open(pathProfile,'w')
+    json.dump(dicoOut,OUT,indent=1)
+    OUT.close()
+    if not dicoInit["quiet"]:
+        nbScan = len([dicoQuery for dicoQuery in lstQuery if dicoQuery["index"]=="COLLSCAN"])
+        printcolor("\n  profile  : "+str(dicoOut["roundtrips"])+" round trips, "+str(dicoOut["dbtime"])+"s in database, "+str(nbScan)+" queries without index\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+        printcolor("      `"+pathProfile+"`\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+
+#***** PROFILE REPORT *****#
+# Summary of profiles by subcommand, slowest operations & queries without index
+def profileReport(dicoInit):
+    from tabulate import tabulate
+    if not dicoInit["quiet"]: printcolor("\nSub-command: profile-report\n","1",dicoInit['blue1'],None,dicoInit['colorBool'])
+    lstPath = [dicoInit["pathInput"]]
+    if os.path.isdir(dicoInit["pathInput"]): lstPath = [os.path.join(dicoInit["pathInput"],fileName) for fileName in sorted(os.listdir(dicoInit["pathInput"])) if fileName.endswith(".json")]
+    dicoSubCmd = {}    # { subcommand: [invocations, elapsed, roundtrips, dbtime] }
+    dicoOperation = {} # { (subcommand,operation): [count, time, max, errors] }
+    dicoScan = {}      # { (collection,command,shape): [count, time, set(subcommand), sort] }
+    for pathProfile in lstPath:
+        try:
+            JSON = open(pathProfile,'r')
+            dicoProfile = json.load(JSON)
+            JSON.close()
+            subCmd = dicoProfile["subcommand"]
+        except (ValueError,KeyError,TypeError):
+            if not dicoInit["quiet"]: printcolor("    skip `"+os.path.basename(pathProfile)+"` (not a profile)\n","0",dicoInit['red'],None,dicoInit['colorBool'])
+            continue
+        if not subCmd in dicoSubCmd: dicoSubCmd[subCmd] = [0,0.0,0,0.0]
+        for i,value in enumerate([1,dicoProfile["elapsed"],dicoProfile["roundtrips"],dicoProfile["dbtime"]]): dicoSubCmd[subCmd][i]+=value
+        for operation,dicoOp in dicoProfile["operations"].items():
+            key = (subCmd,operation)
+            if not key in dicoOperation: dicoOperation[key] = [0,0.0,0.0,0]
+            dicoOperation[key][0]+=dicoOp["count"]
+            dicoOperation[key][1]+=dicoOp["time"]
+            dicoOperation[key][2] = max(dicoOperation[key][2],dicoOp["max"])
+            dicoOperation[key][3]+=dicoOp["errors"]
+        for dicoQuery in dicoProfile["queries"]:
+            if dicoQuery["index"]!="COLLSCAN" and not dicoQuery["sort"]: continue
+            key = (dicoQuery["collection"],dicoQuery["command"],dicoQuery["shape"])
+            if not key in dicoScan: dicoScan[key] = [0,0.0,set(),dicoQuery["index"]]
+            dicoScan[key][0]+=dicoQuery["count"]
+            dicoScan[key][1]+=dicoQuery["time"]
+            dicoScan[key][2].add(subCmd)
+    # Tables
+    tableSubCmd = []
+    for subCmd,(nbRun,elapsed,nbTrip,dbTime) in sorted(dicoSubCmd.items(),key=lambda item: -item[1][1]):
+        tableSubCmd.append([subCmd,nbRun,round(elapsed/nbRun,2),round(nbTrip/nbRun,1),round(dbTime/nbRun,2),round(dbTime*100/max(elapsed,0.000001),1)])
+    tableOperation = []
+    for (subCmd,operation),(count,duration,maxDuration,nbError) in sorted(dicoOperation.items(),key=lambda item: -item[1][1])[:dicoInit["nbProfileRow"]]:
+        tableOperation.append([subCmd,operation,count,round(duration,2),round(duration*1000/count,2),round(maxDuration*1000,1),nbError])
+    tableScan = []
+    for (collection,commandName,shape),(count,duration,setSubCmd,indexName) in sorted(dicoScan.items(),key=lambda item: -item[1][1]):
+        if indexName=="COLLSCAN": plan = "COLLSCAN"
+        else: plan = indexName+" + in-memory sort"
+        if len(shape)>dicoInit["truncateWidth"][1]: shape = shape[0:dicoInit["truncateWidth"][1]-3]+"..."
+        tableScan.append([collection+"."+commandName,shape,plan,count,round(duration,2),",".join(sorted(setSubCmd))])
+    if not dicoInit["quiet"]:
+        printcolor("  "+str(sum([dicoSubCmd[subCmd][0] for subCmd in dicoSubCmd]))+" profiles\n\n","1",dicoInit['blue2'],None,dicoInit['colorBool'])
+        for title,header,table in [ ("SUBCOMMANDS (mean per invocation)",["subcommand","runs","elapsed (s)","round trips","db time (s)","db %"],tableSubCmd), \
+                                    ("SLOWEST OPERATIONS",["subcommand","operation","count","time (s)","mean (ms)","max (ms)","errors"],tableOperation), \
+                                    ("QUERIES WITHOUT INDEX",["operation","shape","plan","count","time (s)","subcommands"],tableScan) ]:
+            printcolor("  "+title+"\n","1",dicoInit['white'],None,dicoInit['colorBool'])
+            for line in tabulate(table, header, tablefmt="fancy_grid").split("\n"):
+                printcolor("  "+line+"\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+            printcolor("\n","0",dicoInit['grey1'],None,dicoInit['colorBool'])
+    if dicoInit["pathOutput"]!="":
+        OUT = open(dicoInit["pathOutput"],'w')
+        json.dump({ "subcommands":[dict(zip(["subcommand","runs","elapsed","roundtrips","dbtime","dbpercent"],row)) for row in tableSubCmd], \
+                    "operations":[dict(zip(["subcommand","operation","count","time","mean_ms","max_ms","errors"],row)) for row in tableOperation], \
+                    "unindexed":[ { "operation":collection+"."+commandName, "shape":shape, "index":indexName, "count":count, "time":round(duration,4), "subcommands":sorted(setSubCmd) } \
+                                  for (collection,commandName,shape),(count,duration,setSubCmd,indexName) in dicoScan.items() ] },OUT,indent=1)
+        OUT.close()
@@ -0,0 +1,129 @@
+#=====================================================
+# -*- coding: utf-8 -*-                              |
+# title           : Nk_profile.py                    |
+# description     : NiourK-DB query instrumentation  |
+# author          : dooguypapua                      |
+# copyright       : CHU Angers                       |
+# date            : 20201026                         |
+# version         : 0.1                              |
+# python_version  : 3.8.2                            |
+#=====================================================
+# Opt-in (`Nk_db.py <subcommand> --profile <file/folder>`) command monitoring:
+# every command sent to mongod (find, getMore, update, aggregate, ...) is one
+# round trip, counted and timed by "collection.command" and query shape
+#   operations = { "nk_var.update": [count, time, max, errors] }
+#   queries    = { (collection, command, shape): [count, time, example filter] }
+# (query time = time of the commands containing the shape, index plans of the
+#  shapes are resolved at the end of the subcommand with explain)
+#=====================================================
+import threading
+from pymongo import monitoring
+
+
+# Filters per write command used for query shapes (bulk commands contain up to nbChunk statements)
+nbShapeStatement = 5
+# Max list length kept in example filters
+nbExampleItem = 10
+
+# Profile of the current process
+dicoProfile = { "active":True, "operations":{}, "queries":{} }
+lockProfile = threading.Lock()
+# Started commands => (operation, [(collection,command,shape,example)])
+dicoPending = {}
+
+
+
+#***** Query shape *****#
+# Filter with values replaced by "?" (lists of filters are deduplicated)
+def queryShape(value):
+    if isinstance(value,dict): return dict([(key,queryShape(value[key])) for key in value])
+    if isinstance(value,(list,tuple)):
+        lstShape = []
+        for item in value:
+            if isinstance(item,dict) and not queryShape(item) in lstShape: lstShape.append(queryShape(item))
+        if len(lstShape)>0: return lstShape
+    return "?"
+
+#***** Example filter *****#
+# Filter with lists truncated to nbExampleItem (still valid for explain)
+def queryExample(value):
+    if isinstance(value,dict): return dict([(key,queryExample(value[key])) for key in value])
+    if isinstance(value,(list,tuple)): return [queryExample(item) for item in list(value)[:nbExampleItem]]
+    return value
+
+#***** Filters of a command *****#
+def commandFilters(commandName,command):
+    if commandName=="find": return [command.get("filter",{})]
+    if commandName in ["count","distinct"]: return [command.get("query",{})]
+    if commandName=="findAndModify": return [command.get("query",{})]
+    if commandName=="aggregate":
+        lstStage = command.get("pipeline",[])
+        if len(lstStage)>0 and "$match" in lstStage[0]: return [lstStage[0]["$match"]]
+    if commandName=="update": return [statement.get("q",{}) for statement in command.get("updates",[])[:nbShapeStatement]]
+    if commandName=="delete": return [statement.get("q",{}) for statement in command.get("deletes",[])[:nbShapeStatement]]
+    return []
+
+#***** Command listener *****#
+class QueryListener(monitoring.CommandListener):
+
+    def started(self,event):
+        if not dicoProfile["active"]: return
+        collection = event.command.get(event.command_name)
+        if event.command_name=="getMore": collection = event.command.get("collection")
+        if isinstance(collection,str): operation = collection+"."+event.command_name
+        else:
+            collection = ""
+            operation = event.command_name
+        lstQuery = []
+        for dicoFilter in commandFilters(event.command_name,event.command):
+            if len(dicoFilter)==0: continue # full scan on purpose
+            shape = repr(queryShape(dicoFilter))
+            if not shape in [query[2] for query in lstQuery]: lstQuery.append((collection,event.command_name,shape,queryExample(dicoFilter)))
+        with lockProfile: dicoPending[(event.connection_id,event.request_id)] = (operation,lstQuery)
+
+    def succeeded(self,event):
+        self.record(event,False)
+
+    def failed(self,event):
+        self.record(event,True)
+
+    def record(self,event,boolFailed):
+        duration = event.duration_micros/1000000
+        with lockProfile:
+            if not (event.connection_id,event.request_id) in dicoPending: return
+            operation,lstQuery = dicoPending.pop((event.connection_id,event.request_id))
+            if not operation in dicoProfile["operations"]: dicoProfile["operations"][operation] = [0,0.0,0.0,0]
+            dicoOperation = dicoProfile["operations"][operation]
+            dicoOperation[0]+=1
+            dicoOperation[1]+=duration
+            dicoOperation[2] = max(dicoOperation[2],duration)
+            if boolFailed: dicoOperation[3]+=1
+            for collection,commandName,shape,example in lstQuery:
+                key = (collection,commandName,shape)
+                if not key in dicoProfile["queries"]: dicoProfile["queries"][key] = [0,0.0,example]
+                dicoProfile["queries"][key][0]+=1
+                dicoProfile["queries"][key][1]+=duration
+
+#***** SNAPSHOT & RESET the process profile *****#
+# (add-batch workers send their profile with each job result)
+def takeProfile():
+    with lockProfile:
+        dicoSnapshot = { "operations":dicoProfile["operations"], "queries":dicoProfile["queries"] }
+        dicoProfile["operations"] = {}
+        dicoProfile["queries"] = {}
+    return dicoSnapshot
+
+#***** MERGE a worker profile *****#
+def mergeProfile(dicoSnapshot):
+    with lockProfile:
+        for operation,(count,duration,maxDuration,nbError) in dicoSnapshot["operations"].items():
+            if not operation in dicoProfile["operations"]: dicoProfile["operations"][operation] = [0,0.0,0.0,0]
+            dicoOperation = dicoProfile["operations"][operation]
+            dicoOperation[0]+=count
+            dicoOperation[1]+=duration
+            dicoOperation[2] = max(dicoOperation[2],maxDuration)
+            dicoOperation[3]+=nbError
+        for key,(count,duration,example) in dicoSnapshot["queries"].items():
+            if not key in dicoProfile["queries"]: dicoProfile["queries"][key] = [0,0.0,example]
+            dicoProfile["queries"][key][0]+=count
+            dicoProfile["queries"][key][1]+=duration